@@ -2,9 +2,29 @@
 Analysis dashboard. This is a graphical user interface (GUI) for user-friendly data analysis.
 Notes:
   This is the suggested way to setup a Dash app, not nested within a class.
+  With --workers, the app is served by gunicorn (see velazquez_lab/app/wsgi.py), otherwise by the Flask development server.
 """
 import argparse
-from velazquez_lab.app.main import build_app
+import os
+
+
+def run_gunicorn(host, port, workers, threads, timeout=120):
+  """Serve velazquez_lab.app.wsgi with gunicorn worker processes."""
+  from gunicorn.app.base import BaseApplication
+
+  class Server(BaseApplication):
+    def load_config(self):
+      self.cfg.set('bind', f"{host}:{port}")
+      self.cfg.set('workers', workers)
+      self.cfg.set('threads', threads)
+      self.cfg.set('timeout', timeout)
+
+    def load(self):
+      from velazquez_lab.app.wsgi import server
+      return server
+
+  os.environ.setdefault('VELAZQUEZ_JOB_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))  # Share the CPUs between the fit pools of all workers.
+  Server().run()
 
 
 def parse_args():
@@ -14,6 +34,8 @@ def parse_args():
   ap.add_argument('--host', default='127.0.0.1', help='Specify host')
   ap.add_argument('-p', '--port', default=8050, type=int, help='Specify application port')
   ap.add_argument('-t', '--theme', default='light', help='Specify light or dark theme')
+  ap.add_argument('-w', '--workers', default=0, type=int, help='Number of gunicorn worker processes (0: Flask development server)')
+  ap.add_argument('--threads', default=2, type=int, help='Number of threads per gunicorn worker')
   args = vars(ap.parse_args())
   return args
 
@@ -21,10 +43,16 @@ def parse_args():
 if __name__ == '__main__':
   """Run application.
   To run:
-    python app.py
-    python app.py -d
-    python app.py -t dark
+    python myapp.py
+    python myapp.py -d
+    python myapp.py -t dark
+    python myapp.py -w 4 --host 0.0.0.0
   """
   args = parse_args()
-  app = build_app(theme=args['theme'], jupyter=False)
-  app.run_server(debug=args['debug'], host=args['host'], port=args['port'])
+  if args['workers'] > 0:
+    os.environ['VELAZQUEZ_THEME'] = args['theme']
+    run_gunicorn(args['host'], args['port'], args['workers'], args['threads'])
+  else:
+    from velazquez_lab.app.build_app import build_app
+    app = build_app(theme=args['theme'], jupyter=False)
+    app.run_server(debug=args['debug'], host=args['host'], port=args['port'])
@@ -0,0 +1,54 @@
+"""Benchmark the on-disk column cache of velazquez_lab.utils.file_reading.
+Compares parsing an EC-Lab text export with loading it from the cache (memory-mapped), and reports hits and misses.
+To run:
+  python benchmark_column_cache.py
+  python benchmark_column_cache.py -n 5000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmark_file_reading import write_eclab_file
+from velazquez_lab.utils.file_reading import ColumnCache, load_columns, read_columns
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--nrows', default=1000000, type=int, help='Number of rows of the data file')
+  ap.add_argument('-r', '--repeat', default=5, type=int, help='Number of cached loads')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  tmp = tempfile.mkdtemp()
+  fname = os.path.join(tmp, 'cv.txt')
+  write_eclab_file(fname, args['nrows'])
+  cache = ColumnCache(directory=os.path.join(tmp, 'cache'))
+  usecols = [0, 1, 2]
+
+  t0 = time.perf_counter()
+  ref = read_columns(fname, usecols=usecols)
+  t_parse = time.perf_counter() - t0
+
+  t0 = time.perf_counter()
+  load_columns(fname, usecols=usecols, cache=cache)
+  t_miss = time.perf_counter() - t0
+
+  t_hit = np.inf
+  for _ in range(args['repeat']):
+    t0 = time.perf_counter()
+    cols = load_columns(fname, usecols=usecols, cache=cache)
+    total = sum(float(c.sum()) for c in cols.values())  # Touch the memory-mapped data.
+    t_hit = min(t_hit, time.perf_counter() - t0)
+  assert all(np.array_equal(ref[k], cols[k]) for k in ref)
+
+  info = cache.cache_info()
+  print(f"{args['nrows']} rows, {os.path.getsize(fname)/2**20:.1f} MB file, {info.nbytes/2**20:.1f} MB cached")
+  print(f"parse: {1e3*t_parse:.1f} ms   first load (parse + save): {1e3*t_miss:.1f} ms   cached load: {1e3*t_hit:.2f} ms   speedup: {t_parse/t_hit:.0f}x")
+  print(info)
@@ -0,0 +1,75 @@
+"""Benchmark reading EC-Lab text exports.
+Compares velazquez_lab.utils.file_reading.read_columns against the previous pd.read_table path.
+To run:
+  python benchmark_file_reading.py
+  python benchmark_file_reading.py -n 5000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from velazquez_lab.utils.file_reading import read_columns
+
+
+def write_eclab_file(fname, nrows, ncycles=10, seed=0):
+  """Write a synthetic EC-Lab CV export (tab separated, trailing tab, CRLF line endings)."""
+  rng = np.random.default_rng(seed)
+  df = pd.DataFrame({
+    'Ewe/V': rng.uniform(0, 0.3, nrows),
+    '<I>/mA': rng.normal(0, 1e-3, nrows),
+    'cycle number': np.repeat(np.arange(1, ncycles+1), -(-nrows//ncycles))[:nrows].astype(float),
+    '': '',
+  })
+  df.to_csv(fname, sep='\t', index=False, float_format='%.15E', lineterminator='\r\n')
+
+
+def time_it(func, nrepeat):
+  """Best wall time (in s) over nrepeat calls."""
+  best = np.inf
+  for _ in range(nrepeat):
+    t0 = time.perf_counter()
+    func()
+    best = min(best, time.perf_counter() - t0)
+  return best
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--nrows', default=1000000, type=int, help='Number of rows in the test file')
+  ap.add_argument('-r', '--repeat', default=3, type=int, help='Number of repetitions')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  with tempfile.TemporaryDirectory() as tmpdir:
+    fname = os.path.join(tmpdir, 'eclab.txt')
+    write_eclab_file(fname, args['nrows'])
+    print(f"{args['nrows']} rows, {os.path.getsize(fname)/1e6:.1f} MB")
+
+    def old_ecsa():
+      df = pd.read_table(fname, header=(0))
+      mask = (df.iloc[:, 2]==2)
+      return df[mask].iloc[:, 0].to_numpy(), df[mask].iloc[:, 1].to_numpy()
+
+    def new_ecsa():
+      e, i, c = read_columns(fname, usecols=[0, 1, 2]).values()
+      mask = (c==2)
+      return e[mask], i[mask]
+
+    def old_tafel():
+      return pd.read_table(fname, sep='\t', header=(0), usecols=[0, 1])
+
+    def new_tafel():
+      return read_columns(fname, usecols=[0, 1])
+
+    for name, old, new in (('ECSA', old_ecsa, new_ecsa), ('Tafel', old_tafel, new_tafel)):
+      t_old = time_it(old, args['repeat'])
+      t_new = time_it(new, args['repeat'])
+      print(f"{name:6s} pd.read_table: {t_old:.3f} s   read_columns: {t_new:.3f} s   speedup: {t_old/t_new:.2f}x")
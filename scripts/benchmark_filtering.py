@@ -0,0 +1,64 @@
+"""Benchmark Savitzky-Golay window optimization of many channels.
+Compares velazquez_lab.utils.filtering.optimize_window_many against the previous one-channel-at-a-time path.
+To run:
+  python benchmark_filtering.py
+  python benchmark_filtering.py -c 5000 -n 2000
+"""
+
+import argparse
+import time
+import numpy as np
+
+from velazquez_lab.utils.filtering import apply_filter, optimize_window_many
+
+
+def make_channels(nchannels, npoints, seed=0):
+  """Noisy sine waves with random frequencies and noise levels."""
+  rng = np.random.default_rng(seed)
+  t = np.linspace(0, 10, npoints)
+  freq = rng.uniform(0.5, 3, (nchannels, 1))
+  noise = rng.uniform(0.01, 0.3, (nchannels, 1))
+  return np.sin(freq*t) + noise*rng.standard_normal((nchannels, npoints))
+
+
+def optimize_window_loop(raw, polyorder=5):
+  """Previous optimize_window: repeated np.gradient, factorials and filtering for one channel."""
+  from scipy.special import factorial
+  pts = raw
+  for _ in range(polyorder+2):
+    pts = np.gradient(pts)
+  vn = np.sum(pts**2) / raw.size
+  val = (2 * (polyorder+2) * factorial(2*polyorder+3)**2 * np.std(raw)**2) / (factorial(polyorder+1)**2 * vn)
+  window_length = int(val ** (1/(2*polyorder+5)))
+  if window_length%2 == 0:
+    window_length += 1
+  return window_length, apply_filter(raw, window_length, polyorder)
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-c', '--nchannels', default=2000, type=int, help='Number of channels')
+  ap.add_argument('-n', '--npoints', default=5000, type=int, help='Number of points per channel')
+  ap.add_argument('-p', '--polyorder', default=5, type=int, help='Order of the filter polynomial')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  raw = make_channels(args['nchannels'], args['npoints'])
+
+  t0 = time.perf_counter()
+  old = [optimize_window_loop(x, args['polyorder']) for x in raw]
+  t_old = time.perf_counter() - t0
+
+  t0 = time.perf_counter()
+  windows, filt = optimize_window_many(raw, args['polyorder'])
+  t_new = time.perf_counter() - t0
+
+  old_windows = np.array([w for w, _ in old])
+  same = old_windows == windows
+  print(f"{args['nchannels']} channels of {args['npoints']} points, {np.unique(windows).size} distinct windows")
+  print(f"loop: {t_old:.3f} s   optimize_window_many: {t_new:.3f} s   speedup: {t_old/t_new:.1f}x   same windows: {same.mean():.1%}")
+  assert np.allclose(np.array([f for _, f in old])[same], filt[same])
@@ -0,0 +1,54 @@
+"""Benchmark gas mixing and correction factors for a mass flow controller log.
+Compares velazquez_lab.utils.gas.mix_gases_many against mix_gases and gas_corr_factor with ufloat flow rates, one sample at a time.
+The per-sample path is timed on a subset of the log.
+To run:
+  python benchmark_gas.py
+  python benchmark_gas.py -n 10000000 -l 5000
+"""
+
+import argparse
+import time
+import warnings
+import numpy as np
+import uncertainties as un
+
+from velazquez_lab.utils import gas
+from velazquez_lab.utils.uarray import UArray
+
+
+def make_log(nsamples, seed=0):
+  """Flow rates (in sccm) of a check gas, CO2 and N2 inputs, with 1% + 0.1 sccm errors."""
+  rng = np.random.default_rng(seed)
+  rates = np.column_stack([rng.uniform(1, 5, nsamples), rng.uniform(10, 30, nsamples), rng.uniform(0, 2, nsamples)])
+  return ['check_5', 'CO2', 'N2'], rates, 0.01*rates + 0.1
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--nsamples', default=1000000, type=int, help='Number of samples in the log')
+  ap.add_argument('-l', '--nloop', default=2000, type=int, help='Number of samples run through the per-sample ufloat path')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  names, rates, rates_err = make_log(args['nsamples'])
+
+  t0 = time.perf_counter()
+  res = gas.mix_gases_many(names, UArray(rates, rates_err))
+  t_new = time.perf_counter() - t0
+
+  nloop = min(args['nloop'], args['nsamples'])
+  t0 = time.perf_counter()
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore')  # ufloat(0, 0) in mix_gases.
+    corrs = [gas.gas_corr_factor(gas.mix_gases(names, [un.ufloat(r, e) for r, e in zip(rates[k], rates_err[k])])) for k in range(nloop)]
+  t_old = (time.perf_counter() - t0) * args['nsamples'] / nloop
+
+  print(f"{args['nsamples']} samples")
+  print(f"ufloat loop: {t_old:.1f} s (extrapolated from {nloop})   mix_gases_many: {t_new:.3f} s   speedup: {t_old/t_new:.0f}x")
+  assert np.allclose([c.n for c in corrs], res.corr.n[:nloop])
+  assert np.allclose([c.s for c in corrs], res.corr.s[:nloop])
+  print('correction factors and errors agree')
@@ -0,0 +1,66 @@
+"""Benchmark the start-up time of the Dash app.
+Runs `python -X importtime` in a fresh interpreter and reports the slowest imports, then times build_app and the first page build.
+To run:
+  python benchmark_import_time.py
+  python benchmark_import_time.py -m velazquez_lab.app.build_app -t 20
+"""
+
+import argparse
+import subprocess
+import sys
+
+
+def import_times(module):
+  """Cumulative import time of each module when importing module in a new interpreter.
+  Returns:
+    list: (cumulative time (in s), self time (in s), module name), slowest first.
+  """
+  proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], capture_output=True, text=True, check=True)
+  times = []
+  for line in proc.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    self_us, cumul_us, name = line[len('import time:'):].split('|')
+    times.append((int(cumul_us)/1e6, int(self_us)/1e6, name.strip()))
+  return sorted(times, reverse=True)
+
+
+def startup_times():
+  """Time (in s) of importing, building the app and serving the first layout, in a new interpreter."""
+  code = '\n'.join([
+    "import time",
+    "t0 = time.perf_counter()",
+    "from velazquez_lab.app.build_app import build_app",
+    "t1 = time.perf_counter()",
+    "app = build_app()",
+    "t2 = time.perf_counter()",
+    "app.layout() if callable(app.layout) else app.layout",
+    "t3 = time.perf_counter()",
+    "print(t1 - t0, t2 - t1, t3 - t2)",
+  ])
+  proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+  return [float(t) for t in proc.stdout.split()]
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-m', '--module', default='velazquez_lab.app.build_app', help='Module to import')
+  ap.add_argument('-t', '--top', default=15, type=int, help='Number of slowest imports to show')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  times = import_times(args['module'])
+  print(f"{'cumulative (ms)':>15s} {'self (ms)':>10s}  module")
+  for cumul, own, name in times[:args['top']]:
+    print(f"{1e3*cumul:15.1f} {1e3*own:10.1f}  {name}")
+
+  loaded = {name for _, _, name in times}
+  heavy = [m for m in ('lmfit', 'scipy', 'matplotlib', 'openpyxl', 'jupyter_dash') if m in loaded]
+  print(f"\nHeavy modules imported at start-up: {', '.join(heavy) if heavy else 'none'}")
+
+  t_import, t_build, t_layout = startup_times()
+  print(f"import: {1e3*t_import:.0f} ms, build_app: {1e3*t_build:.0f} ms, first layout: {1e3*t_layout:.0f} ms")
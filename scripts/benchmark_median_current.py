@@ -0,0 +1,73 @@
+"""Benchmark the current statistics of GC intervals on a long chronopotentiometry trace.
+Compares velazquez_lab.pol.co2_red.interval_currents against the previous get_median_current, which built a mask
+over the whole trace for every interval, and times the charge of every interval (co2_red.interval_charges).
+To run:
+  python benchmark_median_current.py
+  python benchmark_median_current.py -n 100000000 -k 100
+"""
+
+import argparse
+import time
+import numpy as np
+
+from velazquez_lab.pol.co2_red import cumulative_charge, interval_charges, interval_currents
+
+
+def make_trace(nsamples, duration, seed=0):
+  """Times (in s) and noisy, slowly decaying currents (in mA)."""
+  rng = np.random.default_rng(seed)
+  t = np.linspace(0, duration, nsamples) + 1e3
+  return t, -20 + 2*np.exp(-t/duration) + 0.5*rng.standard_normal(nsamples)
+
+
+def get_median_current_loop(t, i, intervals):
+  """Previous get_median_current: one mask over the trace per interval."""
+  median_current = []
+  t = t - min(t)
+  intervals = np.asarray(intervals)
+  for idx, imax in enumerate(intervals):
+    imin = 0 if idx == 0 else intervals[idx - 1]
+    mask = (t>=imin) & (t<imax)
+    median_current.append(np.median(i[mask]))
+  return np.array(median_current)
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--nsamples', default=10000000, type=int, help='Number of samples in the trace')
+  ap.add_argument('-k', '--nintervals', default=48, type=int, help='Number of GC intervals')
+  ap.add_argument('-d', '--duration', default=4*3600, type=float, help='Duration of the trace (in s)')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  t, i = make_trace(args['nsamples'], args['duration'])
+  intervals = np.linspace(0, args['duration'], args['nintervals']+1)[1:]
+
+  t0 = time.perf_counter()
+  old = get_median_current_loop(t, i, intervals)
+  t_old = time.perf_counter() - t0
+
+  t0 = time.perf_counter()
+  res = interval_currents(t, i, intervals)
+  t_new = time.perf_counter() - t0
+
+  t0 = time.perf_counter()
+  full = interval_currents(t, i, intervals, percentiles=[5, 95], mean=True, charge=True)
+  t_full = time.perf_counter() - t0
+
+  t0 = time.perf_counter()
+  charges = interval_charges(t, i, intervals)
+  t_charge = time.perf_counter() - t0
+
+  print(f"{args['nsamples']} samples, {args['nintervals']} intervals")
+  print(f"mask loop: {t_old:.3f} s   interval_currents: {t_new:.3f} s   speedup: {t_old/t_new:.1f}x")
+  print(f"with percentiles, means and charges: {t_full:.3f} s   interval_charges: {t_charge:.3f} s")
+  assert np.allclose(old, res.median, equal_nan=True)
+  assert np.allclose(old, full.median, equal_nan=True)
+  print('medians agree')
+  assert np.isclose(charges.sum(), cumulative_charge(t, i)[-1])
+  print('interval charges add up to the charge passed')
@@ -0,0 +1,68 @@
+"""Benchmark memoized analysis functions.
+Times the first call (computed and cached) and a repeated call (hashing the arguments and a cache hit) of the ECSA, specific capacitance
+and Tafel analyses, as when a user refits with the same parameters or a batch revisits a sample.
+To run:
+  python benchmark_memoize.py
+  python benchmark_memoize.py -n 200000 -s 5
+"""
+
+import argparse
+import time
+import numpy as np
+
+from benchmark_specific_cap import make_cv
+from velazquez_lab.pol import ecsa, specific_cap, tafel_slope
+from velazquez_lab.utils.memoize import RESULTS
+
+
+def make_pol(npoints, seed=0):
+  """Synthetic polarization curve with a Tafel region."""
+  rng = np.random.default_rng(seed)
+  e = np.linspace(-0.8, -1.6, npoints)
+  log_i = np.minimum(-(e+0.8)/0.12, 3) + rng.normal(0, 0.01, npoints)
+  return e, log_i
+
+
+def time_call(func, *args, **kwargs):
+  """Wall time (in s) of one call."""
+  t0 = time.perf_counter()
+  func(*args, **kwargs)
+  return time.perf_counter() - t0
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--npoints', default=100000, type=int, help='Number of points per scan and per polarization curve')
+  ap.add_argument('-s', '--nscans', default=4, type=int, help='Number of ECSA scans')
+  ap.add_argument('-w', '--width', default=2000, type=int, help='Width of the Tafel window search')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  loops = [make_cv(args['npoints'], seed) for seed in range(args['nscans'])]
+  potentials = [e for e, _ in loops]
+  currents = [i for _, i in loops]
+  scan_rates = 10.0 * (1 + np.arange(args['nscans']))
+  e, log_i = make_pol(args['npoints'])
+
+  calls = [
+    ('calculate_ecsa_contours', ecsa.calculate_ecsa_contours, (potentials, currents, scan_rates, np.linspace(0.08, 0.12, 5)), {}),
+    ('calculate_specific_cap', specific_cap.calculate_specific_cap, (potentials, currents, scan_rates), {'mass': 1e-3}),
+    ('fit_tafel_slope_lsq', tafel_slope.fit_tafel_slope_lsq, (e, log_i), {}),
+    ('find_tafel_windows', tafel_slope.find_tafel_windows, (e, log_i), {'width': args['width']}),
+  ]
+  print(f"{'function':>24s} {'first (ms)':>11s} {'repeat (ms)':>12s} {'speedup':>8s}")
+  for name, func, fargs, kwargs in calls:
+    t_first = time_call(func, *fargs, **kwargs)
+    t_repeat = time_call(func, *fargs, **kwargs)
+    print(f"{name:>24s} {1e3*t_first:11.2f} {1e3*t_repeat:12.2f} {t_first/t_repeat:7.1f}x")
+    info = func.cache_info()
+    assert (info.hits, info.misses, info.entries) == (1, 1, 1), info
+
+  """Different data or parameters must miss."""
+  tafel_slope.fit_tafel_slope_lsq(e, log_i + 1e-9)
+  assert tafel_slope.fit_tafel_slope_lsq.cache_info().misses == 2
+  print(RESULTS.cache_info())
@@ -0,0 +1,49 @@
+"""Benchmark CV loop areas for specific capacitance.
+Compares velazquez_lab.pol.specific_cap.loop_areas against the previous shapely Polygon path.
+To run:
+  python benchmark_specific_cap.py
+  python benchmark_specific_cap.py -n 1000000 -s 5
+"""
+
+import argparse
+import time
+import numpy as np
+
+from velazquez_lab.pol.specific_cap import loop_areas
+
+
+def make_cv(npoints, seed=0):
+  """Synthetic CV loop: a triangular potential sweep with a capacitive current and noise."""
+  rng = np.random.default_rng(seed)
+  e = 0.15 - 0.1*np.abs(np.linspace(-1, 1, npoints))
+  i = 1e-3*np.sign(np.linspace(-1, 1, npoints)) + rng.normal(0, 1e-5, npoints)
+  return e, i
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--npoints', default=1000000, type=int, help='Number of points per loop')
+  ap.add_argument('-s', '--nscans', default=1, type=int, help='Number of loops')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  from shapely.geometry import Polygon
+
+  args = parse_args()
+  loops = [make_cv(args['npoints'], seed) for seed in range(args['nscans'])]
+  potentials = [e for e, _ in loops]
+  currents = [i for _, i in loops]
+
+  t0 = time.perf_counter()
+  old = np.array([Polygon(zip(e, i)).area for e, i in loops])
+  t_old = time.perf_counter() - t0
+
+  t0 = time.perf_counter()
+  new = loop_areas(potentials, currents)
+  t_new = time.perf_counter() - t0
+
+  print(f"{args['nscans']} loop(s) of {args['npoints']} points")
+  print(f"shapely: {t_old:.3f} s   loop_areas: {t_new:.3f} s   speedup: {t_old/t_new:.1f}x   max rel. diff: {np.max(np.abs(new/old-1)):.2e}")
@@ -0,0 +1,57 @@
+"""Benchmark the streaming Savitzky-Golay filter on a simulated live current feed.
+Feeds a chronoamperometry-like trace to velazquez_lab.utils.filtering.StreamingSavgolFilter in chunks,
+checks the output against scipy.signal.savgol_filter on the whole trace, and reports the processing time per chunk.
+To run:
+  python benchmark_streaming_filter.py
+  python benchmark_streaming_filter.py -n 10000000 -c 1000 -w 201 -p 3
+"""
+
+import argparse
+import time
+import numpy as np
+
+from velazquez_lab.utils.filtering import StreamingSavgolFilter, apply_filter
+
+
+def make_trace(npoints, seed=0):
+  """Decaying current with noise and slow drift."""
+  rng = np.random.default_rng(seed)
+  t = np.arange(npoints) * 0.01
+  return -1 - np.exp(-t/50) + 1e-3*np.cumsum(rng.standard_normal(npoints)) + 0.01*rng.standard_normal(npoints)
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--npoints', default=1000000, type=int, help='Number of samples')
+  ap.add_argument('-c', '--chunksize', default=100, type=int, help='Number of samples per chunk')
+  ap.add_argument('-w', '--window', default=51, type=int, help='Filter window length')
+  ap.add_argument('-p', '--polyorder', default=3, type=int, help='Order of the filter polynomial')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  raw = make_trace(args['npoints'])
+  filt = StreamingSavgolFilter(args['window'], args['polyorder'])
+
+  out, times = [], []
+  for start in range(0, raw.size, args['chunksize']):
+    t0 = time.perf_counter()
+    out.append(filt.update(raw[start:start+args['chunksize']]))
+    times.append(time.perf_counter() - t0)
+  out.append(filt.flush())
+  streamed = np.concatenate(out)
+  times = np.array(times)
+
+  t0 = time.perf_counter()
+  ref = apply_filter(raw, args['window'], args['polyorder'])
+  t_ref = time.perf_counter() - t0
+
+  err = np.abs(streamed - ref).max()
+  print(f"{args['npoints']} samples in chunks of {args['chunksize']}, window {args['window']}, latency {filt.latency} samples")
+  print(f"stream: {times.sum():.3f} s ({1e6*np.median(times):.1f} us/chunk median, {1e6*np.percentile(times, 99):.1f} us p99)   savgol_filter: {t_ref:.3f} s")
+  print(f"max abs. difference: {err:.2e}")
+  assert streamed.shape == ref.shape
+  assert err < 1e-9 * np.abs(ref).max(), err
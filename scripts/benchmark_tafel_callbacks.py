@@ -0,0 +1,152 @@
+"""Benchmark round trips of the Tafel section of the Dash app.
+Replays user events (upload, pH change, fit preview, zoom, fit range change, fit) against the Flask test client, following the chain of server callbacks the browser would trigger.
+The fit runs as a background job, its latency includes polling until the result arrives.
+Clientside callbacks run in the browser and are not counted.
+To run:
+  python benchmark_tafel_callbacks.py
+  python benchmark_tafel_callbacks.py -n 100000 -r 5
+"""
+
+import argparse
+import base64
+import json
+import time
+import numpy as np
+import pandas as pd
+import plotly
+
+from velazquez_lab.app.build_app import build_app
+
+
+def make_upload(npoints, seed=0):
+  """dcc.Upload contents of a synthetic polarization curve."""
+  rng = np.random.default_rng(seed)
+  e = np.linspace(-0.2, -1.2, npoints)
+  i = -10**(-3 - (e + 0.2)/0.12) * (1 + rng.normal(0, 0.01, npoints))
+  txt = pd.DataFrame({'Ewe/V': e, '<I>/mA': i}).to_csv(sep='\t', index=False)
+  return 'data:text/plain;base64,' + base64.b64encode(txt.encode()).decode()
+
+
+def parse_outputs(key):
+  """(id, property) pairs of a callback_map key."""
+  specs = key[2:-2].split('...') if key.startswith('..') else [key]
+  return [tuple(s.rsplit('.', 1)) for s in specs]
+
+
+def initial_props(app):
+  """Property values of all components in the layout served on the first request."""
+  props = dict()
+  layout = app.layout() if callable(app.layout) else app.layout
+  for comp in layout._traverse():
+    cid = getattr(comp, 'id', None)
+    if cid is not None:
+      for prop in comp._prop_names:
+        props[(cid, prop)] = getattr(comp, prop, None)
+  return props
+
+
+class Session:
+  """Browser stand-in: holds component properties and fires dependent server callbacks."""
+
+  def __init__(self, app):
+    self.app = app
+    app.server.config['PROPAGATE_EXCEPTIONS'] = True  # Raise callback errors instead of returning 500.
+    self.client = app.server.test_client()
+    self.props = initial_props(app)
+    self.callbacks = [(key, parse_outputs(key), cb) for key, cb in app.callback_map.items() if 'callback' in cb]  # Skip clientside callbacks.
+
+  def event(self, changes):
+    """Apply property changes and run the triggered callback chain.
+    Returns:
+      int: number of requests
+      int: bytes sent and received
+      float: wall time (in s)
+    """
+    nreq, nbytes = 0, 0
+    t0 = time.perf_counter()
+    self.props.update(changes)
+    changed = set(changes)
+    while changed:
+      fired = [c for c in self.callbacks if any((i['id'], i['property']) in changed for i in c[2]['inputs'])]
+      changed_ids = [f"{cid}.{prop}" for cid, prop in changed]
+      changed = set()
+      for key, outputs, cb in fired:
+        body = json.dumps({
+          'output': key,
+          'outputs': [{'id': i, 'property': p} for i, p in outputs] if key.startswith('..') else {'id': outputs[0][0], 'property': outputs[0][1]},
+          'inputs': [dict(i, value=self.props.get((i['id'], i['property']))) for i in cb['inputs']],
+          'state': [dict(s, value=self.props.get((s['id'], s['property']))) for s in cb['state']],
+          'changedPropIds': changed_ids,
+        }, cls=plotly.utils.PlotlyJSONEncoder)
+        status, data = self._post(body)
+        nreq += 1
+        nbytes += len(body) + len(data)
+        if status == 204:  # PreventUpdate
+          continue
+        if status != 200:
+          raise RuntimeError(data.decode()[-2000:])
+        for cid, vals in json.loads(data)['response'].items():
+          for prop, val in vals.items():
+            if self.props.get((cid, prop)) != val:
+              self.props[(cid, prop)] = val
+              if (cid, prop) not in outputs or all((i['id'], i['property']) != (cid, prop) for i in cb['inputs']):
+                changed.add((cid, prop))
+    return nreq, nbytes, time.perf_counter() - t0
+
+  def _post(self, body):
+    """Send a callback request. Returns the status code and the response body."""
+    resp = self.client.post('/_dash-update-component', data=body, content_type='application/json')
+    return resp.status_code, resp.data
+
+  def poll(self, name, interval=0.05):
+    """Tick the dcc.Interval of a background job until the job is finished.
+    Returns:
+      int: number of requests
+      int: bytes sent and received
+      float: wall time (in s)
+    """
+    nreq, nbytes = 0, 0
+    t0 = time.perf_counter()
+    while self.props.get((f"{name}-job-storage", 'data')):
+      time.sleep(interval)
+      n = (self.props.get((f"{name}-job-interval", 'n_intervals')) or 0) + 1
+      r = self.event({(f"{name}-job-interval", 'n_intervals'): n})
+      nreq, nbytes = nreq + r[0], nbytes + r[1]
+    return nreq, nbytes, time.perf_counter() - t0
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--npoints', default=100000, type=int, help='Number of points in the polarization curve')
+  ap.add_argument('-r', '--repeat', default=3, type=int, help='Number of repetitions of each event')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  app = build_app()
+  session = Session(app)
+  contents = [make_upload(args['npoints'], seed=k) for k in range(args['repeat'])]
+
+  events = [
+    ('upload', lambda k: {('tafel-upload', 'contents'): contents[k], ('tafel-upload', 'filename'): f"pol{k}.txt"}),
+    ('pH change', lambda k: {('tafel-ph-input', 'value'): 7 + 0.1*k}),
+    ('Ru change', lambda k: {('tafel-ru-input', 'value'): 1 + k}),
+    ('preview on', lambda k: {('tafel-preview-toggle', 'value'): ['preview'] if k%2 == 0 else []}),
+    ('zoom', lambda k: {('tafel-graph', 'relayoutData'): {'xaxis.range[0]': session.props[('tafel-logimin-input', 'value')] + 0.1*k, 'xaxis.range[1]': session.props[('tafel-logimin-input', 'value')] + 1}}),
+    ('range change', lambda k: {('tafel-emin-input', 'value'): session.props[('tafel-emin-input', 'value')] + 0.001}),
+    ('fit', lambda k: {('tafel-run-btn', 'n_clicks'): k + 1}),
+  ]
+  print(f"{args['npoints']} points")
+  print(f"{'event':14s} {'requests':>8s} {'payload (MB)':>13s} {'latency (ms)':>13s}")
+  for name, changes in events:
+    results = []
+    for k in range(args['repeat']):
+      nreq, nbytes, dt = session.event(changes(k))
+      polled = session.poll('tafel')
+      results.append((nreq + polled[0], nbytes + polled[1], dt + polled[2]))
+    nreq, nbytes, _ = max(results, key=lambda r: r[1])
+    best = min(r[2] for r in results)
+    print(f"{name:14s} {nreq:8d} {nbytes/1e6:13.3f} {1e3*best:13.1f}")
@@ -0,0 +1,52 @@
+"""Benchmark error propagation with velazquez_lab.utils.uarray.UArray against uncertainties.unumpy.
+Times the two array paths of the package: the confidence band of a linear fit (m*x + b), and the conversion of
+GC peak areas to concentrations with a calibration line ((area - b)/m). Checks both give the same values and errors.
+To run:
+  python benchmark_uarray.py
+  python benchmark_uarray.py -n 1000000
+"""
+
+import argparse
+import time
+import numpy as np
+import uncertainties as un
+from uncertainties import unumpy as unp
+
+from velazquez_lab.utils.uarray import UArray
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--npoints', default=100000, type=int, help='Number of points')
+  args = vars(ap.parse_args())
+  return args
+
+
+def timed(func):
+  """Result of func() and the time it took, in s."""
+  t0 = time.perf_counter()
+  res = func()
+  return res, time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  rng = np.random.default_rng(0)
+  m, b = un.ufloat(2.5, 0.1), un.ufloat(-0.3, 0.05)
+  x = np.linspace(0, 10, args['npoints'])
+  area = rng.uniform(1e3, 1e5, args['npoints'])
+
+  m_u, b_u = UArray.from_ufloats(m), UArray.from_ufloats(b)
+  cases = {
+    'fit band m*x + b': (lambda: m*x + b, lambda: m_u*x + b_u),
+    'calibration (area - b)/m': (lambda: (unp.uarray(area, 0) - b)/m, lambda: (UArray(area) - b_u)/m_u),
+  }
+  print(f"{args['npoints']} points")
+  for name, (func_old, func_new) in cases.items():
+    old, t_old = timed(func_old)
+    new, t_new = timed(func_new)
+    print(f"{name}: unumpy {t_old:.3f} s   UArray {t_new*1e3:.2f} ms   speedup: {t_old/t_new:.0f}x")
+    assert np.allclose(unp.nominal_values(old), new.n)
+    assert np.allclose(unp.std_devs(old), new.s)
+  print('values and errors agree')
@@ -0,0 +1,101 @@
+"""Peak memory of uploading a large data file to the Dash app.
+Compares parsing a dcc.Upload payload (base64 contents) with the chunked upload route, using tracemalloc.
+The chunked upload must stay within twice the size of the parsed arrays plus a few chunks, whatever the file size.
+To run:
+  python benchmark_upload_memory.py
+  python benchmark_upload_memory.py -n 5000000
+"""
+
+import argparse
+import base64
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+import numpy as np
+import pandas as pd
+
+from velazquez_lab.app import chunked_upload
+from velazquez_lab.app.build_app import build_app
+from velazquez_lab.app.dataset_cache import DATASETS
+from velazquez_lab.utils.file_reading import parse_dash_file, read_columns
+
+
+def make_file(path, nrows, seed=0):
+  """Chronoamperometry-like tab separated file with time, potential and current columns."""
+  rng = np.random.default_rng(seed)
+  t = np.arange(nrows) * 0.01
+  df = pd.DataFrame({'time/s': t, 'Ewe/V': np.full(nrows, -0.8), '<I>/mA': -1 + 0.01*rng.standard_normal(nrows)})
+  df.to_csv(path, sep='\t', index=False, float_format='%.9e')
+
+
+def measure(func):
+  """Peak traced memory (in bytes) and wall time (in s) of func()."""
+  tracemalloc.reset_peak()
+  base = tracemalloc.get_traced_memory()[0]
+  t0 = time.perf_counter()
+  result = func()
+  dt = time.perf_counter() - t0
+  return result, tracemalloc.get_traced_memory()[1] - base, dt
+
+
+def dcc_upload(path):
+  """Parse the file as a dcc.Upload callback does. The base64 payload itself is not counted."""
+  with open(path, 'rb') as f:
+    contents = 'data:text/plain;base64,' + base64.b64encode(f.read()).decode()
+  _, peak, dt = measure(lambda: read_columns(parse_dash_file(contents)))
+  return peak, dt
+
+
+def chunked(client, path):
+  """Post the file to the chunked upload route, as the browser does."""
+  def run():
+    upload_id = uuid.uuid4().hex
+    size = os.path.getsize(path)
+    offset = 0
+    with open(path, 'rb') as f:
+      while True:
+        chunk = f.read(chunked_upload.CHUNK_SIZE)
+        final = int(offset + len(chunk) >= size)
+        resp = client.post(f"{chunked_upload.UPLOAD_ROUTE}/{upload_id}?offset={offset}&final={final}&prefix=bench-&filename=ca.txt", data=chunk)
+        if resp.status_code != 200:
+          raise RuntimeError(resp.get_json())
+        gc.collect()  # The test client keeps each request body in a reference cycle, a real server does not.
+        offset += len(chunk)
+        if final:
+          return resp.get_json()
+  return measure(run)
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('-n', '--nrows', default=2000000, type=int, help='Number of rows of the data file')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  path = os.path.join(tempfile.mkdtemp(), 'ca.txt')
+  make_file(path, args['nrows'])
+  fsize = os.path.getsize(path)
+  arrays = 3 * 8 * args['nrows']
+  client = build_app().server.test_client()
+  client.get('/')  # Session cookie.
+  print(f"file: {fsize/2**20:.1f} MB, parsed arrays: {arrays/2**20:.1f} MB")
+
+  tracemalloc.start()
+  peak, dt = dcc_upload(path)
+  print(f"{'dcc.Upload':>12s}: peak {peak/2**20:8.1f} MB ({peak/fsize:.2f} x file), {dt:.2f} s")
+  result, peak, dt = chunked(client, path)
+  print(f"{'chunked':>12s}: peak {peak/2**20:8.1f} MB ({peak/fsize:.2f} x file), {dt:.2f} s")
+  tracemalloc.stop()
+
+  assert result['nrows'] == args['nrows'], result
+  assert np.array_equal(DATASETS[result['key']]['<I>/mA'], read_columns(path)['<I>/mA'])
+  bound = 2*arrays + 4*chunked_upload.CHUNK_SIZE
+  assert peak < bound, f"Chunked upload peak {peak} exceeds {bound} bytes."
+  print(f"chunked peak within bound ({bound/2**20:.1f} MB)")
@@ -0,0 +1,129 @@
+"""Load test of the Dash app served by gunicorn.
+Simulated users upload their own polarization curve, change the pH a few times and run a Tafel fit, all concurrently.
+Each user has its own cookies, hence its own session. Reports throughput and latency for each number of workers and users.
+To run:
+  python load_test.py
+  python load_test.py -w 1 2 4 -u 1 4 16 -n 20000
+  python load_test.py --url http://127.0.0.1:8050 -u 8
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import requests
+
+from benchmark_tafel_callbacks import Session, make_upload, parse_outputs
+
+
+def layout_props(layout):
+  """Property values of all components in a /_dash-layout response."""
+  props = dict()
+  stack = [layout]
+  while stack:
+    node = stack.pop()
+    if isinstance(node, list):
+      stack.extend(node)
+    elif isinstance(node, dict) and 'props' in node and 'type' in node:
+      cid = node['props'].get('id')
+      for prop, val in node['props'].items():
+        if cid is not None:
+          props[(cid, prop)] = val
+        if isinstance(val, (dict, list)):
+          stack.append(val)
+  return props
+
+
+class HttpSession(Session):
+  """Browser stand-in talking to a running server, with its own cookies."""
+
+  def __init__(self, url):
+    self.url = url
+    self.http = requests.Session()
+    self.props = layout_props(self.http.get(f"{url}/_dash-layout").json())
+    deps = self.http.get(f"{url}/_dash-dependencies").json()
+    self.callbacks = [(d['output'], parse_outputs(d['output']), d) for d in deps if not d.get('clientside_function')]
+
+  def _post(self, body):
+    resp = self.http.post(f"{self.url}/_dash-update-component", data=body, headers={'Content-Type': 'application/json'})
+    return resp.status_code, resp.content
+
+
+def run_user(url, contents, npoints_ph):
+  """Scenario of one user.
+  Returns:
+    list: latency (in s) of each event
+  """
+  session = HttpSession(url)
+  latencies = [session.event({('tafel-upload', 'contents'): contents, ('tafel-upload', 'filename'): 'pol.txt'})[2]]
+  for k in range(npoints_ph):
+    latencies.append(session.event({('tafel-ph-input', 'value'): 7 + 0.1*(k+1)})[2])
+  t = session.event({('tafel-run-btn', 'n_clicks'): 1})[2]
+  latencies.append(t + session.poll('tafel', interval=0.2)[2])
+  return latencies
+
+
+def run_load(url, nusers, contents, nevents):
+  """Run nusers concurrent users.
+  Returns:
+    float: wall time (in s)
+    np.ndarray: latencies (in s) of all events
+  """
+  t0 = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=nusers) as executor:
+    results = list(executor.map(lambda k: run_user(url, contents[k % len(contents)], nevents), range(nusers)))
+  return time.perf_counter() - t0, np.concatenate(results)
+
+
+def start_server(workers, port, data_dir):
+  """Start gunicorn and wait until it answers."""
+  env = dict(os.environ, VELAZQUEZ_DATA_DIR=data_dir, VELAZQUEZ_JOB_WORKERS='1')
+  cmd = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', '2', '-b', f"127.0.0.1:{port}", '--log-level', 'warning', 'velazquez_lab.app.wsgi:server']
+  proc = subprocess.Popen(cmd, env=env)
+  url = f"http://127.0.0.1:{port}"
+  for _ in range(300):
+    if proc.poll() is not None:
+      raise RuntimeError(f"gunicorn exited with code {proc.returncode}.")
+    try:
+      requests.get(f"{url}/_dash-layout", timeout=5)
+      return proc, url
+    except requests.RequestException:  # Not listening yet, or still booting.
+      time.sleep(0.2)
+  proc.terminate()
+  raise RuntimeError('gunicorn did not start.')
+
+
+def parse_args():
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser()
+  ap.add_argument('--url', default=None, help='URL of a running server (default: start gunicorn for each number of workers)')
+  ap.add_argument('-w', '--workers', nargs='+', default=[1, 2, 4], type=int, help='Numbers of gunicorn workers')
+  ap.add_argument('-u', '--users', nargs='+', default=[1, 2, 4, 8], type=int, help='Numbers of concurrent users')
+  ap.add_argument('-n', '--npoints', default=20000, type=int, help='Number of points in each polarization curve')
+  ap.add_argument('-e', '--events', default=3, type=int, help='Number of pH changes per user')
+  ap.add_argument('-p', '--port', default=8051, type=int, help='Port of the started servers')
+  args = vars(ap.parse_args())
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  contents = [make_upload(args['npoints'], seed=k) for k in range(max(args['users']))]
+  print(f"{'workers':>7s} {'users':>5s} {'events/s':>9s} {'p50 (ms)':>9s} {'p95 (ms)':>9s}")
+  for workers in ([None] if args['url'] else args['workers']):
+    proc = None
+    url = args['url']
+    if url is None:
+      proc, url = start_server(workers, args['port'], tempfile.mkdtemp(prefix='velazquez-load-'))
+    try:
+      for nusers in args['users']:
+        wall, latencies = run_load(url, nusers, contents, args['events'])
+        print(f"{workers or '-':>7} {nusers:5d} {latencies.size/wall:9.1f} {1e3*np.median(latencies):9.0f} {1e3*np.percentile(latencies, 95):9.0f}", flush=True)
+    finally:
+      if proc is not None:
+        proc.terminate()
+        proc.wait()
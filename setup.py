@@ -17,4 +17,7 @@ setup(
   url='https://github.com/mpoehlmann/velazquez_lab',
   packages=find_packages(exclude=['assets', 'data', 'docs', 'scripts', 'notebooks']),
   zip_safe=False,
+  entry_points={
+    'console_scripts': ['velazquez-batch=velazquez_lab.pol.batch:main'],
+  },
 )
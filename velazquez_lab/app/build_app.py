@@ -1,16 +1,16 @@
 
 import dash
-from jupyter_dash import JupyterDash
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_html_components as html
+import functools
 import pandas as pd
 
-from velazquez_lab.app import templates
-from velazquez_lab.app.pol_page import create_pol_page
-from velazquez_lab.app.filt_page import create_filt_page
-from velazquez_lab.app.linfit_page import create_linfit_page
+from velazquez_lab.app import chunked_upload, sessions, templates
+from velazquez_lab.app.pol_page import create_pol_page, register_pol_callbacks
+from velazquez_lab.app.filt_page import create_filt_page, register_filt_callbacks
+from velazquez_lab.app.linfit_page import create_linfit_page, register_linfit_callbacks
 from velazquez_lab.utils import styles
 
 
@@ -31,38 +31,43 @@ def build_app(start_page=2, theme='light', jupyter=False):
   dash_args = dict(
     title='Velázquez Lab',
     external_stylesheets=external_stylesheets,
+    suppress_callback_exceptions=True,  # Page layouts are only built when first visited.
   )
-  app = JupyterDash(__name__, **dash_args) if jupyter else dash.Dash(__name__, **dash_args)
+  if jupyter:
+    from jupyter_dash import JupyterDash
+    app = JupyterDash(__name__, **dash_args)
+  else:
+    app = dash.Dash(__name__, **dash_args)
+  sessions.init_sessions(app.server)
+  chunked_upload.init_upload_route(app.server)
 
-  """Define pages."""
+  """Define pages. Callbacks are registered up front, layouts are built on first navigation."""
   pages = pd.DataFrame([
-    dict(id='pg-filt', label='Filtering', content=create_filt_page(app)),
-    dict(id='pg-linfit', label='Linear fitting', content=create_linfit_page(app)),
-    dict(id='pg-pol', label='Polarization curves', content=create_pol_page(app)),
+    dict(id='pg-filt', label='Filtering', create=create_filt_page, register=register_filt_callbacks),
+    dict(id='pg-linfit', label='Linear fitting', create=create_linfit_page, register=register_linfit_callbacks),
+    dict(id='pg-pol', label='Polarization curves', create=create_pol_page, register=register_pol_callbacks),
   ])
+  for p in pages.itertuples():
+    p.register(app)
 
 
   """Create layout and setup page loading."""
+  @functools.lru_cache(maxsize=None)
   def create_page(button_id):
     for i, p in enumerate(pages.itertuples()):
       if p.id == button_id:
         header = dbc.NavbarBrand(p.label)
-        return p.content, header
+        return p.create(), header
     return html.H1("404: page ID not found."), None
 
-  full_page = html.Div([
-    templates.build_navbar(app, pages, start_page, subtitle='Data Analysis Toolkit'),
-    html.Div(create_page(pages.loc[start_page, 'id']), id='main-page'),
-  ])
-
-  """Index layout."""
-  app.layout = full_page
+  def serve_layout():
+    """Index layout, built on the first request."""
+    return html.Div([
+      templates.build_navbar(app, pages, start_page, subtitle='Data Analysis Toolkit'),
+      html.Div(create_page(pages.loc[start_page, 'id']), id='main-page'),
+    ])
 
-  """Complete layout."""
-  app.validation_layout = html.Div([
-    full_page,
-    *(c for c in pages['content']),
-  ])
+  app.layout = serve_layout
 
   @app.callback(
     Output('main-page', 'children'),
@@ -0,0 +1,157 @@
+"""Chunked upload of large data files.
+Notes:
+  dcc.Upload sends the whole file base64-encoded through a callback, so the server holds several copies of it in memory.
+  Here the browser posts the file in chunks to a Flask route, which appends them to a file in the session directory and parses it
+  incrementally into the dataset cache (see file_reading.read_columns_chunked). The browser only gets the dataset key back.
+  The key is written into a hidden dcc.Input, whose value triggers the server callbacks of the page as a dcc.Upload would.
+"""
+
+import hashlib
+import json
+import os
+import re
+import flask
+import dash_bootstrap_components as dbc
+import dash_core_components as dcc
+import dash_html_components as html
+from dash.dependencies import Input, Output
+
+from velazquez_lab.app import sessions
+from velazquez_lab.app.dataset_cache import DATASETS
+from velazquez_lab.utils.file_reading import read_columns_chunked
+
+UPLOAD_ROUTE = '/_velazquez-upload'
+CHUNK_SIZE = 4*2**20  # Bytes per request.
+MAX_CHUNK_SIZE = 16*2**20
+_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_PREFIX_RE = re.compile(r'^[a-z]*-?$')
+
+"""Pick a file and post it in chunks, then hand the dataset key to Dash through the hidden input."""
+UPLOAD_JS = """
+function(n_clicks) {
+  if (!n_clicks) {
+    return window.dash_clientside.no_update;
+  }
+  var status = document.getElementById('__NAME__-chunked-status');
+  var picker = document.createElement('input');
+  picker.type = 'file';
+  picker.onchange = function() {
+    var file = picker.files[0];
+    if (!file) {
+      return;
+    }
+    var id = Array.from(crypto.getRandomValues(new Uint8Array(16)), function(b) { return ('0' + b.toString(16)).slice(-2); }).join('');
+    var send = function(offset) {
+      var end = Math.min(offset + __CHUNK_SIZE__, file.size);
+      var final = end >= file.size ? 1 : 0;
+      var url = '__ROUTE__/' + id + '?offset=' + offset + '&final=' + final + '&prefix=__PREFIX__&filename=' + encodeURIComponent(file.name);
+      fetch(url, {method: 'POST', body: file.slice(offset, end), credentials: 'same-origin'})
+        .then(function(resp) { return resp.json().then(function(body) { return [resp.ok, body]; }); })
+        .then(function(res) {
+          if (!res[0]) {
+            throw new Error(res[1].error);
+          }
+          if (!final) {
+            status.textContent = 'Uploading ' + file.name + ': ' + Math.round(100 * end / file.size) + '%';
+            return send(res[1].offset);
+          }
+          status.textContent = '';
+          var input = document.getElementById('__NAME__-chunked-result');
+          var setter = Object.getOwnPropertyDescriptor(window.HTMLInputElement.prototype, 'value').set;
+          setter.call(input, JSON.stringify(res[1]));
+          input.dispatchEvent(new Event('input', {bubbles: true}));
+        })
+        .catch(function(err) { status.textContent = 'Upload failed: ' + err.message; });
+    };
+    status.textContent = 'Uploading ' + file.name + ': 0%';
+    send(0);
+  };
+  picker.click();
+  return '';
+}
+"""
+
+
+def _upload_path(upload_id):
+  if not _ID_RE.match(upload_id):
+    flask.abort(400)
+  return os.path.join(sessions.data_dir('sessions', sessions.session_id(), 'uploads'), f"{upload_id}.part")
+
+
+def _file_hash(path, block_size=2**20):
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(block_size), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def init_upload_route(server):
+  """Add the route receiving the chunks to the Flask server of the app."""
+  @server.route(f"{UPLOAD_ROUTE}/<upload_id>", methods=['POST'])
+  def upload_chunk(upload_id):
+    """Append a chunk to the upload. The final chunk parses the file into the dataset cache.
+    Query args:
+      offset (int): position of the chunk in the file, the upload resumes from the returned offset if it does not match
+      final (int): 1 for the last chunk
+      prefix (str): namespace of the dataset, see dataset_cache.upload_key
+      filename (str): name of the uploaded file
+    """
+    path = _upload_path(upload_id)
+    offset = flask.request.args.get('offset', 0, type=int)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if offset != size:
+      return flask.jsonify(error=f"Expected offset {size}.", offset=size), 409
+    if (flask.request.content_length or 0) > MAX_CHUNK_SIZE:
+      return flask.jsonify(error=f"Chunks are limited to {MAX_CHUNK_SIZE} bytes."), 413
+
+    """Stream the chunk to disk without holding it in memory."""
+    with open(path, 'ab') as f:
+      for block in iter(lambda: flask.request.stream.read(2**16), b''):
+        f.write(block)
+    if flask.request.args.get('final', 0, type=int) != 1:
+      return flask.jsonify(offset=os.path.getsize(path))
+
+    prefix = flask.request.args.get('prefix', '')
+    if not _PREFIX_RE.match(prefix):
+      return flask.jsonify(error='Invalid prefix.'), 400
+    try:
+      key = prefix + _file_hash(path)
+      data = DATASETS.get_or_load(key, lambda: read_columns_chunked(path))
+    except ValueError as exc:
+      return flask.jsonify(error=str(exc)), 400
+    finally:
+      os.remove(path)
+    return flask.jsonify(key=key, filename=flask.request.args.get('filename', ''), nrows=int(min(len(v) for v in data.values())))
+
+
+def build_chunked_upload(name, label='Upload large file'):
+  """Button, progress text and hidden result input of a chunked upload. See register_chunked_upload."""
+  return html.Div([
+    dbc.Button(label, id=f"{name}-chunked-btn", n_clicks=0, className='btn-block btn-secondary'),
+    html.Div(id=f"{name}-chunked-status", className='text-muted'),
+    dcc.Input(id=f"{name}-chunked-result", type='text', value='', style={'display': 'none'}),
+  ])
+
+
+def register_chunked_upload(app, name, prefix=''):
+  """Register the clientside callback running the upload.
+  Args:
+    app (dash.Dash): application
+    name (str): name given to build_chunked_upload
+    prefix (str): namespace of the dataset, see dataset_cache.upload_key
+  """
+  js = UPLOAD_JS.replace('__NAME__', name).replace('__ROUTE__', UPLOAD_ROUTE).replace('__PREFIX__', prefix).replace('__CHUNK_SIZE__', str(CHUNK_SIZE))
+  app.clientside_callback(js, Output(f"{name}-chunked-status", 'children'), Input(f"{name}-chunked-btn", 'n_clicks'))
+
+
+def parse_chunked_result(value):
+  """Dataset key and file name from the hidden input of a chunked upload.
+  Returns:
+    str: dataset key
+    str: file name
+  """
+  result = json.loads(value)
+  if result['key'] not in DATASETS:
+    raise KeyError(f"Dataset '{result['key']}' is no longer cached, please upload the file again.")
+  return result['key'], result['filename']
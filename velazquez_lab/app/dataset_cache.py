@@ -0,0 +1,160 @@
+"""Server-side cache of uploaded datasets.
+Notes:
+  The dcc.Store components only hold the key of a dataset, the arrays stay in the memory of the server.
+  Keys are derived from the hash of the uploaded file, so uploading the same file twice parses it once.
+  With several server processes, datasets are also spilled to a shared directory, so any process can serve any request.
+"""
+
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+
+def upload_key(contents, prefix=''):
+  """Key of an uploaded file.
+  Args:
+    contents (str): base64 encoded contents from dcc.Upload
+    prefix (str): namespace of the dataset, e.g. the section that parsed it
+  Returns:
+    str: key
+  """
+  return prefix + hashlib.sha256(contents.encode()).hexdigest()
+
+
+class DatasetCache:
+  """Thread-safe store of datasets (dicts of numpy arrays), evicting the least recently used ones.
+  Args:
+    max_bytes (int): maximum total size (in bytes) of the cached arrays
+    directory (str): directory where datasets are also saved, so they can be reloaded (memory-mapped) by other processes or after eviction. None keeps them in memory only.
+    max_disk_bytes (int): maximum size (in bytes) of the directory, above which the least recently used datasets are removed from it
+  """
+
+  def __init__(self, max_bytes=512*2**20, directory=None, max_disk_bytes=4*2**30):
+    self.max_bytes = max_bytes
+    self.directory = directory
+    self.max_disk_bytes = max_disk_bytes
+    self.nbytes = 0
+    self._datasets = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._datasets)
+
+  def __contains__(self, key):
+    return key in self._datasets or (self.directory is not None and os.path.isdir(self._path(key)))
+
+  def __getitem__(self, key):
+    data = self.get(key)
+    if data is None:
+      raise KeyError(f"Dataset '{key}' is no longer cached, please upload the file again.")
+    return data
+
+  def get(self, key, default=None):
+    """Cached dataset, or default if the key is unknown or has been evicted."""
+    with self._lock:
+      if key in self._datasets:
+        self._datasets.move_to_end(key)
+        return self._datasets[key]
+    data = self._load(key)
+    if data is None:
+      return default
+    self._add(key, data)
+    return data
+
+  def _path(self, key):
+    return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+  def _load(self, key):
+    """Memory-mapped dataset from the directory, or None."""
+    if self.directory is None or not os.path.isdir(self._path(key)):
+      return None
+    path = self._path(key)
+    try:
+      data = {fname[:-4]: np.load(os.path.join(path, fname), mmap_mode='r') for fname in os.listdir(path) if fname.endswith('.npy')}
+    except FileNotFoundError:  # Removed meanwhile.
+      return None
+    try:
+      os.utime(path)  # Mark as recently used, see evict_disk and sessions.cleanup.
+    except OSError:
+      pass
+    return data
+
+  def _save(self, key, data):
+    """Write a dataset to the directory, renaming it into place so readers never see a partial dataset."""
+    path = self._path(key)
+    if os.path.isdir(path):
+      return
+    os.makedirs(self.directory, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+    for name, vals in data.items():
+      np.save(os.path.join(tmp, f"{name}.npy"), vals, allow_pickle=False)
+    try:
+      os.rename(tmp, path)
+    except OSError:  # Saved by another process meanwhile.
+      shutil.rmtree(tmp, ignore_errors=True)
+    self.evict_disk()
+
+  def evict_disk(self):
+    """Remove the least recently used datasets from the directory until it fits in max_disk_bytes.
+    The newest dataset is always kept. Datasets still in memory are kept there.
+    """
+    entries = []
+    for name in os.listdir(self.directory):
+      path = os.path.join(self.directory, name)
+      if name.startswith('.'):
+        continue
+      try:
+        entries.append((os.path.getmtime(path), sum(e.stat().st_size for e in os.scandir(path)), path))
+      except FileNotFoundError:  # Removed by another process.
+        pass
+    entries.sort()
+    total = sum(e[1] for e in entries)
+    for _, nbytes, path in entries[:-1]:
+      if total <= self.max_disk_bytes:
+        break
+      shutil.rmtree(path, ignore_errors=True)
+      total -= nbytes
+
+  def _add(self, key, data):
+    """Insert a dataset in memory, evicting the least recently used ones."""
+    nbytes = sum(vals.nbytes for vals in data.values())
+    with self._lock:
+      if key in self._datasets:
+        self.nbytes -= sum(vals.nbytes for vals in self._datasets.pop(key).values())
+      self._datasets[key] = data
+      self.nbytes += nbytes
+      while self.nbytes > self.max_bytes and len(self._datasets) > 1:  # Always keep the newest dataset.
+        _, old = self._datasets.popitem(last=False)
+        self.nbytes -= sum(vals.nbytes for vals in old.values())
+
+  def put(self, key, data):
+    """Add a dataset. The cached arrays are read-only views since they are shared between callbacks.
+    The caller's arrays stay writable, but share memory with the cache and should not be modified afterwards.
+    Args:
+      key (str): dataset key
+      data (dict): column name: array_like
+    Returns:
+      dict: cached dataset
+    """
+    data = {name: np.asarray(vals).view() for name, vals in data.items()}  # Views, so the caller's flags are untouched.
+    for vals in data.values():
+      vals.flags.writeable = False
+    if self.directory is not None:
+      self._save(key, data)
+    self._add(key, data)
+    return data
+
+  def get_or_load(self, key, loader):
+    """Cached dataset, calling loader() and caching its result on a miss."""
+    data = self.get(key)
+    if data is None:
+      data = self.put(key, loader())
+    return data
+
+
+"""Cache shared by all pages of the application."""
+DATASETS = DatasetCache()
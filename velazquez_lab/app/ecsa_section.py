@@ -5,6 +5,7 @@ See pol_page.py for usage.
 import dash
 from dash.dash import no_update
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
@@ -15,14 +16,16 @@ import os
 import pandas as pd
 import plotly.graph_objs as go
 
-from velazquez_lab.app import templates
+from velazquez_lab.app import sessions, templates
+from velazquez_lab.app.dataset_cache import DATASETS, upload_key
+from velazquez_lab.app.jobs import JOBS
 from velazquez_lab.utils.file_reading import parse_dash_file
 from velazquez_lab.pol import ecsa
-from velazquez_lab.utils import styles
+from velazquez_lab.utils import plotting, styles
 import velazquez_lab.utils.linear_fitting as ft
 
 
-def build_ecsa_dlc_fig(file_storage, contour=None):
+def build_ecsa_dlc_fig(file_storage, contour=None, x_range=None):
   """Specify a default scan rate."""
   for i, key in enumerate(file_storage.keys()):
     if file_storage[key]['scan_rate'] is None:
@@ -30,12 +33,13 @@ def build_ecsa_dlc_fig(file_storage, contour=None):
 
   """Initialize figure."""
   dlc_fig = go.Figure()
-  dlc_fig.update_layout(xaxis_title='<b>Potential (V)</b>', yaxis_title='<b>Current (mA)</b>', legend_title='<b>Scan rate (mV/s)</b>')
+  dlc_fig.update_layout(xaxis_title='<b>Potential (V)</b>', yaxis_title='<b>Current (mA)</b>', legend_title='<b>Scan rate (mV/s)</b>', uirevision='ecsa')
 
   """Add datasets."""
   if len(file_storage) > 0:
     for i, file in enumerate(file_storage.values()):
-      trace = go.Scatter(x=file['potential'], y=file['current'], mode='lines', line_color=styles.COLORS[i], name=f"<b>{file['scan_rate']}</b>")
+      data = DATASETS[file['key']]
+      trace = plotting.build_scatter(data['potential'], data['current'], x_range=x_range, mode='lines', line_color=styles.COLORS[i], name=f"<b>{file['scan_rate']}</b>")
       dlc_fig.add_trace(trace)
 
   """Draw contour line."""
@@ -70,11 +74,20 @@ def build_ecsa_fit_fig(fitres_df):
   return fit_fig
 
 
-def build_ecsa_inputs(app):
+def fit_ecsa_job(potentials, currents, scan_rates, contour, specific_cap, blank_cap, progress):
+  """Calculate the ECSA in a background worker. See ecsa_fit_callback.
+  Returns:
+    pd.DataFrame: ecsa.calculate_ecsa_contours results at the contour, as memoized
+  """
+  return ecsa.calculate_ecsa_contours(potentials, currents, scan_rates, [contour], specific_cap=specific_cap, blank_cap=blank_cap, progress=progress)
+
+
+def build_ecsa_inputs():
   content = list()
 
   """File upload."""
   storage = dcc.Store(data=dict(), id='esca-file-storage', storage_type='memory')
+  upload_storage = dcc.Store(data=list(), id='ecsa-upload-storage', storage_type='memory')
   table = dash_table.DataTable(
     id='ecsa-file-table',
     columns=[
@@ -106,7 +119,7 @@ def build_ecsa_inputs(app):
 
   content.append(dbc.Container([
     # html.Div(load_cfg_btn, className='pb-1'),
-    html.Div([storage, table]),
+    html.Div([storage, upload_storage, table]),
     html.Div(file_uploader, className='mt-1'),
   ]))
   content.append(html.Hr())
@@ -134,6 +147,7 @@ def build_ecsa_inputs(app):
     html.Div(btn2, className='pb-1'),
     html.Div(btn3, className='pb-1'),
     html.Div(btn_fit),
+    templates.build_job_status('ecsa'),
   ]))
 
   """Output display."""
@@ -159,13 +173,33 @@ def build_ecsa_inputs(app):
   fpath = os.path.dirname(os.path.realpath(__file__))
   f = open(f"{fpath}/../../docs/ecsa.md", 'r')
   txt = f.read()
-  info = templates.build_modal(app, 'ecsa', 'ECSA Instructions', dcc.Markdown(txt))
+  info = templates.build_modal('ecsa', 'ECSA Instructions', dcc.Markdown(txt))
   layout = templates.build_card('Inputs', content, info=info)
   return layout
 
 
-def build_ecsa_row(app):
-  """Create content for ECSA row."""
+def register_ecsa_callbacks(app):
+  """Register callbacks of the ECSA section."""
+  templates.register_modal_callbacks(app, 'ecsa')
+
+  @app.callback(
+    Output('ecsa-upload-storage', 'data'),
+    Input('ecsa-upload', 'contents'),
+    State('ecsa-upload', 'filename'),
+  )
+  def ecsa_upload_callback(new_file_contents, new_file_names):
+    """Parse uploaded files into the dataset cache. Only their keys are sent to the browser."""
+    if new_file_contents is None:
+      raise PreventUpdate
+    uploads = []
+    for n, c in zip(np.atleast_1d(new_file_names), np.atleast_1d(new_file_contents)):
+      def load(c=c):
+        e, i = ecsa.load_ecsa_data(parse_dash_file(c), cycle=2)
+        return {'potential': e[0], 'current': i[0]}
+      key = upload_key(c, prefix='ecsa-')
+      DATASETS.get_or_load(key, load)
+      uploads.append({'fname': n, 'key': key})
+    return uploads
 
   @app.callback(
     Output('ecsa-file-table', 'data'),
@@ -179,23 +213,68 @@ def build_ecsa_row(app):
     Output('ecsa-fit-value', 'children'),
     Output('ecsa-fit-output', 'is_open'),
     Output('ecsa-download-dataframe-csv', 'data'),
+    Output('ecsa-job-storage', 'data'),
+    Output('ecsa-job-status', 'hidden'),
+    Output('ecsa-job-progress', 'value'),
+    Output('ecsa-job-progress', 'children'),
+    Output('ecsa-job-interval', 'disabled'),
     Input('ecsa-fit-button', 'n_clicks'),
     Input('ecsa-file-table', 'data'),
-    Input('ecsa-upload', 'filename'),
+    Input('ecsa-upload-storage', 'data'),
     Input('ecsa-contour-input', 'value'),
     Input('ecsa-download-button', 'n_clicks'),
-    State('ecsa-upload', 'contents'),
+    Input('ecsa-dlc-graph', 'relayoutData'),
+    Input('ecsa-job-interval', 'n_intervals'),
+    Input('ecsa-job-cancel-btn', 'n_clicks'),
     State('esca-file-storage', 'data'),
     State('esca-fitresdf-storage', 'data'),
     State('ecsa-specific-input', 'value'),
     State('ecsa-blank-input', 'value'),
+    State('ecsa-job-storage', 'data'),
   )
-  def ecsa_fit_callback(fit_btn_clicks, file_table, new_file_names, contour, download_nclicks, new_file_contents, file_storage, fitres_df, specific_cap, blank_cap): #, dlc_fig, fit_fig, ecsa_display_val):
+  def ecsa_fit_callback(fit_btn_clicks, file_table, uploads, contour, download_nclicks, relayout_data, n_intervals, cancel_clicks, file_storage, fitres_df, specific_cap, blank_cap, job): #, dlc_fig, fit_fig, ecsa_display_val):
     """Link ECSA elements together."""
     """Get id of component which triggered the callback."""
     ctx = dash.callback_context
     trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
 
+    """Zoom or pan: only re-send the curves of the visible potential range."""
+    zoomed, x_range = plotting.zoom_range(relayout_data)
+    if trig_id == 'ecsa-dlc-graph':
+      if not zoomed:
+        raise PreventUpdate
+      outputs = [no_update for _ in range(15)]
+      outputs[3] = build_ecsa_dlc_fig(file_storage, contour, x_range=x_range)
+      return tuple(outputs)
+
+    """Background fit: cancel it, or poll it until it is done."""
+    if trig_id == 'ecsa-job-cancel-btn':
+      if 'id' in job:
+        JOBS.cancel(job['id'])
+      raise PreventUpdate  # The next poll reports the cancellation.
+    job_outputs = templates.job_status_outputs(None)
+    result = None
+    if trig_id == 'ecsa-job-interval':
+      if 'id' not in job:
+        raise PreventUpdate
+      status = JOBS.status(job['id'])
+      job_outputs = templates.job_status_outputs(status)
+      if status['state'] in ('queued', 'running'):
+        return (*(no_update for _ in range(10)), no_update, *job_outputs)
+      result = JOBS.result(job['id']) if status['state'] == 'done' else None
+      JOBS.forget(job['id'])
+      if result is None:  # Failed or cancelled, the progress bar shows why.
+        return (*(no_update for _ in range(10)), dict(), *job_outputs)
+      if job.get('memo_key'):  # The fit ran in a worker process, remember it in this one.
+        ecsa.calculate_ecsa_contours.cache_put(job['memo_key'], result)
+      job = dict()
+    elif trig_id == 'ecsa-download-button':
+      job_outputs = tuple(no_update for _ in job_outputs)  # Keep polling a running fit.
+    elif 'id' in job:  # Any other change supersedes the running fit.
+      JOBS.cancel(job['id'])
+      JOBS.forget(job['id'])
+      job = dict()
+
     """Convert file table to DataFrame."""
     fitres_df = pd.DataFrame.from_dict(fitres_df)
     file_table_df = pd.DataFrame.from_dict(file_table)
@@ -203,11 +282,9 @@ def build_ecsa_row(app):
     ecsa_val, esca_val_text = no_update, no_update
     is_fitoutput_open = no_update
     download = None
-    if trig_id == 'ecsa-upload':  # New file uploaded.
-      if new_file_contents is not None:
-        for n, c in zip(np.atleast_1d(new_file_names), np.atleast_1d(new_file_contents)):
-          e, i = ecsa.load_ecsa_data(parse_dash_file(c), cycle=2)
-          file_storage[n] = {'scan_rate': None, 'potential': e[0], 'current': i[0]}
+    if trig_id == 'ecsa-upload-storage':  # New file uploaded.
+      for upload in uploads:
+        file_storage[upload['fname']] = {'scan_rate': None, 'key': upload['key']}
       is_fitoutput_open = False
       fitres_df = pd.DataFrame()
 
@@ -231,13 +308,15 @@ def build_ecsa_row(app):
         if file['scan_rate'] is None:
           raise ValueError("All scan rates must be defined.")
 
-      e = [f['potential'] for f in file_storage.values()]  # TODO: convert to pandas
-      i = [f['current'] for f in file_storage.values()]
+      data = [DATASETS[f['key']] for f in file_storage.values()]
+      e = [d['potential'] for d in data]
+      i = [d['current'] for d in data]
       s = [f['scan_rate'] for f in file_storage.values()]
-      ecsa_val, fitres_df = ecsa.calculate_ecsa(e, i, s, contour=contour, specific_cap=specific_cap, blank_cap=blank_cap)
-      esca_val_text = f"ECSA = {ecsa_val:.4g} cm2"
-      is_fitoutput_open = True
-      fitres_df.to_csv('/content/ecsa_fit_results.csv', index=False)
+      memo_key = ecsa.calculate_ecsa_contours.cache_key(e, i, s, [contour], specific_cap=specific_cap, blank_cap=blank_cap)
+      found, result = ecsa.calculate_ecsa_contours.cache_get(memo_key)  # Same files and parameters as an earlier fit.
+      if not found:
+        job_id = JOBS.submit(fit_ecsa_job, e, i, s, contour, specific_cap, blank_cap)
+        return (*(no_update for _ in range(10)), {'id': job_id, 'memo_key': memo_key}, *templates.job_status_outputs(JOBS.status(job_id)))
 
     elif trig_id == 'ecsa-download-button':
       download = dcc.send_data_frame(fitres_df.to_csv, 'ecsa_fit_results.csv', index=False)
@@ -249,23 +328,34 @@ def build_ecsa_row(app):
       # except:
       #   pass
 
+    if result is not None:  # Fit done, in the background or earlier.
+      ecsa_val, fitres_df = ecsa.ecsa_at_contour(result)
+      esca_val_text = f"ECSA = {ecsa_val:.4g} cm2"
+      is_fitoutput_open = True
+      fitres_df.to_csv(os.path.join(sessions.session_dir(), 'ecsa_fit_results.csv'), index=False)
+
     """Create return values."""
     outputs = tuple([
       [{'fname': key, 'scan_rate': val['scan_rate']} for key, val in file_storage.items()],
       file_storage,
       fitres_df.to_dict(orient='records'),
-      build_ecsa_dlc_fig(file_storage, contour),
+      build_ecsa_dlc_fig(file_storage, contour, x_range=x_range),
       build_ecsa_fit_fig(fitres_df),
       float(f"{ecsa_val:.5g}") if ecsa_val!=no_update else ecsa_val,
       'ECSA',
       esca_val_text,
       is_fitoutput_open,
       download,
+      job,
+      *job_outputs,
     ])
     return outputs
 
+
+def build_ecsa_row():
+  """Create content for ECSA row."""
   row = dbc.Row([
-    dbc.Col(build_ecsa_inputs(app), className='col-3'),
+    dbc.Col(build_ecsa_inputs(), className='col-3'),
     dbc.Col(templates.build_card('Double-layer capacitance', dcc.Graph(id='ecsa-dlc-graph')), className='col-4half',),
     dbc.Col(templates.build_card('Fit results', dcc.Graph(id='ecsa-fit-graph')), className='col-4half',),
   ])
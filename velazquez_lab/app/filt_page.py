@@ -5,83 +5,93 @@ See app.py for usage.
 import dash
 from dash.dash import no_update
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from io import StringIO
 import numpy as np
 import os
 import pandas as pd
 import plotly.graph_objs as go
 
-from velazquez_lab.app import templates
-from velazquez_lab.utils.file_reading import parse_dash_file
-from velazquez_lab.utils import styles, filtering
+from velazquez_lab.app import chunked_upload, templates
+from velazquez_lab.app.dataset_cache import DATASETS, upload_key
+from velazquez_lab.utils.file_reading import parse_dash_file, read_columns
+from velazquez_lab.utils import filtering, plotting, styles
 
 
-def create_filt_fig(raw=None, filt=None):
+def create_filt_fig(raw=None, filt=None, x_range=None):
   fig = go.Figure()
-  fig.update_layout(xaxis_title='<b>Samples</b>', yaxis_title='<b>Title Goes Here</b>')
+  fig.update_layout(xaxis_title='<b>Samples</b>', yaxis_title='<b>Title Goes Here</b>', uirevision='filt')
 
   if raw is not None:
-    tr = go.Scatter(y=raw, mode='lines', line_color=styles.COLORS[0], name=f"<b>Raw</b>")
+    tr = plotting.build_scatter(np.arange(len(raw)), raw, x_range=x_range, mode='lines', line_color=styles.COLORS[0], name=f"<b>Raw</b>")
     fig.add_trace(tr)
   if filt is not None:
-    tr = go.Scatter(y=filt, mode='lines', line_color=styles.COLORS[1], name=f"<b>Filtered</b>")
+    tr = plotting.build_scatter(np.arange(len(filt)), filt, x_range=x_range, mode='lines', line_color=styles.COLORS[1], name=f"<b>Filtered</b>")
     fig.add_trace(tr)
   return fig
 
 
-def create_filt_page(app):
-  file_storage = dcc.Store(data=dict(), id='filt-file-storage', storage_type='memory')
-  file_uploader = dcc.Upload(
-    id='filt-upload',
-    className='file-uploader',
-    children=html.Div(['Drag-and-drop or ', html.A('select file', className='btn-link')]),
-    multiple=False,
-  )
-  output_storage = dcc.Store(data=dict(), id='filt-output-storage', storage_type='memory')
-  btn1 = dbc.InputGroup([
-    dbc.InputGroupAddon('Window length', addon_type='prepend'),
-    dbc.Input(id='filt-window-btn', type='number', min=7, max=101, step=2, value=51),  # Must be odd and greater than polyorder=5
-    dbc.InputGroupAddon('samples', addon_type='append'),
-  ])
-  collapse = dbc.Collapse(
-    dbc.Alert('The window length must be odd and greater than the filter polynomial order (5).', className='alert-warning'),
-    id='filt-window-error',
-    is_open=False
-  )
-  btn2 = dbc.Button('Optimize window length', n_clicks=0, id='filt-optimize-btn', className='btn-block btn-primary mr-1')
+def register_filt_callbacks(app):
+  """Register callbacks of the filtering page."""
+  templates.register_modal_callbacks(app, 'filt')
+  chunked_upload.register_chunked_upload(app, 'filt', prefix='filt-')
 
   @app.callback(
     Output('filt-file-name', 'children'),
     Output('filt-file-storage', 'data'),
+    Input('filt-upload', 'contents'),
+    Input('filt-chunked-result', 'value'),
+    State('filt-upload', 'filename'),
+  )
+  def filt_upload_callback(new_file_content, chunked_result, new_file_name):
+    """Parse an uploaded file into the dataset cache. Only its key is sent to the browser.
+    Large files arrive through the chunked upload, already parsed.
+    """
+    ctx = dash.callback_context
+    trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+    if trig_id == 'filt-chunked-result' and chunked_result:
+      key, fname = chunked_upload.parse_chunked_result(chunked_result)
+      return fname, {'key': key}
+    if new_file_content is None:
+      raise PreventUpdate
+    key = upload_key(new_file_content, prefix='filt-')
+    DATASETS.get_or_load(key, lambda: read_columns(parse_dash_file(new_file_content)))
+    return new_file_name, {'key': key}
+
+  @app.callback(
     Output('filt-output-storage', 'data'),
     Output('filt-graph', 'figure'),
     Output('filt-window-btn', 'max'),
     Output('filt-window-error', 'is_open'),
-    Input('filt-upload', 'filename'),
+    Input('filt-file-storage', 'data'),
     Input('filt-window-btn', 'value'),
     Input('filt-optimize-btn', 'n_clicks'),
-    State('filt-upload', 'contents'),
-    State('filt-file-storage', 'data'),
+    Input('filt-graph', 'relayoutData'),
+    State('filt-output-storage', 'data'),
   )
-  def filt_callback(new_file_name, window_length, _, new_file_content, file_df):
+  def filt_callback(file_storage, window_length, _, relayout_data, filt_storage):
     """Link filtering elements together."""
     """Get id of component which triggered the callback."""
     ctx = dash.callback_context
     trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
 
-    file_name, output_storage = (no_update for _ in range(2))
-    file_df = pd.DataFrame.from_dict(file_df)
+    output_storage = no_update
+    file_df = pd.DataFrame(DATASETS[file_storage['key']] if 'key' in file_storage else {})
+
+    """Zoom or pan: only re-send the curves of the visible sample range."""
+    zoomed, x_range = plotting.zoom_range(relayout_data)
+    if trig_id == 'filt-graph':
+      if not zoomed or len(file_df) == 0:
+        raise PreventUpdate
+      filt_y = DATASETS[filt_storage['key']]['y'] if 'key' in filt_storage else None
+      return no_update, create_filt_fig(file_df.iloc[:,1], filt_y, x_range=x_range), no_update, no_update
     window_max = no_update
     show_error = False
 
-    if trig_id == 'filt-upload':
-      if new_file_content is not None:
-        file_name = new_file_name
-        f = StringIO(parse_dash_file(new_file_content))
-        file_df = pd.read_table(f, sep=',', header=None)
+    if trig_id == 'filt-file-storage':
+      if len(file_df) > 0:
         window_max = len(file_df)
         if window_max%2 == 0:
           window_max -= 1
@@ -97,21 +107,45 @@ def create_filt_page(app):
           window_length, filt_y = filtering.optimize_window(file_df.iloc[:,1], polyorder=5)
         else:
           filt_y = filtering.apply_filter(file_df.iloc[:,1], window_length=window_length, polyorder=5)
-        output_storage = filt_y
+        output_storage = {'key': f"{file_storage['key']}-filt-{window_length}"}
+        DATASETS.put(output_storage['key'], {'y': filt_y})
         fig = create_filt_fig(file_df.iloc[:,1], filt_y)
     else:
       fig = create_filt_fig(None, None)
-    return file_name, file_df.to_dict(orient='records'), output_storage, fig, window_max, show_error
+    return output_storage, fig, window_max, show_error
+
+
+def create_filt_page():
+  file_storage = dcc.Store(data=dict(), id='filt-file-storage', storage_type='memory')
+  file_uploader = dcc.Upload(
+    id='filt-upload',
+    className='file-uploader',
+    children=html.Div(['Drag-and-drop or ', html.A('select file', className='btn-link')]),
+    multiple=False,
+  )
+  output_storage = dcc.Store(data=dict(), id='filt-output-storage', storage_type='memory')
+  btn1 = dbc.InputGroup([
+    dbc.InputGroupAddon('Window length', addon_type='prepend'),
+    dbc.Input(id='filt-window-btn', type='number', min=7, max=101, step=2, value=51),  # Must be odd and greater than polyorder=5
+    dbc.InputGroupAddon('samples', addon_type='append'),
+  ])
+  collapse = dbc.Collapse(
+    dbc.Alert('The window length must be odd and greater than the filter polynomial order (5).', className='alert-warning'),
+    id='filt-window-error',
+    is_open=False
+  )
+  btn2 = dbc.Button('Optimize window length', n_clicks=0, id='filt-optimize-btn', className='btn-block btn-primary mr-1')
 
   """Layout."""
   fpath = os.path.dirname(os.path.realpath(__file__))
   f = open(f"{fpath}/../../docs/filtering.md", 'r')
   txt = f.read()
-  info = templates.build_modal(app, 'filt', 'Filtering Instructions', dcc.Markdown(txt))
+  info = templates.build_modal('filt', 'Filtering Instructions', dcc.Markdown(txt))
   inputs = templates.build_card(
     'Inputs',
     dbc.Container([
       html.Div(file_uploader, className='pb-1'),
+      html.Div(chunked_upload.build_chunked_upload('filt'), className='pb-1'),
       html.Div(id='filt-file-name', className='pb-1'),
       html.Div(btn1, className='pb-1'),
       html.Div(collapse, className='pb-1'),
@@ -0,0 +1,195 @@
+"""Background jobs for long fits in the Dash app.
+Notes:
+  Callbacks submit a job and return immediately, a dcc.Interval then polls the job until it is done, so a slow fit never blocks the server.
+  Jobs run in a process pool. They report progress through a Progress object, which also raises JobCancelled once the job has been cancelled.
+  Queued jobs are cancelled right away, running jobs at their next progress update. A job cancelled after its last update
+  still ends up cancelled: its result is discarded.
+  Job state and results are kept in files, so that with several server processes any of them can poll or cancel a job.
+"""
+
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from velazquez_lab.app import sessions
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_FINISHED = ('done', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+  """Raised inside a job which has been cancelled."""
+
+
+def _job_path(directory, job_id, ext):
+  """Path of a job file. Job ids come from the browser, so anything else than a job id is rejected."""
+  if not isinstance(job_id, str) or not _JOB_ID_RE.match(job_id):
+    raise KeyError(f"Invalid job id: {job_id!r}.")
+  return os.path.join(directory, f"{job_id}.{ext}")
+
+
+def _write_atomic(path, data):
+  """Write bytes to a file, renaming it into place so readers never see a partial file."""
+  tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+  with open(tmp, 'wb') as f:
+    f.write(data)
+  os.replace(tmp, path)
+
+
+def _write_state(directory, job_id, state, done=0, total=1, message=''):
+  status = {'state': state, 'done': done, 'total': total, 'message': message}
+  _write_atomic(_job_path(directory, job_id, 'json'), json.dumps(status).encode())
+
+
+class Progress:
+  """Progress reporter handed to a job as its `progress` keyword argument.
+  Args:
+    job_id (str): job id
+    directory (str): directory of the job files
+  """
+
+  def __init__(self, job_id, directory):
+    self.job_id = job_id
+    self.directory = directory
+
+  def cancelled(self):
+    """Whether the job has been cancelled."""
+    return os.path.exists(_job_path(self.directory, self.job_id, 'cancel'))
+
+  def update(self, done, total, message=''):
+    """Report that done out of total steps are complete.
+    Raises:
+      JobCancelled: if the job has been cancelled.
+    """
+    if self.cancelled():
+      raise JobCancelled(f"Job {self.job_id} cancelled.")
+    _write_state(self.directory, self.job_id, 'running', done, total, message)
+
+
+def _run(func, args, kwargs, job_id, directory):
+  """Entry point of a job in a worker process. Errors are recorded in the job state."""
+  progress = Progress(job_id, directory)
+  try:
+    progress.update(0, 1, 'Starting')
+    result = func(*args, progress=progress, **kwargs)
+  except JobCancelled:
+    _write_state(directory, job_id, 'cancelled', message='Cancelled')
+  except Exception as exc:
+    _write_state(directory, job_id, 'failed', message=f"{type(exc).__name__}: {exc}")
+  else:
+    if progress.cancelled():  # Cancelled after the last progress update: discard the result.
+      _write_state(directory, job_id, 'cancelled', message='Cancelled')
+      return
+    _write_atomic(_job_path(directory, job_id, 'pkl'), pickle.dumps(result))
+    _write_state(directory, job_id, 'done', 1, 1)
+
+
+class JobQueue:
+  """Process pool running jobs in the background, with progress reporting and cancellation.
+  The pool is only started by the first submitted job.
+  Args:
+    max_workers (int): number of worker processes (default: $VELAZQUEZ_JOB_WORKERS, or the number of CPUs)
+    directory (str): directory of the job files (default: the 'jobs' data directory, see sessions.data_dir)
+    max_jobs (int): number of finished jobs whose process-local handles are kept
+  """
+
+  def __init__(self, max_workers=None, directory=None, max_jobs=100):
+    self.max_workers = max_workers
+    self.directory = directory
+    self.max_jobs = max_jobs
+    self._futures = dict()
+    self._lock = threading.Lock()
+    self._executor = None
+
+  def _start(self):
+    """Start the worker processes."""
+    max_workers = self.max_workers or int(os.environ.get('VELAZQUEZ_JOB_WORKERS', 0)) or None
+    ctx = multiprocessing.get_context('spawn')  # Never fork the threaded web server.
+    self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx)
+
+  def submit(self, func, *args, **kwargs):
+    """Run func(*args, progress=Progress, **kwargs) in the background.
+    Args:
+      func (callable): module-level function, so it can be pickled
+    Returns:
+      str: job id
+    """
+    with self._lock:
+      if self._executor is None:
+        self._start()
+      job_id = uuid.uuid4().hex
+      _write_state(self._dir(), job_id, 'queued', message='Queued')
+      self._futures[job_id] = self._executor.submit(_run, func, args, kwargs, job_id, self.directory)
+      done = [k for k, f in self._futures.items() if f.done()]
+      for k in done[:max(0, len(self._futures) - self.max_jobs)]:
+        self._futures.pop(k)
+    return job_id
+
+  def status(self, job_id):
+    """State of a job.
+    Returns:
+      dict:
+        state (str): 'queued', 'running', 'done', 'failed', 'cancelled' or 'unknown'
+        done, total (int): completed and total number of steps
+        message (str): progress or error message
+    """
+    try:
+      with open(_job_path(self._dir(), job_id, 'json')) as f:
+        status = json.load(f)
+    except (KeyError, FileNotFoundError):
+      return {'state': 'unknown', 'done': 0, 'total': 1, 'message': 'Job not found, please run it again.'}
+    future = self._futures.get(job_id)
+    if status['state'] not in _FINISHED and future is not None and future.done():  # The worker process died.
+      exc = None if future.cancelled() else future.exception()
+      status.update(state='failed', message=f"{type(exc).__name__}: {exc}")
+    return status
+
+  def result(self, job_id):
+    """Return value of a finished job."""
+    with open(_job_path(self._dir(), job_id, 'pkl'), 'rb') as f:
+      return pickle.load(f)
+
+  def cancel(self, job_id):
+    """Cancel a queued or running job.
+    Returns:
+      bool: whether the job was still pending.
+    """
+    if self.status(job_id)['state'] not in ('queued', 'running'):
+      return False
+    directory = self._dir()
+    _write_atomic(_job_path(directory, job_id, 'cancel'), b'')
+    future = self._futures.get(job_id)
+    if future is not None and future.cancel():  # Never started.
+      _write_state(directory, job_id, 'cancelled', message='Cancelled')
+    return True
+
+  def forget(self, job_id):
+    """Drop a job and its result."""
+    self._futures.pop(job_id, None)
+    for ext in ('json', 'pkl', 'cancel'):
+      try:
+        os.remove(_job_path(self._dir(), job_id, ext))
+      except (KeyError, FileNotFoundError):
+        pass
+
+  def _dir(self):
+    if self.directory is None:
+      self.directory = sessions.data_dir('jobs')
+    return self.directory
+
+  def shutdown(self):
+    """Stop the worker processes, cancelling queued jobs."""
+    with self._lock:
+      if self._executor is not None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._futures.clear()
+
+
+"""Job queue shared by all pages of the application."""
+JOBS = JobQueue()
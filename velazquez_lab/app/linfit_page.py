@@ -4,22 +4,22 @@ See app.py for usage.
 import dash
 from dash.dash import no_update
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
-from io import StringIO
 import numpy as np
 import os
 import pandas as pd
 import plotly.graph_objs as go
-import uncertainties as un
-from uncertainties import unumpy as unp
 
 from velazquez_lab.app import templates
-from velazquez_lab.utils.file_reading import parse_dash_file
+from velazquez_lab.app.jobs import JOBS
+from velazquez_lab.utils.file_reading import parse_dash_file, read_columns
 from velazquez_lab.utils import styles
 from velazquez_lab.utils import linear_fitting as ft
+from velazquez_lab.utils.uarray import UArray
 
 
 def create_linfit_figs(data_df, output_df):
@@ -44,21 +44,21 @@ def create_linfit_figs(data_df, output_df):
     fig_linfit.add_trace(tr)
 
   if len(output_df) > 0:
-    m_fit = un.ufloat(output_df.loc[0, 'm'], output_df.loc[0, 'm_err'])
-    b_fit = un.ufloat(output_df.loc[0, 'b'], output_df.loc[0, 'b_err'])
+    m_fit = UArray(output_df.loc[0, 'm'], output_df.loc[0, 'm_err'])
+    b_fit = UArray(output_df.loc[0, 'b'], output_df.loc[0, 'b_err'])
     interval = data_df['x'].max() - data_df['x'].min()
     x_fit = np.linspace(data_df['x'].min()-0.1*interval, data_df['x'].max()+0.1*interval, 101)
-    y_fit = ft.linear_eqn(unp.uarray(x_fit, np.zeros(x_fit.size)), m=m_fit, b=b_fit)
+    y_fit = ft.linear_eqn(x_fit, m=m_fit, b=b_fit)
 
-    tr1 = go.Scatter(x=x_fit, y=unp.nominal_values(y_fit), mode='lines', line_color=styles.COLORS[1], name=f"<b>Fit</b>")
+    tr1 = go.Scatter(x=x_fit, y=y_fit.n, mode='lines', line_color=styles.COLORS[1], name=f"<b>Fit</b>")
     fig_linfit.add_trace(tr1)
-    tr2 = go.Scatter(x=x_fit, y=unp.nominal_values(y_fit)-unp.std_devs(y_fit), mode='lines', line_color=styles.color_to_rgba(styles.COLORS[1], 0))
+    tr2 = go.Scatter(x=x_fit, y=y_fit.n-y_fit.s, mode='lines', line_color=styles.color_to_rgba(styles.COLORS[1], 0))
     fig_linfit.add_trace(tr2)
-    tr3 = go.Scatter(x=x_fit, y=unp.nominal_values(y_fit)+unp.std_devs(y_fit), mode='lines', fill='tonexty', line_color=styles.color_to_rgba(styles.COLORS[1], 0))  # , fill_color=styles.color_to_rgba(styles.COLORS[1], 0.4))
+    tr3 = go.Scatter(x=x_fit, y=y_fit.n+y_fit.s, mode='lines', fill='tonexty', line_color=styles.color_to_rgba(styles.COLORS[1], 0))  # , fill_color=styles.color_to_rgba(styles.COLORS[1], 0.4))
     fig_linfit.add_trace(tr3)
 
     # Calculate chi values.
-    _m, _b = (m_fit.n, b_fit.n)
+    _m, _b = (float(m_fit.n), float(b_fit.n))
     chi = data_df['y'] - ft.linear_eqn(data_df['x'], _m, _b)
     is_x_err = not (data_df['x_err'] == 0).all()
     is_y_err = not (data_df['y_err'] == 0).all()
@@ -77,37 +77,14 @@ def create_linfit_figs(data_df, output_df):
   return fig_linfit, fig_chi
 
 
-def create_linfit_page(app):
-  file_uploader = dcc.Upload(
-    id='linfit-upload',
-    className='file-uploader',
-    children=html.Div(['Drag-and-drop or ', html.A('select file', className='btn-link')]),
-    multiple=False,
-  )
-  table = dash_table.DataTable(
-    id='linfit-data-table',
-    columns=[
-      {'name': 'x', 'id': 'x', 'type': 'numeric',},
-      {'name': 'x errors', 'id': 'x_err', 'type': 'numeric',},
-      {'name': 'y', 'id': 'y', 'type': 'numeric',},
-      {'name': 'y errors', 'id': 'y_err', 'type': 'numeric',},
-    ],
-    data=[],
-    style_table={'overflowX': 'scroll'},
-    # style_cell={'whiteSpace': 'normal', 'height': 'auto'},
-    # tooltip_duration=None,
-    # style_cell={
-    #     'overflow': 'hidden',
-    #     'textOverflow': 'ellipsis',
-    #     'maxWidth': 0,
-    # },
-    editable=True,
-    row_deletable=True,
-  )
-  btn_row = dbc.Button('Add row', n_clicks=0, id='linfit-addrow-btn', className='btn-block btn-primary mr-1')
+def fit_linear_job(x, y, x_err, y_err, progress):
+  """Linear fit in a background worker. See linfit_callback."""
+  return ft.linear_fit(x, y, x_err=x_err, y_err=y_err, is_verbose=True, progress=progress)
 
-  output_storage = dcc.Store(data=dict(), id='linfit-output-storage', storage_type='memory')
-  btn_fit = dbc.Button('Fit', n_clicks=0, id='linfit-fit-btn', className='btn-block btn-primary mr-1')
+
+def register_linfit_callbacks(app):
+  """Register callbacks of the linear fitting page."""
+  templates.register_modal_callbacks(app, 'linfit')
 
   @app.callback(
     Output('linfit-data-table', 'data'),
@@ -116,20 +93,51 @@ def create_linfit_page(app):
     Output('linfit-chi-graph', 'figure'),
     Output('linfit-fit-eqn', 'children'),
     Output('linfit-fit-chisq', 'children'),
+    Output('linfit-job-storage', 'data'),
+    Output('linfit-job-status', 'hidden'),
+    Output('linfit-job-progress', 'value'),
+    Output('linfit-job-progress', 'children'),
+    Output('linfit-job-interval', 'disabled'),
     Input('linfit-upload', 'contents'),
     Input('linfit-addrow-btn', 'n_clicks'),
     Input('linfit-fit-btn', 'n_clicks'),
+    Input('linfit-job-interval', 'n_intervals'),
+    Input('linfit-job-cancel-btn', 'n_clicks'),
     # Input('linfit-download-button', 'n_clicks'),
     State('linfit-data-table', 'data'),
     State('linfit-data-table', 'columns'),
     State('linfit-output-storage', 'data'),
+    State('linfit-job-storage', 'data'),
   )
-  def linfit_callback(new_file_content, n_clicks_adrow, n_clicks_fit, data_df, data_columns, output_df):  # n_clicks_download,
+  def linfit_callback(new_file_content, n_clicks_adrow, n_clicks_fit, n_intervals, cancel_clicks, data_df, data_columns, output_df, job):  # n_clicks_download,
     """Link filtering elements together."""
     """Get id of component which triggered the callback."""
     ctx = dash.callback_context
     trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
 
+    """Background fit: cancel it, or poll it until it is done."""
+    if trig_id == 'linfit-job-cancel-btn':
+      if 'id' in job:
+        JOBS.cancel(job['id'])
+      raise PreventUpdate  # The next poll reports the cancellation.
+    job_outputs = templates.job_status_outputs(None)
+    if trig_id == 'linfit-job-interval':
+      if 'id' not in job:
+        raise PreventUpdate
+      status = JOBS.status(job['id'])
+      job_outputs = templates.job_status_outputs(status)
+      if status['state'] in ('queued', 'running'):
+        return (*(no_update for _ in range(6)), no_update, *job_outputs)
+      result = JOBS.result(job['id']) if status['state'] == 'done' else None
+      JOBS.forget(job['id'])
+      if result is None:  # Failed or cancelled, the progress bar shows why.
+        return (*(no_update for _ in range(6)), dict(), *job_outputs)
+      job = dict()
+    elif 'id' in job:  # Any other change supersedes the running fit.
+      JOBS.cancel(job['id'])
+      JOBS.forget(job['id'])
+      job = dict()
+
     data_df = pd.DataFrame.from_dict(data_df)
     if len(data_df.columns) == 0:
       data_df = pd.DataFrame(columns=[c['id'] for c in data_columns])
@@ -140,8 +148,7 @@ def create_linfit_page(app):
     redchi_text = ''
 
     if trig_id == 'linfit-upload':
-      f = parse_dash_file(new_file_content)
-      data_df = pd.read_table(f, header=0, sep=',')
+      data_df = pd.DataFrame(read_columns(parse_dash_file(new_file_content)))
 
     elif trig_id == 'linfit-addrow-btn':
       data_df = data_df.append(pd.Series({c: None for c in data_df.columns}), ignore_index=True)
@@ -149,7 +156,11 @@ def create_linfit_page(app):
     elif trig_id == 'linfit-fit-btn':
       x_err = None if (data_df['x_err'] == 0).all() else data_df['x_err']
       y_err = None if (data_df['y_err'] == 0).all() else data_df['y_err']
-      m_fit, b_fit, redchi = ft.linear_fit(data_df['x'], data_df['y'], x_err=x_err, y_err=y_err, is_verbose=True)
+      job_id = JOBS.submit(fit_linear_job, data_df['x'], data_df['y'], x_err, y_err)
+      return (*(no_update for _ in range(6)), {'id': job_id}, *templates.job_status_outputs(JOBS.status(job_id)))
+
+    elif trig_id == 'linfit-job-interval':  # Background fit done.
+      m_fit, b_fit, redchi = result
       output_df = pd.DataFrame.from_dict({
         'm': [m_fit.n],
         'm_err': [m_fit.s],
@@ -171,14 +182,49 @@ def create_linfit_page(app):
       fig_chi,
       linfit_eqn,
       redchi_text,
+      job,
+      *job_outputs,
     ])
     return outputs
 
+
+def create_linfit_page():
+  file_uploader = dcc.Upload(
+    id='linfit-upload',
+    className='file-uploader',
+    children=html.Div(['Drag-and-drop or ', html.A('select file', className='btn-link')]),
+    multiple=False,
+  )
+  table = dash_table.DataTable(
+    id='linfit-data-table',
+    columns=[
+      {'name': 'x', 'id': 'x', 'type': 'numeric',},
+      {'name': 'x errors', 'id': 'x_err', 'type': 'numeric',},
+      {'name': 'y', 'id': 'y', 'type': 'numeric',},
+      {'name': 'y errors', 'id': 'y_err', 'type': 'numeric',},
+    ],
+    data=[],
+    style_table={'overflowX': 'scroll'},
+    # style_cell={'whiteSpace': 'normal', 'height': 'auto'},
+    # tooltip_duration=None,
+    # style_cell={
+    #     'overflow': 'hidden',
+    #     'textOverflow': 'ellipsis',
+    #     'maxWidth': 0,
+    # },
+    editable=True,
+    row_deletable=True,
+  )
+  btn_row = dbc.Button('Add row', n_clicks=0, id='linfit-addrow-btn', className='btn-block btn-primary mr-1')
+
+  output_storage = dcc.Store(data=dict(), id='linfit-output-storage', storage_type='memory')
+  btn_fit = dbc.Button('Fit', n_clicks=0, id='linfit-fit-btn', className='btn-block btn-primary mr-1')
+
   """Layout."""
   fpath = os.path.dirname(os.path.realpath(__file__))
   f = open(f"{fpath}/../../docs/linear_fitting.md", 'r')
   txt = f.read()
-  info = templates.build_modal(app, 'linfit', 'Linear Fitting Instructions', dcc.Markdown(txt))
+  info = templates.build_modal('linfit', 'Linear Fitting Instructions', dcc.Markdown(txt))
   inputs = templates.build_card(
     'Inputs',
     dbc.Container([
@@ -186,6 +232,7 @@ def create_linfit_page(app):
       html.Div(table),
       html.Div(btn_row, className='pb-1'),
       html.Div(btn_fit, className='pb-1'),
+      templates.build_job_status('linfit'),
       output_storage,
     ]),
     info=info
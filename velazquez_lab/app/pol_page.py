@@ -8,18 +8,24 @@ import dash_html_components as html
 from velazquez_lab.app import ecsa_section, tafel_section
 
 
-def create_pol_page(app):
+def register_pol_callbacks(app):
+  """Register callbacks of the polarization curve page."""
+  ecsa_section.register_ecsa_callbacks(app)
+  tafel_section.register_tafel_callbacks(app)
+
+
+def create_pol_page():
   pg = dbc.Container(
     [
       html.Div('Electrochemical Surface Area', className='section-header mb-1'),
-      ecsa_section.build_ecsa_row(app),
+      ecsa_section.build_ecsa_row(),
       html.Hr(className='section-hr'),
       html.Div('Polarization Curves & Tafel Slope', className='section-header mb-1'),
-      tafel_section.build_tafel_row(app),
+      tafel_section.build_tafel_row(),
       html.Hr(className='section-hr'),
     ],
     className='page-content',
     fluid=True
   )
 
-  return pg
\ No newline at end of file
+  return pg
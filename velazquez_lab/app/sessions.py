@@ -0,0 +1,102 @@
+"""Per-session state of the Dash app when it is served to many users.
+Notes:
+  Each browser gets a session cookie, and each session gets its own result directory, so exported files of different users never collide.
+  Server state shared by the worker processes of a multi-worker server (spilled datasets, background jobs) lives under the same data directory.
+  The data directory is $VELAZQUEZ_DATA_DIR, or a velazquez_lab folder in the temporary directory.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import flask
+
+COOKIE_NAME = 'velazquez_session'
+MAX_AGE = 24*3600  # Time (in s) after which an unused session is deleted.
+CLEANUP_INTERVAL = 600  # Minimum time (in s) between two cleanups by a server process.
+_last_cleanup = {'time': 0.0}
+_cleanup_lock = threading.Lock()
+_SESSION_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def data_dir(*parts):
+  """Directory of server data shared by all worker processes, created if needed.
+  Args:
+    *parts (str): subdirectory, e.g. 'datasets'
+  Returns:
+    str: path
+  """
+  root = os.environ.get('VELAZQUEZ_DATA_DIR') or os.path.join(tempfile.gettempdir(), 'velazquez_lab')
+  path = os.path.join(root, *parts)
+  os.makedirs(path, exist_ok=True)
+  return path
+
+
+def session_id():
+  """Id of the session of the current request, or 'default' outside of a request (e.g. in a notebook)."""
+  if not flask.has_request_context():
+    return 'default'
+  sid = flask.g.get('session_id') or flask.request.cookies.get(COOKIE_NAME, '')
+  return sid if _SESSION_RE.match(sid) else 'default'
+
+
+def session_dir():
+  """Result directory of the current session, created if needed."""
+  return data_dir('sessions', session_id())
+
+
+def init_sessions(server, max_age=MAX_AGE, interval=CLEANUP_INTERVAL):
+  """Give each browser a session cookie and delete sessions unused for more than max_age seconds.
+  Cleanup runs at startup, then on the first request after every interval seconds, so a long-running server keeps
+  its data directory bounded.
+  Args:
+    server (flask.Flask): server of the Dash app
+    max_age (float): session lifetime (in s)
+    interval (float): minimum time (in s) between two cleanups
+  """
+  @server.before_request
+  def _assign_session():
+    sid = flask.request.cookies.get(COOKIE_NAME, '')
+    if not _SESSION_RE.match(sid):
+      flask.g.session_id = uuid.uuid4().hex
+      flask.g.new_session = True
+    maybe_cleanup(max_age, interval)
+
+  @server.after_request
+  def _set_cookie(response):
+    if flask.g.get('new_session'):
+      response.set_cookie(COOKIE_NAME, flask.g.session_id, max_age=int(max_age), httponly=True, samesite='Lax')
+    return response
+
+  maybe_cleanup(max_age, interval)
+
+
+def maybe_cleanup(max_age=MAX_AGE, interval=CLEANUP_INTERVAL):
+  """Run cleanup in a background thread, unless this process ran it less than interval seconds ago."""
+  with _cleanup_lock:
+    now = time.time()
+    if now - _last_cleanup['time'] < interval:
+      return
+    _last_cleanup['time'] = now
+  threading.Thread(target=cleanup, args=(max_age,), daemon=True).start()
+
+
+def cleanup(max_age=MAX_AGE):
+  """Delete session directories, spilled datasets and job files unused for more than max_age seconds."""
+  now = time.time()
+  for sub in ('sessions', 'datasets', 'jobs'):
+    root = data_dir(sub)
+    for name in os.listdir(root):
+      path = os.path.join(root, name)
+      try:
+        if now - os.path.getmtime(path) <= max_age:
+          continue
+        if os.path.isdir(path):
+          shutil.rmtree(path, ignore_errors=True)
+        else:
+          os.remove(path)
+      except FileNotFoundError:  # Removed by another worker.
+        pass
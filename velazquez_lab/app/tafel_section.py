@@ -7,6 +7,7 @@ Notes:
 import dash
 from dash.dash import no_update
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
@@ -16,52 +17,136 @@ import os
 import pandas as pd
 import plotly.graph_objs as go
 
-from velazquez_lab.app import templates
+from velazquez_lab.app import sessions, templates
+from velazquez_lab.app.dataset_cache import DATASETS, upload_key
+from velazquez_lab.app.jobs import JOBS
 from velazquez_lab.pol import tafel_slope
-from velazquez_lab.utils import styles
+from velazquez_lab.utils import plotting, styles
 from velazquez_lab.utils.file_reading import parse_dash_file
 
 
-def build_tafel_figs(file_df, result_storage, sa_val, sa_type, log_i_range=None, e_range=None):
-  """Initialize figures."""
-  fig_raw, fig_pol, fig_tafel = ( go.Figure() for _ in range(3) )
-  fig_raw.update_layout(xaxis_title='<b>E<sub>WE</sub> (V vs Ag/AgCl)</b>', yaxis_title='<b>I (mA)</b>', showlegend=False)
-  fig_pol.update_layout(xaxis_title='<b>E<sub>WE</sub> (V vs RHE)</b>', yaxis_title=f'<b><i>j</i> (mA/cm<sup>2</sup><sub>{sa_type}</sub>)</b>', showlegend=False)
-  fig_tafel.update_layout(xaxis_title=f'<b>log<sub>10</sub>(mA/cm<sup>2</sup><sub>{sa_type}</sub>)</b>', yaxis_title='<b>E<sub>WE</sub> (V vs RHE)</b>', showlegend=True)
+"""Draw the fit range and fit line on the base Tafel figure in the browser, so range changes need no server round trip."""
+TAFEL_FIG_JS = """
+function(base, result, e_min, e_max, log_i_min, log_i_max) {
+  if (!base) {
+    return window.dash_clientside.no_update;
+  }
+  var data = base.data.slice();
+  var layout = Object.assign({}, base.layout);
+  if (data.length > 1) {
+    var xr = layout.xaxis.range, yr = layout.yaxis.range;
+    var box = {type: 'rect', fillcolor: 'rgba(220,220,220,0.5)', line: {color: 'rgba(0,0,0,0)'}};
+    var vrect = function(x0, x1) { return Object.assign({xref: 'x', yref: 'y domain', x0: x0, x1: x1, y0: 0, y1: 1}, box); };
+    var hrect = function(y0, y1) { return Object.assign({xref: 'x domain', yref: 'y', x0: 0, x1: 1, y0: y0, y1: y1}, box); };
+    layout.shapes = [];
+    if (log_i_min !== null && log_i_max !== null) {
+      layout.shapes.push(vrect(xr[0], log_i_min), vrect(log_i_max, xr[1]));
+    }
+    if (e_min !== null && e_max !== null) {
+      layout.shapes.push(hrect(yr[0], e_min), hrect(e_max, yr[1]));
+    }
+    if (result && result.e) {
+      data[1] = Object.assign({}, data[1], {x: result.log_i, y: result.e, visible: true});
+    }
+  }
+  return {data: data, layout: layout};
+}
+"""
+
+
+"""Fit preview from the curve sorted by potential: the potential range is a slice, summed after centering on the curve means."""
+TAFEL_PREVIEW_JS = """
+function(pre, e_min, e_max, log_i_min, log_i_max) {
+  if (!pre || e_min === null || e_max === null || log_i_min === null || log_i_max === null) {
+    return '';
+  }
+  var e = pre.e, log_i = pre.log_i;
+  var search = function(v, strict) {
+    var lo = 0, hi = e.length;
+    while (lo < hi) {
+      var mid = (lo + hi) >> 1;
+      if (e[mid] < v || (strict && e[mid] === v)) { lo = mid + 1; } else { hi = mid; }
+    }
+    return lo;
+  };
+  var a = search(e_min, false), b = search(e_max, true);
+  var n = 0, sx = 0, sy = 0, sxy = 0, sxx = 0, syy = 0;
+  for (var k = a; k < b; k++) {
+    if (log_i[k] >= log_i_min && log_i[k] <= log_i_max) {
+      var dx = e[k] - pre.xm, dy = log_i[k] - pre.ym;
+      n += 1; sx += dx; sy += dy; sxy += dx*dy; sxx += dx*dx; syy += dy*dy;
+    }
+  }
+  if (n < 3) {
+    return 'Preview: fewer than 3 points in range';
+  }
+  var cxy = n*sxy - sx*sy, cxx = n*sxx - sx*sx, cyy = n*syy - sy*sy;
+  var slope = Math.abs(1000*cxx/cxy);
+  return 'Preview: ' + slope.toPrecision(4) + ' mV/decade (r² = ' + (cxy*cxy/(cxx*cyy)).toFixed(3) + ', ' + n + ' points)';
+}
+"""
+
 
+def build_raw_fig(file_df, x_range=None, uirevision=None):
+  """Raw polarization curve, decimated to the zoomed potential range."""
+  fig = go.Figure()
+  fig.update_layout(xaxis_title='<b>E<sub>WE</sub> (V vs Ag/AgCl)</b>', yaxis_title='<b>I (mA)</b>', showlegend=False, uirevision=uirevision)
   if len(file_df) > 0:
-    """Raw polarization curve."""
-    trace = go.Scatter(x=file_df['E'], y=file_df['I'], mode='lines', line_color=styles.COLORS[0], name='Data')
-    fig_raw.add_trace(trace)
+    fig.add_trace(plotting.build_scatter(file_df['E'], file_df['I'], x_range=x_range, mode='lines', line_color=styles.COLORS[0], name='Data'))
+  return fig
 
-    """Corrected polarization curve."""
-    trace = go.Scatter(x=file_df['E_rhe'], y=file_df['I_sa'], mode='lines', line_color=styles.COLORS[0], name='Data')
-    fig_pol.add_trace(trace)
 
-    """Tafel slope."""
-    trace = go.Scatter(x=file_df['log10_I_sa'], y=file_df['E_rhe'], mode='lines', line_color=styles.COLORS[0], name='Data')
-    fig_tafel.add_trace(trace)
+def build_corr_fig(file_df, sa_type, x_range=None, uirevision=None):
+  """Corrected polarization curve, decimated to the zoomed potential range."""
+  fig = go.Figure()
+  fig.update_layout(xaxis_title='<b>E<sub>WE</sub> (V vs RHE)</b>', yaxis_title=f'<b><i>j</i> (mA/cm<sup>2</sup><sub>{sa_type}</sub>)</b>', showlegend=False, uirevision=uirevision)
+  if len(file_df) > 0:
+    fig.add_trace(plotting.build_scatter(file_df['E_rhe'], file_df['I_sa'], x_range=x_range, mode='lines', line_color=styles.COLORS[0], name='Data'))
+  return fig
 
-    """Draw fit region."""
-    box_args = dict(fillcolor='rgba(220,220,220,0.5)', line=dict(color='rgba(0,0,0,0)'))
+
+def build_tafel_fig(file_df, sa_type, x_range=None, uirevision=None):
+  """Tafel plot with a hidden fit trace. The fit range and fit line are filled in by TAFEL_FIG_JS."""
+  fig = go.Figure()
+  fig.update_layout(xaxis_title=f'<b>log<sub>10</sub>(mA/cm<sup>2</sup><sub>{sa_type}</sub>)</b>', yaxis_title='<b>E<sub>WE</sub> (V vs RHE)</b>', showlegend=True, uirevision=uirevision)
+  if len(file_df) > 0:
+    fig.add_trace(plotting.build_scatter(file_df['log10_I_sa'], file_df['E_rhe'], x_range=x_range, mode='lines', line_color=styles.COLORS[0], name='Data'))
+    fig.add_trace(go.Scatter(x=[], y=[], mode='lines', line=dict(color=styles.COLORS[1], dash='dash'), name='Fit', visible=False))
     x_range, y_range = styles.get_axes_ranges(file_df['log10_I_sa'], y=file_df['E_rhe'])
-    fig_tafel.update_xaxes(range=x_range)
-    fig_tafel.update_yaxes(range=y_range)
-    if log_i_range is not None:
-      fig_tafel.add_vrect(x0=x_range[0], x1=log_i_range[0], **box_args)
-      fig_tafel.add_vrect(x0=log_i_range[1], x1=x_range[1], **box_args)
-    if e_range is not None:
-      fig_tafel.add_hrect(y0=y_range[0], y1=e_range[0], **box_args)
-      fig_tafel.add_hrect(y0=e_range[1], y1=y_range[1], **box_args)
+    fig.update_xaxes(range=x_range)
+    fig.update_yaxes(range=y_range)
+  return fig
+
+
+def build_output_df(data, fit):
+  """Data and fit results for download."""
+  output_df = pd.DataFrame(data)
+  output_df.insert(len(output_df.columns), 'tafel_slope', pd.Series([fit['tafel_slope']]))
+  output_df.insert(len(output_df.columns), 'rsq', pd.Series([fit['rsq']]))
+  output_df.insert(len(output_df.columns), 'tafel_fit_e', pd.Series(fit['e']))
+  output_df.insert(len(output_df.columns), 'tafel_fit_logi', pd.Series(fit['log_i']))
+  return output_df
+
 
-  if len(result_storage)>0:
-    trace = go.Scatter(x=result_storage['log_i'], y=result_storage['e'], mode='lines', line=dict(color=styles.COLORS[1], dash='dash'), name='Fit')
-    fig_tafel.add_trace(trace)
+"""Keys of a Tafel fit result, in the order returned by tafel_slope.fit_tafel_slope_lsq."""
+FIT_KEYS = ('tafel_slope', 'rsq', 'e', 'log_i')
 
-  return fig_raw, fig_pol, fig_tafel
 
+def fit_tafel_job(e, log_i, fitmethod, model, progress):
+  """Fit the Tafel slope in a background worker. See tafel_fit_callback.
+  Returns:
+    dict: tafel_slope, rsq, e and log_i of the fit curve
+  """
+  if fitmethod == 'lsq':
+    fit = dict(zip(FIT_KEYS, tafel_slope.fit_tafel_slope_lsq(e, log_i, model=model, progress=progress)))
+  # elif fitmethod == 'bayesian':
+    # tafel_slope_val, rsq, res_voltages, res_log_currents = tafel_slope.fit_tafel_slope_bayesian(e, log_i, model=model)
+  else:
+    raise ValueError(f"Fit method '{fitmethod}' not implemented.")
+  return fit
 
-def build_tafel_inputs(app):
+
+def build_tafel_inputs():
   """Create inputs."""
   content = list()
 
@@ -73,11 +158,16 @@ def build_tafel_inputs(app):
     multiple=False,
   )
   file_display = html.Div(id='tafel-file-display')
-  storage = dcc.Store(data=dict(), id='tafel-file-storage', storage_type='memory')
+  storage = html.Div([
+    dcc.Store(data=dict(), id='tafel-file-storage', storage_type='memory'),
+    dcc.Store(data=dict(), id='tafel-derived-storage', storage_type='memory'),
+    dcc.Store(data=None, id='tafel-base-storage', storage_type='memory'),
+    dcc.Store(data=None, id='tafel-preview-storage', storage_type='memory'),
+  ])
 
   btn1 = dbc.InputGroup([
     dbc.InputGroupAddon('Surface area', addon_type='prepend'),
-    dbc.Input(id='tafel-sa-input', value=1, type='number', required=True, step='any', placeholder='ECSA value'),
+    dbc.Input(id='tafel-sa-input', value=1, type='number', required=True, step='any', placeholder='ECSA value', debounce=True),
     dbc.InputGroupAddon('cm2', addon_type='append'),
   ])
   btn2 = dbc.InputGroup([
@@ -95,11 +185,11 @@ def build_tafel_inputs(app):
   ])
   btn3 = dbc.InputGroup([
     dbc.InputGroupAddon('pH', addon_type='prepend'),
-    dbc.Input(id='tafel-ph-input', value=3, type='number', required=True, step='any', placeholder='pH level'),
+    dbc.Input(id='tafel-ph-input', value=3, type='number', required=True, step='any', placeholder='pH level', debounce=True),
   ])
   btn4 = dbc.InputGroup([
     dbc.InputGroupAddon('Ru', addon_type='prepend'),
-    dbc.Input(id='tafel-ru-input', value=0, type='number', required=True, step='any', placeholder='Uncompensated resistance value'),
+    dbc.Input(id='tafel-ru-input', value=0, type='number', required=True, step='any', placeholder='Uncompensated resistance value', debounce=True),
     dbc.InputGroupAddon('UNITS', addon_type='append'),
   ])
   content.append(dbc.Container([
@@ -159,13 +249,19 @@ def build_tafel_inputs(app):
       ),
     ]
   )
+  preview = html.Div([
+    dbc.Checklist(id='tafel-preview-toggle', options=[{'label': 'Live fit preview', 'value': 'preview'}], value=[], switch=True),
+    html.Div(id='tafel-preview-val', className='text-muted'),
+  ])
   btn_run = dbc.Button('Calculate Tafel slope', className='btn-block btn-primary', id='tafel-run-btn', n_clicks=0)
   content.append(dbc.Container([
     html.Div(btn1, className='pb-1'),
     html.Div(btn2, className='pb-1'),
     html.Div(btn3, className='pb-1'),
     html.Div(btn4, className='pb-1'),
+    html.Div(preview, className='pb-1'),
     html.Div(btn_run, className=''),
+    templates.build_job_status('tafel'),
   ]))
 
   """Fit output display."""
@@ -187,129 +283,259 @@ def build_tafel_inputs(app):
   fpath = os.path.dirname(os.path.realpath(__file__))
   f = open(f"{fpath}/../../docs/tafel.md", 'r')
   txt = f.read()
-  info = templates.build_modal(app, 'tafel', 'Polarization Curve & Tafel Slope Instructions', dcc.Markdown(txt))
+  info = templates.build_modal('tafel', 'Polarization Curve & Tafel Slope Instructions', dcc.Markdown(txt))
   layout = templates.build_card('Inputs', content, info=info)
   return layout
 
 
-def build_tafel_row(app):
-  """Create content for Tafel slope row."""
+def register_tafel_callbacks(app):
+  """Register callbacks of the Tafel slope section."""
+  templates.register_modal_callbacks(app, 'tafel')
 
   @app.callback(
     Output('tafel-file-display', 'children'),
     Output('tafel-file-storage', 'data'),
+    Input('tafel-upload', 'contents'),
+    State('tafel-upload', 'filename'),
+  )
+  def tafel_upload_callback(new_file_content, new_file_name):
+    """Parse an uploaded file into the dataset cache. Only its key is sent to the browser."""
+    if new_file_content is None:
+      raise PreventUpdate
+    def load():
+      file_df = tafel_slope.load_tafel_data(parse_dash_file(new_file_content))
+      file_df = file_df[file_df['I'] != 0]  # Remove zeros.
+      return {c: file_df[c].to_numpy() for c in file_df}
+    key = upload_key(new_file_content, prefix='tafel-')
+    DATASETS.get_or_load(key, load)
+    return new_file_name, {'key': key}
+
+  @app.callback(
+    Output('pol-raw-graph', 'figure'),
+    Input('tafel-file-storage', 'data'),
+    Input('pol-raw-graph', 'relayoutData'),
+  )
+  def tafel_raw_callback(file_storage, relayout_data):
+    """Raw polarization curve. Only sent once per upload, and again at full resolution for the zoomed range."""
+    ctx = dash.callback_context
+    trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+    zoomed, x_range = plotting.zoom_range(relayout_data)
+    if trig_id == 'pol-raw-graph' and not zoomed:
+      raise PreventUpdate
+    file_df = pd.DataFrame(DATASETS[file_storage['key']] if 'key' in file_storage else {})
+    return build_raw_fig(file_df, x_range=x_range if trig_id == 'pol-raw-graph' else None, uirevision=file_storage.get('key'))
+
+  @app.callback(
+    Output('tafel-derived-storage', 'data'),
     Output('tafel-emin-input', 'value'),
     Output('tafel-emax-input', 'value'),
     Output('tafel-logimin-input', 'value'),
     Output('tafel-logimax-input', 'value'),
-    Output('pol-raw-graph', 'figure'),
-    Output('pol-corr-graph', 'figure'),
-    Output('tafel-graph', 'figure'),
-    Output('tafel-result-storage', 'data'),
-    Output('tafel-slope-val', 'children'),
-    Output('tafel-fit-output', 'is_open'),
-    Output('tafel-download-dataframe-csv', 'data'),
-    Input('tafel-upload', 'filename'),
-    Input('tafel-run-btn', 'n_clicks'),
+    Input('tafel-file-storage', 'data'),
     Input('tafel-sa-input', 'value'),
-    Input('tafel-satype-input', 'value'),
     Input('tafel-ph-input', 'value'),
     Input('tafel-ru-input', 'value'),
+  )
+  def tafel_derived_callback(file_storage, sa_val, ph, ru):
+    """Correct and normalize the polarization curve. Only runs when the data, pH, Ru or surface area change."""
+    if 'key' not in file_storage:
+      return dict(), no_update, no_update, no_update, no_update
+    if None in (sa_val, ph, ru):  # Input box is being edited.
+      raise PreventUpdate
+
+    def derive():
+      data = DATASETS[file_storage['key']]
+      i_sa = data['I'] / sa_val
+      return {
+        'E': data['E'],
+        'I': data['I'],
+        'E_rhe': tafel_slope.corrected_potential(data['E'], data['I'], ph, ru),
+        'I_sa': i_sa,
+        'log10_I_sa': np.log10(np.abs(i_sa)),
+      }
+    key = f"{file_storage['key']}-{ph}-{ru}-{sa_val}"
+    file_df = pd.DataFrame(DATASETS.get_or_load(key, derive))
+
+    e_min = float(f"{file_df['E_rhe'].min():.4g}")
+    e_max = float(f"{file_df['E_rhe'].max():.4g}")
+    log_i_min = float(f"{file_df['log10_I_sa'].min():.4g}")
+    log_i_max = float(f"{file_df['log10_I_sa'].max():.4g}")
+    return {'key': key}, e_min, e_max, log_i_min, log_i_max
+
+  @app.callback(
+    Output('pol-corr-graph', 'figure'),
+    Input('tafel-derived-storage', 'data'),
+    Input('tafel-satype-input', 'value'),
+    Input('pol-corr-graph', 'relayoutData'),
+  )
+  def tafel_corr_callback(derived_storage, sa_type, relayout_data):
+    """Corrected polarization curve, re-sent at full resolution for the zoomed range."""
+    ctx = dash.callback_context
+    trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+    zoomed, x_range = plotting.zoom_range(relayout_data)
+    if trig_id == 'pol-corr-graph' and not zoomed:
+      raise PreventUpdate
+    file_df = pd.DataFrame(DATASETS[derived_storage['key']] if 'key' in derived_storage else {})
+    return build_corr_fig(file_df, sa_type, x_range=x_range if trig_id == 'pol-corr-graph' else None, uirevision=derived_storage.get('key'))
+
+  @app.callback(
+    Output('tafel-base-storage', 'data'),
+    Input('tafel-derived-storage', 'data'),
+    Input('tafel-satype-input', 'value'),
+    Input('tafel-graph', 'relayoutData'),
+  )
+  def tafel_base_callback(derived_storage, sa_type, relayout_data):
+    """Tafel plot without the fit range, re-sent at full resolution for the zoomed range."""
+    ctx = dash.callback_context
+    trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+    zoomed, x_range = plotting.zoom_range(relayout_data)
+    if trig_id == 'tafel-graph' and not zoomed:
+      raise PreventUpdate
+    file_df = pd.DataFrame(DATASETS[derived_storage['key']] if 'key' in derived_storage else {})
+    return build_tafel_fig(file_df, sa_type, x_range=x_range if trig_id == 'tafel-graph' else None, uirevision=derived_storage.get('key'))
+
+  app.clientside_callback(
+    TAFEL_FIG_JS,
+    Output('tafel-graph', 'figure'),
+    Input('tafel-base-storage', 'data'),
+    Input('tafel-result-storage', 'data'),
     Input('tafel-emin-input', 'value'),
     Input('tafel-emax-input', 'value'),
     Input('tafel-logimin-input', 'value'),
     Input('tafel-logimax-input', 'value'),
-    Input('tafel-download-btn', 'n_clicks'),
+  )
+
+  @app.callback(
+    Output('tafel-preview-storage', 'data'),
+    Input('tafel-derived-storage', 'data'),
+    Input('tafel-preview-toggle', 'value'),
+  )
+  def tafel_preview_callback(derived_storage, preview):
+    """Send the current curve, sorted by potential, once. The preview itself is computed in the browser.
+    Only the two sorted arrays and their means are sent: summing a slice in the browser is cheap, prefix sums would
+    more than triple the payload.
+    """
+    if 'key' not in derived_storage or 'preview' not in preview:
+      return None
+    data = DATASETS[derived_storage['key']]
+    order = np.argsort(data['E_rhe'], kind='stable')
+    e, log_i = data['E_rhe'][order], data['log10_I_sa'][order]
+    return dict(e=e, log_i=log_i, xm=float(e.mean()), ym=float(log_i.mean()))
+
+  app.clientside_callback(
+    TAFEL_PREVIEW_JS,
+    Output('tafel-preview-val', 'children'),
+    Input('tafel-preview-storage', 'data'),
+    Input('tafel-emin-input', 'value'),
+    Input('tafel-emax-input', 'value'),
+    Input('tafel-logimin-input', 'value'),
+    Input('tafel-logimax-input', 'value'),
+  )
+
+  @app.callback(
+    Output('tafel-result-storage', 'data'),
+    Output('tafel-slope-val', 'children'),
+    Output('tafel-fit-output', 'is_open'),
+    Output('tafel-job-storage', 'data'),
+    Output('tafel-job-status', 'hidden'),
+    Output('tafel-job-progress', 'value'),
+    Output('tafel-job-progress', 'children'),
+    Output('tafel-job-interval', 'disabled'),
+    Input('tafel-run-btn', 'n_clicks'),
+    Input('tafel-derived-storage', 'data'),
+    Input('tafel-job-interval', 'n_intervals'),
+    Input('tafel-job-cancel-btn', 'n_clicks'),
+    State('tafel-emin-input', 'value'),
+    State('tafel-emax-input', 'value'),
+    State('tafel-logimin-input', 'value'),
+    State('tafel-logimax-input', 'value'),
     State('tafel-fitmethod-input', 'value'),
     State('tafel-model-input', 'value'),
-    State('tafel-upload', 'contents'),
-    State('tafel-file-storage', 'data'),
-    State('tafel-result-storage', 'data'),
+    State('tafel-job-storage', 'data'),
   )
-  def tafel_fit_callback(new_file_name, run_btn_clicks, sa_val, sa_type, ph, ru, e_min, e_max, log_i_min, log_i_max, n_clicks_download, fitmethod, model, new_file_content, file_storage, result_storage):
-    """Link Tafel slope elements together."""
+  def tafel_fit_callback(run_btn_clicks, derived_storage, n_intervals, cancel_clicks, e_min, e_max, log_i_min, log_i_max, fitmethod, model, job):
+    """Fit the Tafel slope in the background and poll the fit until it is done. New data clears the previous fit."""
     ctx = dash.callback_context
     trig_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
 
-    """Get values from storage"""
-    file_df = pd.DataFrame.from_dict(file_storage)
-    file_name = no_update
-    tafel_slope_val = no_update
-    is_fitoutput_open = False
-    download = None
+    if trig_id == 'tafel-job-cancel-btn':
+      if 'id' in job:
+        JOBS.cancel(job['id'])
+      raise PreventUpdate  # The next poll reports the cancellation.
 
-    if trig_id == 'tafel-upload':  # New file uploaded.
-      file_df = tafel_slope.load_tafel_data(parse_dash_file(new_file_content))
-      file_df= file_df[file_df['I'] != 0]  # Remove zeros.
-      for c in ['E_rhe', 'I_sa', 'log10_I_sa']:
-        file_df.insert(len(file_df.columns), c, np.full(len(file_df), np.nan))
-      file_name = new_file_name
-
-    if len(file_df) > 0:
-      file_df['E_rhe'] = tafel_slope.corrected_potential(file_df['E'], file_df['I'], ph, ru)
-      file_df['I_sa'] = file_df['I'] / sa_val
-      file_df['log10_I_sa'] = np.log10(np.abs(file_df['I_sa']))
-
-      if trig_id in ['tafel-upload', 'tafel-sa-input', 'tafel-ph-input', 'tafel-ru-input']:
-        e_min = float(f"{file_df['E_rhe'].min():.4g}")
-        e_max = float(f"{file_df['E_rhe'].max():.4g}")
-        log_i_min = float(f"{file_df['log10_I_sa'].min():.4g}")
-        log_i_max = float(f"{file_df['log10_I_sa'].max():.4g}")
-
-    if trig_id == 'tafel-run-btn':
-      e, log_i = file_df['E_rhe'].to_numpy(), file_df['log10_I_sa'].to_numpy()
+    if trig_id != 'tafel-job-interval':
+      if 'id' in job:  # A new fit or new data supersedes the running fit.
+        JOBS.cancel(job['id'])
+        JOBS.forget(job['id'])
+      if trig_id != 'tafel-run-btn' or 'key' not in derived_storage:
+        return (dict(), no_update, False, dict(), *templates.job_status_outputs(None))
+
+      """Submit the fit, unless the same fit of the same data has already been done."""
+      data = DATASETS[derived_storage['key']]
+      e, log_i = data['E_rhe'], data['log10_I_sa']
       mask = (e>=e_min) & (e<=e_max) & (log_i>=log_i_min) & (log_i<=log_i_max)
-      e, log_i = e[mask], log_i[mask]
-      if fitmethod == 'lsq':
-        result_storage['tafel_slope'], result_storage['rsq'], result_storage['e'], result_storage['log_i'] = tafel_slope.fit_tafel_slope_lsq(e, log_i, model=model)
-        tafel_slope_val = result_storage['tafel_slope']
-      # elif fitmethod == 'bayesian':
-        # tafel_slope_val, rsq, res_voltages, res_log_currents = tafel_slope.fit_tafel_slope_bayesian(e, log_i, model=model)
-      else:
-        raise ValueError(f"Fit method '{fitmethod}' not implemented.")
-      is_fitoutput_open = True
-
-      output_df = file_df.copy(deep=True)
-      output_df.insert(len(output_df.columns), 'tafel_slope', pd.Series([result_storage['tafel_slope']]))
-      output_df.insert(len(output_df.columns), 'rsq', pd.Series([result_storage['rsq']]))
-      output_df.insert(len(output_df.columns), 'tafel_fit_e', pd.Series(result_storage['e']))
-      output_df.insert(len(output_df.columns), 'tafel_fit_logi', pd.Series(result_storage['log_i']))
-      output_df.to_csv('/content/tafel_fit_results.csv', index=False)
-
-    if trig_id == 'tafel-download-btn':
-      output_df = file_df.copy(deep=True)
-      output_df.insert(len(output_df.columns), 'tafel_slope', pd.Series([result_storage['tafel_slope']]))
-      output_df.insert(len(output_df.columns), 'rsq', pd.Series([result_storage['rsq']]))
-      output_df.insert(len(output_df.columns), 'tafel_fit_e', pd.Series(result_storage['e']))
-      output_df.insert(len(output_df.columns), 'tafel_fit_logi', pd.Series(result_storage['log_i']))
-      download = dcc.send_data_frame(output_df.to_csv, 'tafel_fit_results.csv')
-      # try:
-      #   from google.colab import files
-      #   with open('tafel_fit_results.csv', 'w') as f:
-      #     f.write(output_df.to_csv(index=False))
-      #   files.download('tafel_fit_results.csv')
-      # except:
-      #   pass
-
-    """Prepare return values."""
-    fig_raw, fig_corr, fig_tafel = build_tafel_figs(file_df, result_storage, sa_val, sa_type, log_i_range=[log_i_min, log_i_max], e_range=[e_min, e_max])
-    outputs = tuple([
-      file_name,
-      file_df.to_dict(orient='records'),
-      e_min, e_max, log_i_min, log_i_max,
-      fig_raw,
-      fig_corr,
-      fig_tafel,
-      result_storage,
-      f"{tafel_slope_val:.4g} mV/decade" if tafel_slope_val!=no_update else no_update,
-      is_fitoutput_open,
-      download,
-    ])
-    return outputs
+      job = {
+        'derived_key': derived_storage['key'],
+        'fit_key': f"{derived_storage['key']}-fit-{e_min}-{e_max}-{log_i_min}-{log_i_max}-{fitmethod}-{model}",
+        'memo_key': tafel_slope.fit_tafel_slope_lsq.cache_key(e[mask], log_i[mask], model=model) if fitmethod == 'lsq' else None,
+      }
+      found, res = tafel_slope.fit_tafel_slope_lsq.cache_get(job['memo_key']) if job['memo_key'] else (False, None)
+      if not found:
+        job['id'] = JOBS.submit(fit_tafel_job, e[mask], log_i[mask], fitmethod, model)
+        return (dict(), no_update, False, job, *templates.job_status_outputs(JOBS.status(job['id'])))
+      fit = dict(zip(FIT_KEYS, res))
+      status = None
+
+    else:
+      """Poll the fit."""
+      if 'id' not in job:
+        raise PreventUpdate
+      status = JOBS.status(job['id'])
+      if status['state'] in ('queued', 'running'):
+        return (no_update, no_update, no_update, no_update, *templates.job_status_outputs(status))
+      fit = JOBS.result(job['id']) if status['state'] == 'done' else None
+      JOBS.forget(job['id'])
+      if fit is None:  # Failed or cancelled, the progress bar shows why.
+        return (no_update, no_update, no_update, dict(), *templates.job_status_outputs(status))
+      if job.get('memo_key'):  # The fit ran in a worker process, remember it in this one.
+        tafel_slope.fit_tafel_slope_lsq.cache_put(job['memo_key'], tuple(fit[k] for k in FIT_KEYS))
 
+    """Keep the full fit curve on the server, the browser only gets a decimated line to draw."""
+    DATASETS.put(job['fit_key'], {'e': fit['e'], 'log_i': fit['log_i']})
+    plot_log_i, plot_e = plotting.decimate(fit['log_i'], fit['e'], method='lttb')
+    result_storage = {'key': job['fit_key'], 'tafel_slope': fit['tafel_slope'], 'rsq': fit['rsq'], 'e': plot_e, 'log_i': plot_log_i}
+
+    build_output_df(DATASETS[job['derived_key']], fit).to_csv(os.path.join(sessions.session_dir(), 'tafel_fit_results.csv'), index=False)
+    return (result_storage, f"{fit['tafel_slope']:.4g} mV/decade", True, dict(), *templates.job_status_outputs(status))
+
+  @app.callback(
+    Output('tafel-download-dataframe-csv', 'data'),
+    Input('tafel-download-btn', 'n_clicks'),
+    State('tafel-derived-storage', 'data'),
+    State('tafel-result-storage', 'data'),
+    prevent_initial_call=True,
+  )
+  def tafel_download_callback(n_clicks_download, derived_storage, result_storage):
+    """Download data and fit results."""
+    if 'key' not in derived_storage or len(result_storage) == 0:
+      raise PreventUpdate
+    fit = dict(DATASETS[result_storage['key']], tafel_slope=result_storage['tafel_slope'], rsq=result_storage['rsq'])
+    output_df = build_output_df(DATASETS[derived_storage['key']], fit)
+    return dcc.send_data_frame(output_df.to_csv, 'tafel_fit_results.csv')
+    # try:
+    #   from google.colab import files
+    #   with open('tafel_fit_results.csv', 'w') as f:
+    #     f.write(output_df.to_csv(index=False))
+    #   files.download('tafel_fit_results.csv')
+    # except:
+    #   pass
+
+
+def build_tafel_row():
+  """Create content for Tafel slope row."""
   tafel_row = dbc.Row(
     [
-      dbc.Col(build_tafel_inputs(app), className='col-3'),
+      dbc.Col(build_tafel_inputs(), className='col-3'),
       dbc.Col(
         [
           dbc.Row(dbc.Col(templates.build_card('Raw polarization curve', dcc.Graph(id='pol-raw-graph')))),
@@ -6,8 +6,11 @@ import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 
+JOB_POLL_INTERVAL = 500  # Time (in ms) between two polls of a background job.
 
-def build_modal(app, name, title, content):
+
+def build_modal(name, title, content):
+  """Info button and modal. See register_modal_callbacks for opening and closing it."""
   open_button = html.I(className='far fa-question-circle', n_clicks=0, id=f"open-{name}")
   close_button = html.I(className='far fa-window-close', n_clicks=0, id=f"close-{name}")
   modal = dbc.Modal(
@@ -17,7 +20,11 @@ def build_modal(app, name, title, content):
     ],
     id=f"modal-{name}",
   )
+  return open_button, modal
+
 
+def register_modal_callbacks(app, name):
+  """Open and close the modal created by build_modal."""
   @app.callback(
     Output(f"modal-{name}", "is_open"),
     Input(f"open-{name}", "n_clicks"),
@@ -29,8 +36,6 @@ def build_modal(app, name, title, content):
       return not is_open
     return is_open
 
-  return open_button, modal
-
 
 def build_card(title, content, info=None):
   if info is not None:
@@ -48,6 +53,37 @@ def build_card(title, content, info=None):
   return card
 
 
+def build_job_status(name):
+  """Progress bar, cancel button and polling interval of a background job, hidden until a job is submitted. See jobs.py."""
+  status = html.Div(
+    [
+      dbc.Progress(id=f"{name}-job-progress", value=0, striped=True, animated=True, className='mb-1'),
+      dbc.Button('Cancel', id=f"{name}-job-cancel-btn", n_clicks=0, className='btn-block btn-secondary'),
+      dcc.Interval(id=f"{name}-job-interval", interval=JOB_POLL_INTERVAL, disabled=True),
+      dcc.Store(id=f"{name}-job-storage", data=dict(), storage_type='memory'),
+    ],
+    id=f"{name}-job-status",
+    hidden=True,
+    className='pt-1',
+  )
+  return status
+
+
+def job_status_outputs(status):
+  """Values of the elements of build_job_status for a job.
+  Args:
+    status (dict, None): JobQueue.status of the job. None hides the progress bar.
+  Returns:
+    tuple: status hidden, progress value, progress label, interval disabled
+  """
+  if status is None:
+    return True, 0, '', True
+  finished = status['state'] not in ('queued', 'running')
+  value = 100 * status['done'] / max(status['total'], 1)
+  label = 'Queued' if status['state'] == 'queued' else status['message']
+  return status['state'] == 'done', value, label, finished
+
+
 def build_navbar(app, pages, active_page=0, subtitle=None):
   dropdown = dbc.DropdownMenu(
     children=[dbc.DropdownMenuItem(p.label, id=p.id) for p in pages.itertuples()],
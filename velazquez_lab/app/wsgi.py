@@ -0,0 +1,22 @@
+"""WSGI entry point for serving the application to many users with several worker processes.
+Notes:
+  Uploaded datasets are spilled to the shared data directory, since consecutive requests of a session may reach different workers.
+  The spilled datasets are bounded by DatasetCache.max_disk_bytes, and unused sessions, datasets and job files are
+  deleted periodically (see sessions.init_sessions).
+  Settings are read from the environment:
+    VELAZQUEZ_THEME: light or dark theme
+    VELAZQUEZ_DATA_DIR: shared data directory, see sessions.data_dir
+    VELAZQUEZ_JOB_WORKERS: number of background fit processes per server worker
+To run:
+  gunicorn -w 4 --threads 2 -b 0.0.0.0:8050 velazquez_lab.app.wsgi:server
+  python myapp.py -w 4
+"""
+import os
+
+from velazquez_lab.app import sessions
+from velazquez_lab.app.build_app import build_app
+from velazquez_lab.app.dataset_cache import DATASETS
+
+DATASETS.directory = sessions.data_dir('datasets')
+app = build_app(theme=os.environ.get('VELAZQUEZ_THEME', 'light'))
+server = app.server
@@ -0,0 +1,199 @@
+"""Batch analysis of a directory of polarization curve data files.
+Runs ECSA, specific capacitance and Tafel slope analyses in parallel and streams the results into one summary file.
+
+Info:
+  The manifest is a CSV file with one row per data file and the columns:
+    sample: sample name. ECSA files of a sample are analyzed together.
+    file: data file name, relative to the data directory.
+    analysis: 'ecsa' (double-layer CV at one scan rate) or 'tafel' (polarization curve).
+    scan_rate: scan rate (in mV/s), for ECSA files.
+    ph: pH level, for Tafel files.
+    ru: uncompensated resistance (in Ohms), for Tafel files.
+    area: surface area (in cm2). Optional, used to normalize Tafel currents and specific capacitance.
+    mass: catalyst mass (in g). Optional, used to normalize specific capacitance.
+    cycle: cycle number to select in ECSA files. Optional, overrides --cycle.
+"""
+
+import argparse
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')  # Never open a GUI, also in worker processes.
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import numpy as np
+import pandas as pd
+
+from velazquez_lab.pol import ecsa, specific_cap, tafel_slope
+
+SUMMARY_COLUMNS = [
+  'sample', 'analysis', 'files', 'status', 'error',
+  'contour', 'ecsa', 'slope_low', 'slope_high', 'rsq_low', 'rsq_high',
+  'csp', 'csp_g', 'csp_cm2',
+  'tafel_slope', 'rsq', 'e_min', 'e_max', 'npoints',
+]
+
+
+def _opt(value):
+  """Manifest value, or None if the cell is empty."""
+  return None if pd.isna(value) else value
+
+
+def run_ecsa(sample, files, scan_rates, cycle, contours, specific_cap_val=1, blank_cap=0, mass=None, surf_area=None):
+  """ECSA and specific capacitance for the ECSA files of one sample.
+  Returns:
+    list: summary rows, one per contour.
+  """
+  potentials, currents = ecsa.load_ecsa_data(files, cycle=cycle)
+  df = ecsa.calculate_ecsa_contours(potentials, currents, scan_rates, contours, specific_cap=specific_cap_val, blank_cap=blank_cap)
+  _, _, csp_df = specific_cap.calculate_specific_cap(potentials, currents, scan_rates, mass=mass, surf_area=surf_area)
+  csp = {key: csp_df[key].mean() if csp_df[key].notna().any() else None for key in ('csp', 'csp_g', 'csp_cm2')}
+
+  rows = []
+  for contour, fit in df.groupby('contour', sort=False):
+    fit = fit.iloc[0]
+    rows.append(dict(
+      sample=sample, analysis='ecsa', files=';'.join(os.path.basename(f) for f in files), status='ok',
+      contour=contour, ecsa=fit['ecsa'], slope_low=fit['slope_low'], slope_high=fit['slope_high'], rsq_low=fit['rsq_low'], rsq_high=fit['rsq_high'],
+      **csp,
+    ))
+  return rows
+
+
+def run_tafel(sample, file, ph, ru=0, area=1, min_length=10):
+  """Tafel slope of one polarization curve over the best automatically found window.
+  Returns:
+    list: one summary row.
+  """
+  df = tafel_slope.load_tafel_data(file)
+  df = df[df['I'] != 0]  # Remove zeros.
+  e_rhe = tafel_slope.corrected_potential(df['E'].to_numpy(), df['I'].to_numpy(), ph, ru)
+  log_i = np.log10(np.abs(df['I'].to_numpy() / area))
+  best = tafel_slope.find_tafel_windows(e_rhe, log_i, min_length=min_length, max_results=1).iloc[0]
+  e_win = e_rhe[int(best['start']):int(best['stop'])]
+  return [dict(
+    sample=sample, analysis='tafel', files=os.path.basename(file), status='ok',
+    tafel_slope=best['tafel_slope'], rsq=best['rsq'], e_min=e_win.min(), e_max=e_win.max(), npoints=int(best['npoints']),
+  )]
+
+
+def build_tasks(manifest, directory, args):
+  """Create (function, kwargs, description) tasks from the manifest."""
+  tasks = []
+  for sample, df in manifest.groupby('sample', sort=False):
+    cv = df[df['analysis'] == 'ecsa']
+    if len(cv) > 0:
+      cycle = _opt(cv['cycle'].iloc[0]) if 'cycle' in cv else None
+      kwargs = dict(
+        sample=sample,
+        files=[os.path.join(directory, f) for f in cv['file']],
+        scan_rates=cv['scan_rate'].to_numpy(dtype=float),
+        cycle=int(cycle) if cycle is not None else args['cycle'],
+        contours=args['potential'],
+        specific_cap_val=args['specific'],
+        blank_cap=args['blank'],
+        mass=_opt(cv['mass'].iloc[0]) if 'mass' in cv else None,
+        surf_area=_opt(cv['area'].iloc[0]) if 'area' in cv else None,
+      )
+      tasks.append((run_ecsa, kwargs, dict(sample=sample, analysis='ecsa', files=';'.join(cv['file']))))
+
+    for row in df[df['analysis'] == 'tafel'].itertuples():
+      area = _opt(getattr(row, 'area', None))
+      kwargs = dict(
+        sample=sample,
+        file=os.path.join(directory, row.file),
+        ph=row.ph,
+        ru=_opt(getattr(row, 'ru', None)) or 0,
+        area=area if area is not None else 1,
+        min_length=args['minlength'],
+      )
+      tasks.append((run_tafel, kwargs, dict(sample=sample, analysis='tafel', files=row.file)))
+  return tasks
+
+
+class SummaryWriter:
+  """Append summary rows to a CSV or Parquet file as results arrive."""
+
+  def __init__(self, fname):
+    self.fname = fname
+    self.is_parquet = fname.endswith('.parquet')
+    if self.is_parquet:
+      import pyarrow as pa
+      import pyarrow.parquet as pq
+      types = {c: pa.string() for c in ('sample', 'analysis', 'files', 'status', 'error')}
+      self.schema = pa.schema([(c, types.get(c, pa.float64())) for c in SUMMARY_COLUMNS])
+      self.writer = pq.ParquetWriter(fname, self.schema)
+    else:
+      self.file = open(fname, 'w', newline='')
+      self.writer = csv.DictWriter(self.file, fieldnames=SUMMARY_COLUMNS)
+      self.writer.writeheader()
+
+  def write(self, rows):
+    if self.is_parquet:
+      import pyarrow as pa
+      df = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+      self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+    else:
+      self.writer.writerows(rows)
+      self.file.flush()
+
+  def close(self):
+    if self.is_parquet:
+      self.writer.close()
+    else:
+      self.file.close()
+
+
+def run_batch(directory, manifest, output, args):
+  """Run all analyses of a manifest in a process pool, writing each result as soon as it completes.
+  Returns:
+    int: number of failed tasks.
+  """
+  tasks = build_tasks(manifest, directory, args)
+  writer = SummaryWriter(output)
+  nfailed = 0
+  try:
+    with ProcessPoolExecutor(max_workers=args['workers']) as executor:
+      futures = {executor.submit(func, **kwargs): desc for func, kwargs, desc in tasks}
+      for n, future in enumerate(as_completed(futures)):
+        desc = futures[future]
+        try:
+          rows = future.result()
+        except Exception as exc:  # Keep going, the failure is recorded in the summary.
+          rows = [dict(desc, status='failed', error=f"{type(exc).__name__}: {exc}")]
+          nfailed += 1
+        writer.write(rows)
+        print(f"[{n+1}/{len(tasks)}] {desc['sample']} {desc['analysis']}: {rows[0]['status']}", flush=True)
+  finally:
+    writer.close()
+  return nfailed
+
+
+def parse_args(argv=None):
+  """Parse commandline arguments for module."""
+  ap = argparse.ArgumentParser(description='Batch ECSA, specific capacitance and Tafel slope analysis.')
+  ap.add_argument('directory', help='Directory containing the data files')
+  ap.add_argument('-m', '--manifest', default=None, help='Manifest CSV file (default: <directory>/manifest.csv)')
+  ap.add_argument('-o', '--output', default='summary.csv', help='Summary file (.csv or .parquet)')
+  ap.add_argument('-j', '--workers', default=None, type=int, help='Number of worker processes (default: number of CPUs)')
+  ap.add_argument('-p', '--potential', nargs='+', default=[0.175], type=float, help='Potential contours (in V) at which ECSA is calculated')
+  ap.add_argument('-c', '--cycle', default=2, type=int, help='Cycle number of ECSA files')
+  ap.add_argument('--specific', default=1, type=float, help='Specific capacitance (in F/cm^2)')
+  ap.add_argument('--blank', default=0, type=float, help='Blank capacitance in F')
+  ap.add_argument('--minlength', default=10, type=int, help='Minimum number of points in the Tafel fit window')
+  args = vars(ap.parse_args(argv))
+  return args
+
+
+def main(argv=None):
+  """Console entry point.
+  Examples:
+    velazquez-batch data/campaign -o summary.parquet -p 0.15 0.175 0.2 -j 8
+  """
+  args = parse_args(argv)
+  manifest = pd.read_csv(args['manifest'] or os.path.join(args['directory'], 'manifest.csv'))
+  manifest['analysis'] = manifest['analysis'].str.lower()
+  nfailed = run_batch(args['directory'], manifest, args['output'], args)
+  return 1 if nfailed > 0 else 0
+
+
+if __name__ == '__main__':
+  raise SystemExit(main())
@@ -1,15 +1,15 @@
 """CO2 reduction analysis."""
 
+from collections import namedtuple
 import matplotlib.pyplot as plt
 # plt.style.use('../plot/jessica.mplstyle')
 import numpy as np
 import pandas as pd
 import sys
-import uncertainties as un
-from uncertainties import unumpy as unp
 
 from velazquez_lab.utils.file_reading import load_excel_ws
 from velazquez_lab.pol import tafel_slope
+from velazquez_lab.utils.uarray import UArray, nominal_values, std_devs
 
 
 """Load liquid calibration data."""
@@ -27,16 +27,141 @@ NMR_CAL = {  # (rel area vs uM)
 }
 
 
+def _sorted_trace(t, i):
+  """Times (from the first sample) and currents as float arrays, sorted by time if needed (a no-op for a time trace)."""
+  t = np.asarray(t, dtype=float)
+  i = np.asarray(i, dtype=float)
+  if t.size and np.any(t[1:] < t[:-1]):
+    order = np.argsort(t, kind='stable')
+    t, i = t[order], i[order]
+  return (t - t[0] if t.size else t), i
+
+
+def cumulative_charge(t, i):
+  """Charge passed since the first sample, by cumulative trapezoidal integration of the current.
+  Args:
+    t (array_like): times (in s), increasing
+    i (array_like): currents (in mA)
+  Returns:
+    np.ndarray: charge (in C) passed at each time, starting at 0
+  """
+  t = np.asarray(t, dtype=float)
+  i = np.asarray(i, dtype=float)
+  q = np.zeros(t.size)
+  np.cumsum(0.5 * (i[1:] + i[:-1]) * np.diff(t), out=q[1:])
+  return q / 1000  # mA*s to C
+
+
+def _bound_charges(t, q, intervals):
+  """Charge of each interval: differences of the cumulative charge q, interpolated at the interval bounds."""
+  if t.size == 0:
+    return np.full(intervals.size, np.nan)
+  return np.diff(np.interp(np.concatenate([[0], intervals]), t, q))
+
+
+def interval_charges(t, i, intervals):
+  """Charge passed during each GC interval, from a single cumulative charge array.
+  Intervals are as in interval_currents. The cumulative charge is interpolated at the interval bounds, so the charges
+  of consecutive intervals add up to the charge passed until the last bound. Times past the end of the trace add nothing.
+  Args:
+    t (array_like): times (in s)
+    i (array_like): currents (in mA)
+    intervals (array_like): end time (in s) of each interval, from the start of the trace
+  Returns:
+    np.ndarray: charge (in C) of each interval
+  """
+  t, i = _sorted_trace(t, i)
+  return _bound_charges(t, cumulative_charge(t, i), np.asarray(intervals, dtype=float).ravel())
+
+
+def interval_durations(t, intervals):
+  """Time covered by the trace in each GC interval, e.g. to turn interval_charges into mean currents.
+  Intervals are as in interval_currents. Parts of an interval past the end of the trace are not covered,
+  and intervals without samples give NaN.
+  Args:
+    t (array_like): times (in s)
+    intervals (array_like): end time (in s) of each interval, from the start of the trace
+  Returns:
+    np.ndarray: covered duration (in s) of each interval
+  """
+  t, _ = _sorted_trace(t, t)
+  intervals = np.asarray(intervals, dtype=float).ravel()
+  if t.size == 0:
+    return np.full(intervals.size, np.nan)
+  bounds = np.concatenate([[0], intervals])
+  nsamples = np.searchsorted(t, bounds[1:], side='left') - np.searchsorted(t, bounds[:-1], side='left')
+  durations = np.diff(np.clip(bounds, 0, t[-1]))
+  return np.where(nsamples > 0, durations, np.nan)
+
+
+"""
+median: median current of each interval
+mean: mean current of each interval, or None
+percentiles: current percentiles of each interval, shape (nintervals, npercentiles), or None
+charge: charge (in C) passed during each interval, or None (see interval_charges)
+nsamples: number of samples in each interval
+"""
+IntervalCurrents = namedtuple('IntervalCurrents', ['median', 'mean', 'percentiles', 'charge', 'nsamples'])
+
+def interval_currents(t, i, intervals, percentiles=None, mean=False, charge=False):
+  """Current statistics during each GC interval, with one segmentation of the trace.
+  Interval k covers times (from the start of the trace) in [intervals[k-1], intervals[k]), the first one starting at 0.
+  The samples are sorted by time once (a no-op for a time trace), and np.searchsorted finds where each interval starts
+  and stops, so every interval is a contiguous slice and each sample is visited once. Empty intervals give NaN
+  statistics (their charge is still interpolated).
+  Args:
+    t (array_like): times (in s)
+    i (array_like): currents (in mA)
+    intervals (array_like): end time (in s) of each interval, from the start of the trace
+    percentiles (array_like): percentiles (0 to 100) to compute, if any
+    mean (bool): whether to compute the mean currents
+    charge (bool): whether to compute the charges
+  Returns:
+    IntervalCurrents: statistics of each interval
+  """
+  t, i = _sorted_trace(t, i)
+  intervals = np.asarray(intervals, dtype=float).ravel()
+
+  """Segment."""
+  stop = np.searchsorted(t, intervals, side='left')
+  start = np.minimum(np.concatenate([[0], np.searchsorted(t, intervals[:-1], side='left')]).astype(int), stop)
+  nsamples = stop - start
+  nonempty = nsamples > 0
+
+  """Medians and percentiles: one partition of each slice."""
+  q = [50] + ([] if percentiles is None else list(np.ravel(percentiles)))
+  quantiles = np.full((intervals.size, len(q)), np.nan)
+  for k in np.flatnonzero(nonempty):
+    quantiles[k] = np.percentile(i[start[k]:stop[k]], q)
+
+  """Means and charges: differences of cumulative sums at the interval bounds."""
+  means, charges = None, None
+  if mean:
+    csum = np.concatenate([[0], np.cumsum(i)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+      means = (csum[stop] - csum[start]) / nsamples
+  if charge:
+    charges = _bound_charges(t, cumulative_charge(t, i), intervals)
+
+  return IntervalCurrents(
+    median=quantiles[:, 0],
+    mean=means,
+    percentiles=None if percentiles is None else quantiles[:, 1:],
+    charge=charges,
+    nsamples=nsamples,
+  )
+
+
 def get_median_current(t, i, intervals):
-  median_current= []
-  t = t - min(t)
-  intervals = np.asarray(intervals)
-  for idx, imax in enumerate(intervals):
-    imin = 0 if idx == 0 else intervals[idx - 1]
-    mask = (t>=imin) & (t<imax)
-    med = np.median(i[mask])
-    median_current.append(med)
-  return np.array(median_current)
+  """Median current during each GC interval. See interval_currents.
+  Args:
+    t (array_like): times
+    i (array_like): currents
+    intervals (array_like): end time of each interval, from the start of the trace
+  Returns:
+    np.ndarray: median current of each interval
+  """
+  return interval_currents(t, i, intervals).median
 
 
 def get_fe_pct(precursor, product, conc_from_red, solution_vol, coulombs_passed):
@@ -46,6 +171,7 @@ def get_fe_pct(precursor, product, conc_from_red, solution_vol, coulombs_passed)
     product (str): Product name.
     conc_from_red (float): Concentration of product from CO2 reduction.
     solution_vol (float): Solution volume in mL.
+    coulombs_passed (float): Charge passed in C (see cumulative_charge).
   """
   ELEC_TO_REDUCE = {
     'CO': {
@@ -100,16 +226,23 @@ def liquid_product_analysis(precursor, products, integs, dmf_right_peaks, dmf_le
   return df
 
 
-def gaseous_product_analysis(peak_areas, gc_calib_curve, median_current, area):
-  """
+def gaseous_product_analysis(peak_areas, gc_calib_curve, charges, durations, area):
+  """Calculate faradaic efficiency for gas products, against the mean cell current of each GC interval.
   Args:
-    peak_areas (dict): Peak areas (in mV/min) for each gas product.
-    gc_calib_curve (dict): GC calibration curve slopes (mV/min/mA) and intercepts (in mV/min).
+    peak_areas (dict): Peak areas (in mV/min) for each gas product, one per GC interval.
+    gc_calib_curve (dict): GC calibration curve slopes (mV/min/mA) and intercepts (in mV/min), as UArrays, ufloats or floats.
+    charges (array_like): Charge passed (in C) during each GC interval (see interval_charges).
+    durations (array_like): Time (in s) covered by the trace in each GC interval (see interval_durations).
+    area (float): Geometric area (in cm2).
+  Returns:
+    pd.DataFrame: one row per product. current, fe_pct and partial_current_density are UArrays with one value per peak.
   """
+  with np.errstate(divide='ignore', invalid='ignore'):
+    cell_current = 1000 * np.asarray(charges, dtype=float) / np.asarray(durations, dtype=float)  # C/s to mA
   rows = []
   for key, _peak_area in peak_areas.items():
-    current = (_peak_area - gc_calib_curve[key]['b']) / gc_calib_curve[key]['m']  # mA
-    fe_pct = 100 * (current / median_current)
+    current = (UArray(_peak_area) - gc_calib_curve[key]['b']) / gc_calib_curve[key]['m']  # mA
+    fe_pct = 100 * (current / cell_current)
     partial_current_density = current / area  # mA/cm2
 
     rows.append([key, _peak_area, current, fe_pct, partial_current_density])
@@ -137,14 +270,16 @@ if __name__ == "__main__":
   gc_time_intervals = gc_data.loc[3:14, 'B'].dropna() * 60  # s
   area_geometric = nmr_data.loc[2, 'W']  # cm2
   solution_vol = nmr_data.loc[2, 'T']  # mL
-  coulombs_passed = nmr_data.loc[2, 'U']  # C
   ph = nmr_data.loc[2, 'X']
   ru = nmr_data.loc[2, 'Y']  # Ohms
 
-  """Median current."""
-  median_current = get_median_current(echem_data['time/s'], echem_data['I/mA'], gc_time_intervals)  # Amps
+  """Charge passed, and charge of each GC interval."""
+  coulombs_passed = np.abs(cumulative_charge(echem_data['time/s'], echem_data['I/mA'])[-1])  # C
+  gc_charges = interval_charges(echem_data['time/s'], echem_data['I/mA'], gc_time_intervals)  # C
+  gc_durations = interval_durations(echem_data['time/s'], gc_time_intervals)  # s
   print(f"gc time intervals: {gc_time_intervals}")
-  print(f"median currents: {median_current}")
+  print(f"charge per interval (C): {gc_charges}")
+  print(f"charge passed (C): {coulombs_passed} (workbook: {nmr_data.loc[2, 'U']})")
   print(f"overall mediancurrent: {np.median(echem_data['I/mA'])}")
 
   """Liquid product analysis (NMR)."""
@@ -170,12 +305,12 @@ if __name__ == "__main__":
   }
 
   gc_calib_curve = {  # m: mV/min/mA, b: mV/min
-    'CO': {'m': un.ufloat(gc_data.loc[3, 'S'], gc_data.loc[3, 'T']), 'b': un.ufloat(gc_data.loc[3, 'U'], gc_data.loc[3, 'V'])},
-    'methane': {'m': un.ufloat(gc_data.loc[4, 'S'], gc_data.loc[4, 'T']), 'b': un.ufloat(gc_data.loc[4, 'U'], gc_data.loc[4, 'V'])},
-    'hydrogen': {'m': un.ufloat(gc_data.loc[5, 'S'], gc_data.loc[5, 'T']), 'b': un.ufloat(gc_data.loc[5, 'U'], gc_data.loc[5, 'U'])},
+    'CO': {'m': UArray(gc_data.loc[3, 'S'], gc_data.loc[3, 'T']), 'b': UArray(gc_data.loc[3, 'U'], gc_data.loc[3, 'V'])},
+    'methane': {'m': UArray(gc_data.loc[4, 'S'], gc_data.loc[4, 'T']), 'b': UArray(gc_data.loc[4, 'U'], gc_data.loc[4, 'V'])},
+    'hydrogen': {'m': UArray(gc_data.loc[5, 'S'], gc_data.loc[5, 'T']), 'b': UArray(gc_data.loc[5, 'U'], gc_data.loc[5, 'U'])},
   }
 
-  gas_df = gaseous_product_analysis(peak_areas, gc_calib_curve, median_current=median_current, area=area_geometric)
+  gas_df = gaseous_product_analysis(peak_areas, gc_calib_curve, charges=gc_charges, durations=gc_durations, area=area_geometric)
   print()
   print(f'gas_df:\n{gas_df.head()}')
 
@@ -194,28 +329,28 @@ if __name__ == "__main__":
 
   """Plot: liquid partial current density."""
   fig, ax = plt.subplots(constrained_layout=True)
-  liq_prod_mask = ( np.abs(unp.nominal_values(liq_df['partial_current_density'])) > 0 )
-  ax.bar(liq_df['product'][liq_prod_mask], np.abs(unp.nominal_values(liq_df['partial_current_density'][liq_prod_mask])))
+  liq_prod_mask = ( np.abs(nominal_values(liq_df['partial_current_density'])) > 0 )
+  ax.bar(liq_df['product'][liq_prod_mask], np.abs(nominal_values(liq_df['partial_current_density'][liq_prod_mask])))
   plt.xticks(rotation=45, horizontalalignment="right")
   ax.set(ylabel='Partial current density (mA/cm2)', title='Liquid products')
 
   """Plot: gaseous partial current density vs. time."""
   fig, ax = plt.subplots(constrained_layout=True)
   for i, prod in enumerate(gas_df['product']):
-    ax.errorbar(gc_time_intervals, unp.nominal_values(gas_df['partial_current_density'].iloc[i]), yerr=unp.std_devs(gas_df['partial_current_density'].iloc[i]), fmt='o-', label=prod)
+    ax.errorbar(gc_time_intervals, nominal_values(gas_df['partial_current_density'].iloc[i]), yerr=std_devs(gas_df['partial_current_density'].iloc[i]), fmt='o-', label=prod)
     ax.set(xlabel='Time (s)', ylabel='Partial current density (mA/cm2)', title='Gas products')
   ax.legend()
 
   """Plot: liquid faradaic efficiency."""
   fig, ax = plt.subplots(constrained_layout=True)
-  ax.bar(liq_df['product'][liq_prod_mask], np.abs(unp.nominal_values(liq_df['fe_pct_CO2'][liq_prod_mask])))
+  ax.bar(liq_df['product'][liq_prod_mask], np.abs(nominal_values(liq_df['fe_pct_CO2'][liq_prod_mask])))
   plt.xticks(rotation=45, horizontalalignment="right")
   ax.set(ylabel='CO2 Faradaic efficiency (%)', title='Liquid products')
 
   """Plot: gaseous faradaic efficiency vs. time."""
   fig, ax = plt.subplots(constrained_layout=True)
   for i, prod in enumerate(gas_df['product']):
-    ax.errorbar(gc_time_intervals, np.abs(unp.nominal_values(gas_df['fe_pct'].iloc[i])), yerr=unp.std_devs(gas_df['fe_pct'].iloc[i]), fmt='o-', label=prod)
+    ax.errorbar(gc_time_intervals, np.abs(nominal_values(gas_df['fe_pct'].iloc[i])), yerr=std_devs(gas_df['fe_pct'].iloc[i]), fmt='o-', label=prod)
     ax.set(xlabel='Time (s)', ylabel='Faradaic efficiency (%)', title='Gas products')
   ax.legend()
 
@@ -4,39 +4,220 @@ Info:
   The data file's first column contains potential (in V).
   The second column contains the current (in mA).
   The third column (optionally) contains the cycle index.
+  EC-Lab binary (.mpr) files are also accepted, using their potential, current and cycle number columns.
 """
 
 import argparse
+import functools
 import numpy as np
+import os
 import pandas as pd
 
+from velazquez_lab.utils.file_reading import MPR_CURRENT, MPR_POTENTIAL, is_mpr, load_columns
 import velazquez_lab.utils.linear_fitting as ft
+from velazquez_lab.utils.memoize import memoize
 
 
-def load_ecsa_data(files, cycle=None, header=(0), **kwargs):
+def cycle_index(cycles):
+  """Find the contiguous rows of each cycle.
+  Args:
+    cycles (array_like): Cycle number of each row. Rows of a cycle must be contiguous, as in EC-Lab files.
+  Returns:
+    dict: slice of rows for each cycle number.
+  """
+  cycles = np.asarray(cycles)
+  if cycles.size == 0:
+    return dict()
+  bounds = np.flatnonzero(np.diff(cycles)) + 1
+  starts = np.concatenate([[0], bounds]).tolist()
+  stops = np.concatenate([bounds, [cycles.size]]).tolist()
+  keys = [int(c) if float(c).is_integer() else float(c) for c in cycles[starts]]
+  if len(set(keys)) != len(keys):
+    raise ValueError("Cycle numbers are not contiguous.")
+  return {k: slice(a, b) for k, a, b in zip(keys, starts, stops)}
+
+
+class CycleData:
+  """Potentials and currents of one data file, selectable by cycle.
+  The cycle index is built on first use and cached, so selecting a cycle is a slice returning views.
+  """
+
+  def __init__(self, potential, current, cycles):
+    self.potential = potential
+    self.current = current
+    self.cycles = cycles
+
+  @classmethod
+  def from_file(cls, file):
+    """Load a data file (text or .mpr). Text files given by path are cached, see file_reading.load_columns."""
+    usecols = [MPR_POTENTIAL, MPR_CURRENT, 'cycle number'] if is_mpr(file) else [0, 1, 2]
+    return cls(*load_columns(file, usecols=usecols).values())
+
+  @functools.cached_property
+  def index(self):
+    """Slice of rows for each cycle number."""
+    return cycle_index(self.cycles)
+
+  def __getitem__(self, cycle):
+    """Potentials and currents (views) for a cycle, empty if the file has no such cycle."""
+    rows = self.index.get(cycle, slice(0, 0))
+    return self.potential[rows], self.current[rows]
+
+  def __iter__(self):
+    return iter(self.index)
+
+  def __len__(self):
+    return len(self.index)
+
+  def items(self):
+    """Iterate over (cycle, (potentials, currents)) without copying."""
+    return ((c, self[c]) for c in self.index)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_cycle_data(path, mtime_ns, size):
+  data = CycleData.from_file(path)
+  for arr in (data.potential, data.current, data.cycles):  # Shared between callers
+    arr.flags.writeable = False
+  return data
+
+
+def load_ecsa_cycles(files):
+  """Loads all cycles of data files.
+  Files given by path are parsed and indexed once, then cached until they are modified.
+  Args:
+    files (str, StringIO, BytesIO, array_like): Data files (text or .mpr) to load.
+  Returns:
+    list: CycleData for each file.
+  """
+  data = []
+  for f in np.atleast_1d(files):
+    if isinstance(f, (str, os.PathLike)):
+      st = os.stat(f)
+      data.append(_load_cycle_data(os.path.abspath(f), st.st_mtime_ns, st.st_size))
+    else:
+      data.append(CycleData.from_file(f))
+  return data
+
+
+def load_ecsa_data(files, cycle=None):
   """Loads data file contents into lists of potentials and currents.
   Args:
-    files (str, StringIO, array_like): Data files to load.
+    files (str, StringIO, BytesIO, array_like): Data files (text or .mpr) to load.
     cycle (int, None): Cycle index (3rd column in data file) to select.
       All data in the file is used if this is None.
-    header (array_like, None): Header lines, passed to pd.read_table.
-    **kwargs: Passed to pd.read_table
   Returns:
     list: potentials
     list: currents
   """
   potentials, currents = list(), list()
-  for f in np.atleast_1d(files):
-    df = pd.read_table(f, header=header, **kwargs)
-    if cycle is not None:  # Select data for a given cycle (3rd column)
-      mask = (df.iloc[:, 2]==cycle)
-    potentials.append(df[mask].iloc[:, 0].to_numpy())
-    currents.append(df[mask].iloc[:, 1].to_numpy())
+  if cycle is None:
+    for f in np.atleast_1d(files):
+      usecols = [MPR_POTENTIAL, MPR_CURRENT] if is_mpr(f) else [0, 1]
+      e, i = load_columns(f, usecols=usecols).values()
+      potentials.append(e)
+      currents.append(i)
+  else:  # Select data for a given cycle (3rd column)
+    for data in load_ecsa_cycles(files):
+      e, i = data[cycle]
+      potentials.append(e)
+      currents.append(i)
   return potentials, currents
 
 
+def interp_segments(x, xps, fps):
+  """Interpolate the same points on many curves with a single np.interp call.
+  Each curve is sorted by x and shifted so that the curves occupy disjoint x ranges of one increasing array.
+  Args:
+    x (array_like): Points at which to interpolate.
+    xps (list): x values of each curve (in any order).
+    fps (list): y values of each curve.
+  Returns:
+    np.ndarray: interpolated values, shape (len(xps), len(x)). Points outside a curve take its end values.
+  """
+  x = np.atleast_1d(np.asarray(x, dtype=float))
+  lo = np.array([np.min(xp) for xp in xps])
+  hi = np.array([np.max(xp) for xp in xps])
+  width = max(hi.max(), x.max()) - min(lo.min(), x.min()) + 1
+  shifts = width * np.arange(len(xps))
+
+  keys = np.concatenate([np.asarray(xp, dtype=float) + s for xp, s in zip(xps, shifts)])
+  vals = np.concatenate([np.asarray(fp, dtype=float) for fp in fps])
+  order = np.argsort(keys, kind='stable')
+  queries = np.clip(x[np.newaxis, :], lo[:, np.newaxis], hi[:, np.newaxis]) + shifts[:, np.newaxis]
+  return np.interp(queries, keys[order], vals[order])
+
+
+@memoize(ignore=('progress',))
+def calculate_ecsa_contours(potentials, currents, scan_rates, contours, specific_cap=1, blank_cap=0, progress=None):
+  """Calculates electrochemical surface area at many potential contours at once.
+  Each scan is split at its vertex (minimum potential) once, and every contour is interpolated on both halves in one call.
+  The lower and higher currents are then fit against scan rate in closed form for all contours.
+  Args:
+    potentials (array_like): potentials (in V) for each scan
+    currents (array_like): currents (in mA) for each scan
+    scan_rates (array_like): scan rate (in mV/s for each scan)
+    contours (array_like): potentials (in V) at which to calculate the ECSA
+    specific_cap (float): specific capacitance (in F/cm^2)
+    blank_cap (float): blank capacitance (in F)
+    progress (app.jobs.Progress, None): progress reporter of a background job, updated at each stage
+  Returns:
+    pd.DataFrame: one row per contour and scan with columns contour, scan_rate, I_low, I_high,
+      slope_low, intercept_low, rsq_low, slope_high, intercept_high, rsq_high and ecsa.
+  """
+  contours = np.atleast_1d(np.asarray(contours, dtype=float))
+  scan_rates = np.asarray(scan_rates, dtype=float)
+  nscans = len(scan_rates)
+
+  """Interpolate contours on both halves of every scan."""
+  if progress is not None:
+    progress.update(0, 2, 'Interpolating contours')
+  xps, fps = [], []
+  for e, i in zip(potentials, currents):
+    e, i = np.asarray(e), np.asarray(i)
+    mid_idx = np.argmin(e)  # Find minimum potential to divide data in half
+    xps += [e[:mid_idx+1], e[mid_idx:]]
+    fps += [i[:mid_idx+1], i[mid_idx:]]
+  i_halves = interp_segments(contours, xps, fps).reshape(nscans, 2, contours.size)
+  i_low = i_halves.min(axis=1).T  # (contours, scans)
+  i_high = i_halves.max(axis=1).T
+
+  """Fit contours."""
+  if progress is not None:
+    progress.update(1, 2, 'Fitting contours')
+  cols = {
+    'contour': np.repeat(contours, nscans),
+    'scan_rate': np.tile(scan_rates, contours.size),
+    'I_low': i_low.ravel(),
+    'I_high': i_high.ravel(),
+  }
+  slopes = dict()
+  for key, i_key in (('low', i_low), ('high', i_high)):
+    fits = ft.linear_fit_many(scan_rates, i_key)
+    slopes[key] = fits.m
+    cols[f'slope_{key}'] = np.repeat(fits.m, nscans)
+    cols[f'intercept_{key}'] = np.repeat(fits.b, nscans)
+    cols[f'rsq_{key}'] = np.repeat(fits.rsq, nscans)
+
+  avg_slope = 0.5 * (np.abs(slopes['low'])+np.abs(slopes['high']))  # Units are mA*s/mV=F
+  cols['ecsa'] = np.repeat((avg_slope-blank_cap) / specific_cap, nscans)
+  return pd.DataFrame(cols)
+
+
+def ecsa_at_contour(df):
+  """Split the results of calculate_ecsa_contours at a single contour into the ECSA and the fit results.
+  Args:
+    df (pd.DataFrame): calculate_ecsa_contours results for one contour
+  Returns:
+    float: electrochemical surface area
+    pd.DataFrame: currents at the contour for each scan and the fit results
+  """
+  return df.loc[0, 'ecsa'], df.drop(columns=['contour', 'ecsa'])
+
+
 def calculate_ecsa(potentials, currents, scan_rates, contour, specific_cap=1, blank_cap=0):
   """Calculates electrochemical surface area in units of FIXME.
+  See calculate_ecsa_contours for many contours, whose memoized results this reuses.
   Args:
     potentials (array_like): potentials (in V) for each scan
     currents (array_like): currents (in mA) for each scan
@@ -46,31 +227,12 @@ def calculate_ecsa(potentials, currents, scan_rates, contour, specific_cap=1, bl
     blank_cap (float): blank capacitance (in F)
   Returns:
     float: electrochemical surface area in units of FIXME
-    pd.DataFrame:
+    pd.DataFrame: currents at the contour for each scan and the fit results
   TODO:
-    Generalize this implementation.
     Fix blank capacitance
   """
-  """Prepare data."""
-  rows = []
-  for row, (e, i, r) in enumerate(zip(potentials, currents, scan_rates)):
-    mid_idx = np.argmin(e)  # Find minimum potential to divide data in half
-    i1, i2 = ( np.interp(contour, e[idx], i[idx]) for idx in (slice(0,mid_idx),slice(mid_idx,None)) )  # Interpolate on line for each half
-    rows.append([r, min(i1, i2), max(i1, i2)])
-  df = pd.DataFrame(rows, columns=['scan_rate', 'I_low', 'I_high'])
-
-  """Fit contours."""
-  for i, key in enumerate(('low', 'high')):
-    m_fit, b_fit, redchi = ft.linear_fit(df['scan_rate'], df[f'I_{key}'])
-    m_fit = m_fit.n
-    b_fit = b_fit.n
-    df.insert(len(df.columns), f'slope_{key}', pd.Series(m_fit))
-    df.insert(len(df.columns), f'intercept_{key}', pd.Series(b_fit))
-    df.insert(len(df.columns), f'rsq_{key}', pd.Series(redchi))
-
-  avg_slope = 0.5 * (np.abs(df.loc[0, 'slope_low'])+np.abs(df.loc[0, 'slope_high']))  # Units are mA*s/mV=F
-  ecsa_val = (avg_slope-blank_cap) / specific_cap
-  return ecsa_val, df
+  df = calculate_ecsa_contours(potentials, currents, scan_rates, [contour], specific_cap=specific_cap, blank_cap=blank_cap)
+  return ecsa_at_contour(df)
 
 
 def parse_args():
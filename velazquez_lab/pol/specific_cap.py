@@ -5,9 +5,69 @@ Calculate specific capacitance.
 import argparse
 import numpy as np
 import pandas as pd
-from shapely.geometry import Polygon
 
-def calculate_specific_cap(potentials, currents, scan_rates, mass=None, surf_area=None):
+from velazquez_lab.utils.memoize import memoize
+
+
+def _concat_loops(potentials, currents):
+  """Concatenate loops (rows of a 2-D array or a list of arrays) and find where each starts."""
+  lengths = np.array([np.size(e) for e in potentials])
+  e = np.concatenate([np.asarray(_e, dtype=float).ravel() for _e in potentials])
+  i = np.concatenate([np.asarray(_i, dtype=float).ravel() for _i in currents])
+  starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+  return e, i, starts, lengths
+
+
+def _loop_sums(values, starts, lengths):
+  """Sum of values over each loop. np.add.reduceat alone would give an empty loop the value at its start, or fail at the end."""
+  sums = np.zeros(lengths.size)
+  nonempty = lengths > 0
+  if np.any(nonempty):
+    sums[nonempty] = np.add.reduceat(values, starts[nonempty])
+  return sums
+
+
+def loop_areas(potentials, currents):
+  """Areas enclosed by closed current-potential loops, using the shoelace formula.
+  All loops are integrated at once: each point is paired with the next one of its loop (the last with the first).
+  Args:
+    potentials (array_like): potentials for each loop, as a 2-D array (loops x points) or a list of arrays.
+    currents (array_like): currents for each loop, like potentials.
+  Returns:
+    np.ndarray: area of each loop (in units of potential*current).
+  """
+  e, i, starts, lengths = _concat_loops(potentials, currents)
+  nonempty = lengths > 0
+  nxt = np.arange(1, e.size+1)
+  nxt[(starts+lengths-1)[nonempty]] = starts[nonempty]  # Close each loop
+  cross = e*i[nxt] - e[nxt]*i
+  return 0.5 * np.abs(_loop_sums(cross, starts, lengths))
+
+
+def loop_charges(potentials, currents, scan_rates):
+  """Anodic and cathodic charges passed during each scan, by trapezoidal integration over time.
+  Args:
+    potentials (array_like): potentials (in V) for each scan, as a 2-D array (scans x points) or a list of arrays.
+    currents (array_like): currents (in mA) for each scan, like potentials.
+    scan_rates (array_like): scan rate (in mV/s) for each scan
+  Returns:
+    np.ndarray: anodic (positive current) charge (in C) of each scan.
+    np.ndarray: cathodic (negative current) charge (in C) of each scan.
+  """
+  e, i, starts, lengths = _concat_loops(potentials, currents)
+  dt = np.abs(np.diff(e)) / (np.repeat(np.asarray(scan_rates, dtype=float), lengths)[:-1] / 1000)  # s
+  bounds = starts[1:][(starts[1:] > 0) & (starts[1:] < e.size)]  # Empty scans have no step to cut
+  dt[bounds-1] = 0  # No step between the end of one scan and the start of the next
+  dt = np.append(dt, 0)
+  charges = []
+  for _i in (np.maximum(i, 0), np.minimum(i, 0)):
+    trapz = 0.5 * (_i + np.append(_i[1:], 0)) * dt / 1000  # mA*s to C
+    charges.append(_loop_sums(trapz, starts, lengths))
+  return charges[0], charges[1]
+
+
+@memoize
+def calculate_specific_cap(potentials, currents, scan_rates, mass=None, surf_area=None, charges=False):
   """Calculates specific capacitance in units of F/g or F/cm2 depending on the input normalization.
   Args:
     potentials (array_like): potentials (in V) for each scan
@@ -15,22 +75,25 @@ def calculate_specific_cap(potentials, currents, scan_rates, mass=None, surf_are
     scan_rates (array_like): scan rate (in mV/s for each scan)
     mass (float): mass (in g) of catalyst
     surf_area (float): surface area (in cm2) of electrode
+    charges (bool): Whether to add the anodic and cathodic charges (in C) of each scan.
   Returns:
     float: mass-normalized specific capacitance (in F/g)
     float: area-normalized specific capacitance (in F/cm2)
     pd.DataFrame: calculations
   """
-  rows = []
-  for e, i, r in zip(potentials, currents, scan_rates):
-    _i = np.asarray(i) / 1000  # Convert mA to A
-    _r = r / 1000  # Convert mV/s to V/s
-    delta_v = max(e) - min(e)
-    pgon = Polygon(zip(e, _i))
-    _row = [r, pgon.area, 0.5*pgon.area/(_r*delta_v)]  # Area units: Amps*Volts=C
-    _row.append(_row[2]/mass if mass is not None else None)
-    _row.append(_row[2]/surf_area if surf_area is not None else None)
-    rows.append(_row)
-  df = pd.DataFrame(rows, columns=['scan_rate', 'area', 'csp', 'csp_g', 'csp_cm2'])
+  scan_rates = np.asarray(scan_rates)
+  area = loop_areas(potentials, [np.asarray(i) / 1000 for i in currents])  # Convert mA to A. Area units: Amps*Volts
+  delta_v = np.array([np.max(e) - np.min(e) for e in potentials])
+  csp = 0.5*area / ((scan_rates/1000)*delta_v)  # Convert mV/s to V/s
+  df = pd.DataFrame({
+    'scan_rate': scan_rates,
+    'area': area,
+    'csp': csp,
+    'csp_g': csp/mass if mass is not None else None,
+    'csp_cm2': csp/surf_area if surf_area is not None else None,
+  })
+  if charges:
+    df['q_anodic'], df['q_cathodic'] = loop_charges(potentials, currents, scan_rates)
   avg_csp_g = df['csp_g'].mean() if mass is not None else None
   avg_csp_cm2 = df['csp_cm2'].mean() if surf_area is not None else None
   return avg_csp_g, avg_csp_cm2, df
@@ -55,12 +118,12 @@ if __name__ == "__main__":
       python ecsa.py -f 2-6-2021_K2Mo6S6_sample1_her_03_CV_C02.txt 2-6-2021_K2Mo6S6_sample1_her_04_CV_C02.txt 2-6-2021_K2Mo6S6_sample1_her_05_CV_C02.txt 2-6-2021_K2Mo6S6_sample1_her_06_CV_C02.txt 2-6-2021_K2Mo6S6_sample1_her_07_CV_C02.txt -s 5 20 50 100 200 --cycle 2 -m 0.000117 -a 0.504
   """
   import matplotlib.pyplot as plt
-  from velazquez_lab.pol.ecsa import load_data
+  from velazquez_lab.pol.ecsa import load_ecsa_data
 
   args = parse_args()
 
   """Load input data files."""
-  potentials, currents = load_data(args['files'], cycle=args['cycle'])
+  potentials, currents = load_ecsa_data(args['files'], cycle=args['cycle'])
 
   """Calculate specific capacitance (c_sp)."""
   csp_g, csp_cm2, df = calculate_specific_cap(potentials, currents, scan_rates=args['scanrates'], mass=args['mass'], surf_area=args['area'])
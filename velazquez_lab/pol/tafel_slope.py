@@ -5,17 +5,22 @@ import numpy as np
 import pandas as pd
 
 # import velazquez_lab.pol.julius as jl
+from velazquez_lab.utils.file_reading import MPR_CURRENT, MPR_POTENTIAL, is_mpr, load_columns
 import velazquez_lab.utils.linear_fitting as ft
+from velazquez_lab.utils.memoize import memoize
 
 
 def load_tafel_data(file):
   """Load data.
   Args:
-    file: FIXME
+    file (str, StringIO, BytesIO): Data file. The first column is the potential (in V) and the second is the current (in mA).
+      EC-Lab binary (.mpr) files are read by column name instead. Text files given by path are cached, see file_reading.load_columns.
+  Returns:
+    pd.DataFrame: potentials ('E') and currents ('I').
   """
-  df = pd.read_table(file, sep='\t', header=(0), usecols=[0, 1])
-  df = df.rename(columns={df.columns[0]: 'E', df.columns[1]: 'I'})
-  return df
+  usecols = [MPR_POTENTIAL, MPR_CURRENT] if is_mpr(file) else [0, 1]
+  e, i = load_columns(file, usecols=usecols).values()
+  return pd.DataFrame({'E': e, 'I': i})
 
 
 def corrected_potential(potential, current, ph, ru=0):
@@ -100,13 +105,15 @@ def corrected_potential(potential, current, ph, ru=0):
 #   return np.mean(ap_tafels), d_voltages, ap_model_data+offset
 
 
-def fit_tafel_slope_lsq(voltages, log_currents, model='co2'):
+@memoize(ignore=('progress',))
+def fit_tafel_slope_lsq(voltages, log_currents, model='co2', progress=None):
   """Fit the Tafel slope using least squares regression.
   Args:
     voltages (array_like): Potentials (in V).
     log_currents (array_like): Log10 of currents.
     method (str): Tafel slope fitting method. Choose from 'simple' or 'bayesian'.
     model (str): Fit model to use. Choose from 'co2' or 'her'. FIXME
+    progress (app.jobs.Progress, None): Progress reporter of a background job (see linear_fitting.linear_fit).
   Returns:
     tafel_slope (float): Tafel slope (in mV/decade).
     rsq (float): R-squared value.
@@ -114,7 +121,9 @@ def fit_tafel_slope_lsq(voltages, log_currents, model='co2'):
     res_log_currents (array_like): Log10 o currents for plotting fit result.
   """
   if model == 'co2':
-    m_fit, b_fit, redchi, fitresult = ft.linear_fit(voltages, log_currents, return_fitres=True)
+    m_fit, b_fit, redchi, fitresult = ft.linear_fit(voltages, log_currents, return_fitres=True, progress=progress)
+    if progress is not None:
+      progress.update(2, 3, 'Fit curve')
     m_fit = m_fit.n
     b_fit = b_fit.n
     tafel_slope = np.abs(1000/m_fit)  # 1000 to convert V to mV.
@@ -126,6 +135,88 @@ def fit_tafel_slope_lsq(voltages, log_currents, model='co2'):
   return tafel_slope, rsq, res_voltages, res_log_currents
 
 
+def centered_prefix_sums(x, y):
+  """Prefix sums for O(1) linear fits of y vs x over any index range.
+  The sums over rows [a, b) are psum[k][b] - psum[k][a]. Centering on the means avoids cancellation.
+  Args:
+    x (array_like): independent variable
+    y (array_like): dependent variable
+  Returns:
+    dict: means xm and ym, and prefix sums (of length n+1) x, y, xy, xx and yy of the centered values
+  """
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  xm, ym = x.mean(), y.mean()
+  dx, dy = x - xm, y - ym
+  psum = {k: np.concatenate([[0], np.cumsum(v)]) for k, v in (('x', dx), ('y', dy), ('xy', dx*dy), ('xx', dx**2), ('yy', dy**2))}
+  return dict(psum, xm=xm, ym=ym)
+
+
+def find_tafel_windows(voltages, log_currents, min_length=5, width=None, max_results=10):
+  """Search for the most linear Tafel regions of a polarization curve.
+  Every contiguous window of at least min_length points is scored by the R-squared of log10 current vs potential.
+  Prefix sums of x, y, xy, x**2 and y**2 make each window O(1), so the search is O(n**2), or O(n) for a fixed width.
+  Args:
+    voltages (array_like): Potentials (in V), in acquisition order.
+    log_currents (array_like): Log10 of currents.
+    min_length (int): Minimum number of points in a window.
+    width (int, None): If given, only windows of exactly this many points are scored.
+    max_results (int): Number of windows returned.
+  Returns:
+    pd.DataFrame: best windows ranked by R-squared (then by length), with columns start and stop (row slice),
+      npoints, slope, intercept, tafel_slope (in mV/decade), rsq, e_span and log_i_span (difference between the window's end points).
+  Raises:
+    ValueError: if the curve has fewer points than the shortest window.
+  """
+  n = np.size(voltages)
+  length = width if width is not None else min_length
+  if length > n:  # Checked before the memoized search, which would find no window.
+    raise ValueError(f"Windows of {length} points need at least {length} points, got {n}.")
+  return _find_tafel_windows(voltages, log_currents, min_length=min_length, width=width, max_results=max_results)
+
+
+@memoize
+def _find_tafel_windows(voltages, log_currents, min_length=5, width=None, max_results=10):
+  """Memoized search of find_tafel_windows."""
+  x = np.asarray(voltages, dtype=float)
+  y = np.asarray(log_currents, dtype=float)
+  n = x.size
+  psum = centered_prefix_sums(x, y)
+  xm, ym = psum['xm'], psum['ym']
+
+  lengths = [width] if width is not None else range(min_length, n+1)
+  cols = {k: [] for k in ('start', 'stop', 'npoints', 'slope', 'intercept', 'rsq')}
+  for length in lengths:
+    start = np.arange(n - length + 1)
+    stop = start + length
+    sx, sy, sxy, sxx, syy = (psum[k][stop] - psum[k][start] for k in ('x', 'y', 'xy', 'xx', 'yy'))
+    cxy = length*sxy - sx*sy
+    cxx = length*sxx - sx**2
+    cyy = length*syy - sy**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+      rsq = np.nan_to_num(cxy**2 / (cxx*cyy), nan=-np.inf)
+    best = np.argpartition(-rsq, max_results-1)[:max_results] if rsq.size > max_results else start  # Keep the best windows of each length
+    with np.errstate(divide='ignore', invalid='ignore'):
+      slope = cxy[best] / cxx[best]
+    cols['start'].append(start[best])
+    cols['stop'].append(stop[best])
+    cols['npoints'].append(np.full(best.size, length))
+    cols['slope'].append(slope)
+    cols['intercept'].append((sy[best] - slope*sx[best])/length + ym - slope*xm)
+    cols['rsq'].append(rsq[best])
+
+  df = pd.DataFrame({k: np.concatenate(v) if v else np.array([]) for k, v in cols.items()})
+  df = df.sort_values(['rsq', 'npoints'], ascending=False, kind='stable').head(max_results).reset_index(drop=True)
+  df['tafel_slope'] = np.abs(1000/df['slope'])  # 1000 to convert V to mV.
+  df['e_span'] = np.abs(x[df['stop']-1] - x[df['start']])
+  df['log_i_span'] = np.abs(y[df['stop']-1] - y[df['start']])
+  return df
+
+
+for _attr in ('cache_key', 'cache_get', 'cache_put', 'cache_info', 'cache_clear'):  # Memoization API, see memoize.
+  setattr(find_tafel_windows, _attr, getattr(_find_tafel_windows, _attr))
+
+
 if __name__ == '__main__':
   """Example Tafel slope analysis."""
   import matplotlib.pyplot as plt
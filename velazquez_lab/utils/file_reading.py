@@ -1,13 +1,112 @@
 """File reading functions."""
 
 import base64
-from io import StringIO
-import openpyxl
+from collections import namedtuple
+import functools
+import hashlib
+from io import BytesIO, TextIOWrapper
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
 import pandas as pd
 
+ECLAB_MAGIC = 'EC-Lab ASCII FILE'
+
+"""
+skiprows: number of lines before the first data row
+names: column names (column indices if the file has no header)
+sep: column separator
+decimal: decimal point character
+"""
+TableFormat = namedtuple('TableFormat', ['skiprows', 'names', 'sep', 'decimal'])
+
+"""
+hits, misses: number of lookups served from and missing in the cache (in this process)
+entries: number of cached files
+nbytes: size of the cache on disk (in bytes)
+max_bytes: size above which the least recently used entries are evicted
+"""
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'entries', 'nbytes', 'max_bytes'])
+COLUMN_CACHE_VERSION = 1  # Part of the cache keys, bump when the parsing changes.
+
+"""
+EC-Lab binary (.mpr) files: a file header followed by modules, each starting with b'MODULE' and a module header.
+Module headers written by EC-Lab >= 11.50 mark the extra fields with 0xFFFFFFFF after the long name.
+"""
+MPR_MAGIC = b'BIO-LOGIC MODULAR FILE\x1a'
+MPR_HEADER_SIZE = 0x34
+MPR_MODULE_MAGIC = b'MODULE'
+MPR_MODULE_HEADER = np.dtype([('shortname', 'S10'), ('longname', 'S25'), ('length', '<u4'), ('version', '<u4'), ('date', 'S8')])
+MPR_MODULE_HEADER_V2 = np.dtype([('shortname', 'S10'), ('longname', 'S25'), ('max_length', '<u4'), ('length', '<u4'), ('version', '<u4'), ('unknown', '<u4'), ('date', 'S8')])
+MPR_DATA_OFFSET = {0: 100, 2: 405, 3: 406}  # Start of the records within the data module, by module version
+
+"""Column IDs of the data module: (name, dtype)."""
+MPR_COLUMNS = {
+  4: ('time/s', '<f8'),
+  5: ('control/V/mA', '<f4'),
+  6: ('Ewe/V', '<f4'),
+  7: ('dq/mA.h', '<f8'),
+  8: ('I/mA', '<f4'),
+  9: ('Ece/V', '<f4'),
+  11: ('<I>/mA', '<f8'),
+  13: ('(Q-Qo)/mA.h', '<f8'),
+  16: ('Analog IN 1/V', '<f4'),
+  19: ('control/V', '<f4'),
+  20: ('control/mA', '<f4'),
+  23: ('dQ/mA.h', '<f8'),
+  24: ('cycle number', '<f8'),
+  26: ('Rapp/Ohm', '<f4'),
+  32: ('freq/Hz', '<f4'),
+  33: ('|Ewe|/V', '<f4'),
+  34: ('|I|/A', '<f4'),
+  35: ('Phase(Z)/deg', '<f4'),
+  36: ('|Z|/Ohm', '<f4'),
+  37: ('Re(Z)/Ohm', '<f4'),
+  38: ('-Im(Z)/Ohm', '<f4'),
+  39: ('I Range', '<u2'),
+  69: ('R/Ohm', '<f4'),
+  70: ('P/W', '<f4'),
+  74: ('|Energy|/W.h', '<f8'),
+  75: ('Analog OUT/V', '<f4'),
+  76: ('<I>/mA', '<f4'),
+  77: ('<Ewe>/V', '<f4'),
+  78: ('Cs-2/µF-2', '<f4'),
+  96: ('|Ece|/V', '<f4'),
+  123: ('Energy charge/W.h', '<f8'),
+  124: ('Energy discharge/W.h', '<f8'),
+  125: ('Capacitance charge/µF', '<f8'),
+  126: ('Capacitance discharge/µF', '<f8'),
+  131: ('Ns', '<u2'),
+  169: ('Cs/µF', '<f4'),
+  172: ('Cp/µF', '<f4'),
+  173: ('Cp-2/µF-2', '<f4'),
+  174: ('<Ewe>/V', '<f4'),
+  178: ('(Q-Qo)/C', '<f4'),
+  179: ('dQ/C', '<f4'),
+  211: ('Q charge/discharge/mA.h', '<f8'),
+  212: ('half cycle', '<u4'),
+}
+
+MPR_POTENTIAL = ('Ewe/V', '<Ewe>/V')  # Alternative names of the potential and current columns
+MPR_CURRENT = ('<I>/mA', 'I/mA')
+
+"""Column IDs packed as bits of a single 'flags' byte: (name, bit mask)."""
+MPR_FLAGS = {
+  1: ('mode', 0x03),
+  2: ('ox/red', 0x04),
+  3: ('error', 0x08),
+  21: ('control changes', 0x10),
+  31: ('Ns changes', 0x20),
+  65: ('counter inc.', 0x80),
+}
+
 
 def load_excel_ws(file, sheet):
   """Load worksheet from an .xlsx file. Excel column and row labeling is matched."""
+  import openpyxl
   df = pd.read_excel(file, sheet, header=None)
   df.rename(columns={c: openpyxl.utils.cell.get_column_letter(c+1) for c in df.columns}, inplace=True)
   df.set_index(df.index + 1, inplace=True)
@@ -15,8 +114,450 @@ def load_excel_ws(file, sheet):
 
 
 def parse_dash_file(contents):
-  """Parse the contents of a file from dash."""
+  """Parse the contents of a file from dash.
+  Text files are decoded while they are read, so only the decoded bytes are held in memory.
+  See chunked_upload.py for files too large to upload through dcc.Upload.
+  """
   # print(contents)
   content_type, content_string = contents.split(',')
-  decoded = base64.b64decode(content_string)
-  return StringIO(decoded.decode('utf-8'))
\ No newline at end of file
+  decoded = BytesIO(base64.b64decode(content_string))
+  if decoded.getbuffer()[:len(MPR_MAGIC)] == MPR_MAGIC:
+    return decoded
+  return TextIOWrapper(decoded, encoding='utf-8', newline='')
+
+
+def _is_number(token):
+  try:
+    float(token)
+  except ValueError:
+    return False
+  return True
+
+
+def _split_line(line, sep):
+  tokens = line.rstrip('\r\n').split(sep) if sep is not None else line.split()
+  if sep is not None and len(tokens) > 1 and tokens[-1].strip() == '':  # EC-Lab ends every line with a separator
+    tokens = tokens[:-1]
+  return [t.strip() for t in tokens]
+
+
+def _eclab_header_lines(lines):
+  """Number of header lines announced on the second line of an EC-Lab preamble ("Nb header lines : 50")."""
+  try:
+    return int(lines[1].split(':')[1])
+  except (IndexError, ValueError):
+    raise ValueError("The EC-Lab header does not give its number of lines.") from None
+
+
+@functools.lru_cache(maxsize=None)
+def csv_engine():
+  """pandas.read_csv engine for text files: pyarrow's CSV parser, several times faster than pandas' C parser, if installed.
+  pyarrow is only imported by the first file read, so importing this module stays cheap.
+  """
+  try:
+    import pyarrow
+  except ImportError:
+    return 'c'
+  return 'pyarrow'
+
+
+def detect_table_format(lines):
+  """Detect the header and separator of a delimited text file.
+  Handles EC-Lab exports, both with and without the "EC-Lab ASCII FILE" preamble.
+  Args:
+    lines (list): First lines of the file. Two lines after the header are enough.
+  Returns:
+    TableFormat: skiprows, names, sep, decimal.
+  Raises:
+    ValueError: if there are no lines (e.g. an empty file), or the EC-Lab header is incomplete.
+  """
+  if len(lines) == 0:
+    raise ValueError("The file is empty.")
+
+  """Skip the EC-Lab preamble. Its second line gives the number of header lines, the last of which holds the column names."""
+  start = 0
+  if lines[0].startswith(ECLAB_MAGIC):
+    start = _eclab_header_lines(lines) - 1
+    if start >= len(lines):
+      raise ValueError(f"The EC-Lab header announces {start+1} lines, but the file has {len(lines)}.")
+
+  """Find the separator from the first data row."""
+  first = lines[start]
+  row = lines[start+1] if len(lines) > start+1 else first
+  if '\t' in row:
+    sep = '\t'
+  elif ',' in row:
+    sep = ','
+  elif ';' in row:
+    sep = ';'
+  else:
+    sep = None  # Whitespace
+
+  """EC-Lab writes decimal commas in some locales."""
+  decimal = '.'
+  if sep != ',' and ',' in row and '.' not in row:
+    decimal = ','
+
+  """The first row is a header if any of its fields is not a number."""
+  tokens = _split_line(first, sep)
+  if all(_is_number(t.replace(decimal, '.')) for t in tokens):
+    return TableFormat(skiprows=start, names=list(range(len(tokens))), sep=sep, decimal=decimal)
+  return TableFormat(skiprows=start+1, names=tokens, sep=sep, decimal=decimal)
+
+
+def _column_index(col, names):
+  """Index of a column given by index, name or tuple of alternative names."""
+  if isinstance(col, (int, np.integer)):
+    return col
+  for c in np.atleast_1d(col):
+    if c in names:
+      return names.index(c)
+  raise ValueError(f"Column not found: {col}. Available columns: {names}")
+
+
+def is_mpr(file):
+  """Whether a file path or open file is an EC-Lab binary (.mpr) file."""
+  if isinstance(file, (bytes, bytearray, memoryview)):
+    return bytes(file[:len(MPR_MAGIC)]) == MPR_MAGIC
+  if not hasattr(file, 'read'):
+    with open(file, 'rb') as f:
+      return f.read(len(MPR_MAGIC)) == MPR_MAGIC
+  pos = file.tell()
+  magic = file.read(len(MPR_MAGIC))
+  file.seek(pos)
+  return magic == MPR_MAGIC
+
+
+def read_mpr_modules(buf):
+  """Module headers of an EC-Lab binary (.mpr) file.
+  Args:
+    buf (np.ndarray): File contents as uint8.
+  Returns:
+    list: dicts with the module header fields and the 'offset' of the module data in buf.
+  """
+  if buf[:len(MPR_MAGIC)].tobytes() != MPR_MAGIC:
+    raise ValueError("Not an EC-Lab .mpr file.")
+  modules = []
+  pos = MPR_HEADER_SIZE
+  while pos < buf.size:
+    if buf[pos:pos+len(MPR_MODULE_MAGIC)].tobytes() != MPR_MODULE_MAGIC:
+      raise ValueError(f"Expected module at byte {pos}.")
+    pos += len(MPR_MODULE_MAGIC)
+    is_v2 = buf[pos+35:pos+39].view('<u4')[0] == 0xFFFFFFFF
+    hdr_dtype = MPR_MODULE_HEADER_V2 if is_v2 else MPR_MODULE_HEADER
+    hdr = buf[pos:pos+hdr_dtype.itemsize].view(hdr_dtype)[0]
+    module = {n: hdr[n] for n in hdr_dtype.names}
+    module['offset'] = pos + hdr_dtype.itemsize
+    modules.append(module)
+    pos = module['offset'] + int(module['length'])
+  return modules
+
+
+def mpr_dtype(column_ids):
+  """Record dtype of the data module for a list of column IDs. Flag columns share one 'flags' byte."""
+  fields = []
+  for cid in column_ids:
+    if cid in MPR_FLAGS:
+      if ('flags', 'u1') not in fields:
+        fields.append(('flags', 'u1'))
+    elif cid in MPR_COLUMNS:
+      name, dtype = MPR_COLUMNS[cid]
+      if any(name == f[0] for f in fields):  # Keep field names unique
+        name = f"{name} ({cid})"
+      fields.append((name, dtype))
+    else:
+      raise ValueError(f"EC-Lab column ID not implemented: {cid}")
+  return np.dtype(fields)
+
+
+def read_mpr(file):
+  """Read the data module of an EC-Lab binary (.mpr) file without copying it.
+  Args:
+    file (str, file-like, bytes): File path (memory-mapped) or file contents.
+  Returns:
+    np.ndarray: structured array of records, one field per column, viewing the file contents.
+    list: column IDs, including flag columns.
+  """
+  if isinstance(file, (bytes, bytearray, memoryview)):
+    buf = np.frombuffer(file, dtype=np.uint8)
+  elif hasattr(file, 'getbuffer'):  # BytesIO
+    buf = np.frombuffer(file.getbuffer(), dtype=np.uint8)
+  elif hasattr(file, 'read'):
+    buf = np.frombuffer(file.read(), dtype=np.uint8)
+  else:
+    buf = np.memmap(file, dtype=np.uint8, mode='r')
+
+  data = [m for m in read_mpr_modules(buf) if m['shortname'].strip() == b'VMP data']
+  if len(data) != 1:
+    raise ValueError(f"Expected one data module, found {len(data)}.")
+  data = data[0]
+  if int(data['version']) not in MPR_DATA_OFFSET:
+    raise ValueError(f"Data module version not implemented: {data['version']}")
+
+  off = data['offset']
+  nrecords = int(buf[off:off+4].view('<u4')[0])
+  ncols = int(buf[off+4])
+  id_dtype = 'u1' if data['version'] == 0 else '<u2'
+  id_size = np.dtype(id_dtype).itemsize
+  column_ids = buf[off+5:off+5+ncols*id_size].view(id_dtype).tolist()
+  records = np.ndarray(shape=(nrecords,), dtype=mpr_dtype(column_ids), buffer=buf, offset=off+MPR_DATA_OFFSET[int(data['version'])])
+  return records, column_ids
+
+
+def _read_mpr_columns(file, usecols=None):
+  records, column_ids = read_mpr(file)
+  flags = {MPR_FLAGS[cid][0]: MPR_FLAGS[cid][1] for cid in column_ids if cid in MPR_FLAGS}
+  names = [n for n in records.dtype.names if n != 'flags'] + list(flags)
+  if usecols is None:
+    usecols = names
+  cols = dict()
+  for c in usecols:
+    name = names[_column_index(c, names)]
+    if name in flags:
+      mask = flags[name]
+      shift = (mask & -mask).bit_length() - 1
+      cols[name] = ((records['flags'] & mask) >> shift).astype(np.float64)
+    else:
+      cols[name] = records[name].astype(np.float64)
+  return cols
+
+
+def _detect_file_format(f):
+  """Detect the TableFormat of an open text file, leaving its position unchanged."""
+  pos = f.tell()
+  lines = [f.readline() for _ in range(3)]
+  if lines[0].startswith(ECLAB_MAGIC):
+    lines += [f.readline() for _ in range(_eclab_header_lines(lines))]
+  f.seek(pos)
+  return detect_table_format([l for l in lines if l])
+
+
+def _select_columns(fmt, usecols):
+  """Names and indices of the columns to read."""
+  if usecols is None:
+    usecols = fmt.names
+  idx = [_column_index(c, fmt.names) for c in usecols]
+  return [fmt.names[i] for i in idx], idx
+
+
+def read_columns(file, usecols=None, fmt=None):
+  """Read columns of a delimited text file (e.g. an EC-Lab export) into float64 arrays.
+  Only the requested columns are parsed, with the fastest available parser and no type inference.
+  EC-Lab binary (.mpr) files are read directly, in which case columns are selected by name.
+  Args:
+    file (str, file-like): File path or open text file.
+    usecols (array_like, None): Column names or indices to read. All columns are read if None.
+      A tuple selects the first of several alternative names that is present.
+    fmt (TableFormat, None): File format. Detected from the first lines of the file if None.
+  Returns:
+    dict: float64 arrays keyed by column name (or index if the file has no header), in the order of usecols.
+  """
+  if is_mpr(file):
+    return _read_mpr_columns(file, usecols)
+
+  is_path = not hasattr(file, 'read')
+  f = open(file, 'r', newline='') if is_path else file
+  try:
+    if fmt is None:
+      fmt = _detect_file_format(f)
+    names, idx = _select_columns(fmt, usecols)
+
+    engine = csv_engine() if (fmt.sep is not None and fmt.decimal == '.') else 'c'  # pyarrow handles neither
+    df = pd.read_csv(
+      f,
+      sep=fmt.sep if fmt.sep is not None else r'\s+',
+      decimal=fmt.decimal,
+      header=None,
+      skiprows=fmt.skiprows,
+      usecols=idx,
+      dtype=np.float64,
+      engine=engine,
+    )
+  finally:
+    if is_path:
+      f.close()
+  return {name: df[i].to_numpy() for name, i in zip(names, idx)}
+
+
+def read_columns_chunked(file, usecols=None, fmt=None, chunksize=2**16):
+  """Read columns of a large delimited text file into float64 arrays, with memory bounded by the size of the arrays.
+  The file is parsed chunksize rows at a time into arrays preallocated from the file size, so the text is never held in memory.
+  EC-Lab binary (.mpr) files are memory-mapped, only the requested columns are copied.
+  Args:
+    file (str): File path.
+    usecols, fmt: See read_columns.
+    chunksize (int): Number of rows parsed at once.
+  Returns:
+    dict: float64 arrays keyed by column name (or index if the file has no header), in the order of usecols.
+  """
+  if is_mpr(file):
+    return _read_mpr_columns(file, usecols)
+
+  with open(file, 'r', newline='') as f:
+    if fmt is None:
+      fmt = _detect_file_format(f)
+    names, idx = _select_columns(fmt, usecols)
+    reader = pd.read_csv(
+      f,
+      sep=fmt.sep if fmt.sep is not None else r'\s+',
+      decimal=fmt.decimal,
+      header=None,
+      skiprows=fmt.skiprows,
+      usecols=idx,
+      dtype=np.float64,
+      engine='c',  # pyarrow cannot read in chunks
+      chunksize=chunksize,
+    )
+    cols = None
+    n = 0
+    for chunk in reader:
+      if cols is None:  # Estimate the number of rows from the size of the first chunk.
+        nbytes = max(f.buffer.tell() if hasattr(f, 'buffer') else 1, 1)
+        capacity = max(len(chunk), int(1.05 * len(chunk) * os.path.getsize(file) / nbytes))
+        cols = [np.empty(capacity) for _ in idx]
+      if n + len(chunk) > cols[0].size:
+        for c in cols:
+          c.resize(max(n + len(chunk), int(1.5 * c.size)), refcheck=False)
+      for c, i in zip(cols, idx):
+        c[n:n+len(chunk)] = chunk[i].to_numpy()
+      n += len(chunk)
+  if cols is None:
+    cols = [np.empty(0) for _ in idx]
+  for c in cols:
+    c.resize(n, refcheck=False)  # Shrinks in place.
+  return dict(zip(names, cols))
+
+
+@functools.lru_cache(maxsize=256)
+def _file_digest(path, mtime_ns, size, block_size=2**20):
+  """SHA-256 of a file, computed once per version of the file."""
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(block_size), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+class ColumnCache:
+  """On-disk cache of parsed columns, keyed by the SHA-256 of the source file and the reader options.
+  Each entry is a directory of .npy files, loaded memory-mapped and read-only. Entries are shared between processes
+  (CLI scripts, the app) and evicted least recently used first once the cache exceeds max_bytes.
+  Args:
+    directory (str, None): cache directory (default: $VELAZQUEZ_CACHE_DIR, or ~/.cache/velazquez_lab/columns)
+    max_bytes (int): maximum size of the cache on disk (in bytes)
+  """
+
+  def __init__(self, directory=None, max_bytes=2*2**30):
+    self.directory = directory or os.environ.get('VELAZQUEZ_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'velazquez_lab', 'columns')
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+
+  def key(self, path, **options):
+    """Cache key of a file read with the given reader options."""
+    st = os.stat(path)
+    digest = _file_digest(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    opts = repr(sorted(options.items()))
+    return hashlib.sha256(f"{COLUMN_CACHE_VERSION}:{digest}:{opts}".encode()).hexdigest()
+
+  def get(self, key):
+    """Cached columns (read-only memory maps), or None."""
+    path = os.path.join(self.directory, key)
+    try:
+      with open(os.path.join(path, 'columns.json')) as f:
+        names = json.load(f)
+      cols = {name: np.load(os.path.join(path, f"{i}.npy"), mmap_mode='r') for i, name in enumerate(names)}
+    except (OSError, ValueError):  # Missing, evicted meanwhile, or unreadable.
+      with self._lock:
+        self.misses += 1
+      return None
+    try:
+      os.utime(path)  # Mark as recently used.
+    except OSError:  # Read-only cache, or evicted meanwhile.
+      pass
+    with self._lock:
+      self.hits += 1
+    return cols
+
+  def put(self, key, cols):
+    """Save columns, renaming the entry into place so readers never see a partial entry, then evict old entries."""
+    os.makedirs(self.directory, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+    try:
+      for i, vals in enumerate(cols.values()):
+        np.save(os.path.join(tmp, f"{i}.npy"), np.asarray(vals), allow_pickle=False)
+      with open(os.path.join(tmp, 'columns.json'), 'w') as f:
+        json.dump([n if isinstance(n, str) else int(n) for n in cols], f)
+    except OSError:  # E.g. disk full: don't leave a partial entry behind.
+      shutil.rmtree(tmp, ignore_errors=True)
+      raise
+    try:
+      os.rename(tmp, os.path.join(self.directory, key))
+    except OSError:  # Saved by another process meanwhile.
+      shutil.rmtree(tmp, ignore_errors=True)
+    self.evict()
+
+  def _entries(self):
+    """(last use time, size in bytes, path) of each entry."""
+    entries = []
+    if not os.path.isdir(self.directory):
+      return entries
+    for name in os.listdir(self.directory):
+      path = os.path.join(self.directory, name)
+      if name.startswith('.'):
+        continue
+      try:
+        nbytes = sum(e.stat().st_size for e in os.scandir(path))
+        entries.append((os.path.getmtime(path), nbytes, path))
+      except FileNotFoundError:
+        pass
+    return entries
+
+  def evict(self):
+    """Remove the least recently used entries until the cache fits in max_bytes."""
+    entries = sorted(self._entries())
+    total = sum(e[1] for e in entries)
+    for _, nbytes, path in entries:
+      if total <= self.max_bytes:
+        break
+      shutil.rmtree(path, ignore_errors=True)
+      total -= nbytes
+
+  def clear(self):
+    """Remove all entries and reset the counters."""
+    shutil.rmtree(self.directory, ignore_errors=True)
+    self.hits, self.misses = 0, 0
+
+  def cache_info(self):
+    """CacheInfo of the cache."""
+    entries = self._entries()
+    return CacheInfo(self.hits, self.misses, len(entries), sum(e[1] for e in entries), self.max_bytes)
+
+
+"""Cache shared by all loaders of the package."""
+COLUMN_CACHE = ColumnCache()
+
+
+def load_columns(file, usecols=None, fmt=None, cache=COLUMN_CACHE):
+  """read_columns, served from the on-disk column cache for text files given by path.
+  Open files (e.g. uploads) and EC-Lab binary (.mpr) files, which are memory-mapped anyway, are read directly.
+  Args:
+    file, usecols, fmt: See read_columns.
+    cache (ColumnCache, None): column cache. None disables caching.
+  Returns:
+    dict: float64 arrays keyed by column name, read-only if served from the cache.
+  Notes:
+    The cache is only an optimization: if it can't be written, the parsed columns are returned anyway.
+  """
+  if cache is None or not isinstance(file, (str, os.PathLike)) or is_mpr(file):
+    return read_columns(file, usecols=usecols, fmt=fmt)
+  key = cache.key(file, usecols=usecols, fmt=fmt)
+  cols = cache.get(key)
+  if cols is None:
+    cols = read_columns(file, usecols=usecols, fmt=fmt)
+    try:
+      cache.put(key, cols)
+    except OSError:  # Unwritable cache directory, disk full, ...
+      pass
+  return cols
@@ -1,41 +1,209 @@
 """TODO."""
 
-import copy
-import matplotlib.pyplot as plt
+import functools
+import math
 import numpy as np
 import pandas as pd
-from scipy.signal import savgol_filter
-from scipy.special import factorial
 
 
 def apply_filter(raw, window_length, polyorder, **kwargs):
   """TODO."""
+  from scipy.signal import savgol_filter
   return savgol_filter(raw, window_length, polyorder, **kwargs)
 
 
+@functools.lru_cache(maxsize=None)
+def central_stencil(n):
+  """Integer coefficients of n repeated central differences, i.e. [1, 0, -1] convolved with itself n times.
+  Divided by 2**n, they give the interior of n repeated np.gradient calls.
+  Returns:
+    np.ndarray: 2*n+1 coefficients, to be correlated with the data (first coefficient applies to the first point)
+  """
+  coefs = np.array([1])
+  for _ in range(n):
+    coefs = np.convolve(coefs, [-1, 0, 1])
+  coefs.flags.writeable = False
+  return coefs
+
+
+def repeated_gradient(x, n):
+  """Same as applying np.gradient n times along the last axis, in one pass over the data.
+  The interior is one correlation with central_stencil(n). Only the n points at each end, where np.gradient switches
+  to one-sided differences, are computed with np.gradient on a slice of 2*n+1 points.
+  Args:
+    x (array_like): data, shape (..., npoints)
+    n (int): number of derivatives
+  Returns:
+    np.ndarray: n-th derivative (in units of sample spacing), same shape as x
+  """
+  x = np.asarray(x, dtype=float)
+  size = x.shape[-1]
+  if n == 0:
+    return x.copy()
+  if size <= 2*n+1:
+    for _ in range(n):
+      x = np.gradient(x, axis=-1)
+    return x
+
+  out = np.empty_like(x)
+  m = size - 2*n
+  interior = out[..., n:size-n]
+  interior[...] = 0
+  for j, c in enumerate(central_stencil(n)):
+    if c != 0:
+      interior += c * x[..., j:j+m]
+  interior /= 2**n
+  for sl, dst in ((slice(None, 2*n+1), slice(None, n)), (slice(-(2*n+1), None), slice(-n, None))):
+    edge = x[..., sl]
+    for _ in range(n):
+      edge = np.gradient(edge, axis=-1)
+    out[..., dst] = edge[..., dst]
+  return out
+
+
+@functools.lru_cache(maxsize=None)
+def _window_constant(polyorder):
+  """Polynomial order dependent factor of the optimal window length formula."""
+  return 2 * (polyorder+2) * math.factorial(2*polyorder+3)**2 / math.factorial(polyorder+1)**2
+
+
+def optimize_window_many(raw, polyorder=5, **kwargs):
+  """Optimize the Savitzky-Golay filter window length of many signals at once, and filter them.
+  Uses the analytic formula of https://arxiv.org/pdf/1808.10489.pdf, with the (polyorder+2)-th derivative of every signal
+  computed in one pass (see repeated_gradient). Signals sharing a window length are filtered together.
+  Args:
+    raw (array_like): signals, shape (nsignals, npoints)
+    polyorder (int): order of the filter polynomial
+    **kwargs: keyword arguments of scipy.signal.savgol_filter
+  Returns:
+    np.ndarray: odd window length of each signal, clipped to the valid range (polyorder, npoints]
+    np.ndarray: filtered signals, shape (nsignals, npoints)
+  """
+  raw = np.asarray(raw, dtype=float)
+  if raw.ndim != 2:
+    raise ValueError(f"Expected a 2-D array of signals, got shape {raw.shape}.")
+  npoints = raw.shape[1]
+  max_window = npoints if npoints%2 == 1 else npoints-1
+  min_window = polyorder+1 if polyorder%2 == 0 else polyorder+2
+  if max_window < min_window:
+    raise ValueError(f"At least {min_window} points are needed for polyorder {polyorder}, got {npoints}.")
+
+  """Window length of each signal."""
+  block = max(1, 2**16 // npoints)  # Rows per block, so the derivative temporaries stay in cache.
+  vn = np.empty(len(raw))
+  for k in range(0, len(raw), block):
+    vn[k:k+block] = np.sum(repeated_gradient(raw[k:k+block], polyorder+2)**2, axis=1) / npoints
+  with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+    val = _window_constant(polyorder) * np.var(raw, axis=1) / vn
+    window_length = val ** (1/(2*polyorder+5))
+  window_length = np.clip(np.nan_to_num(window_length, nan=min_window, posinf=max_window), 0, max_window).astype(int)
+  window_length += (window_length%2 == 0)  # Make sure it's odd
+  window_length = np.clip(window_length, min_window, max_window)
+
+  """Filter."""
+  filt = np.empty_like(raw)
+  for wl in np.unique(window_length):
+    rows = window_length == wl
+    filt[rows] = apply_filter(raw[rows], int(wl), polyorder, axis=-1, **kwargs)
+  return window_length, filt
+
+
 def optimize_window(raw, polyorder=5, **kwargs):
-  """Optimize Savitzky-Golay filter window length."""
-  """Use analytic formula for window_length.
-  https://arxiv.org/pdf/1808.10489.pdf
+  """Optimize Savitzky-Golay filter window length. See optimize_window_many.
+  Args:
+    raw (array_like): signal
+    polyorder (int): order of the filter polynomial
+    **kwargs: keyword arguments of scipy.signal.savgol_filter
+  Returns:
+    int: odd window length
+    np.ndarray: filtered signal
+  """
+  window_length, filt = optimize_window_many(np.asarray(raw)[np.newaxis, :], polyorder, **kwargs)
+  return int(window_length[0]), filt[0]
+
+
+class StreamingSavgolFilter:
+  """Savitzky-Golay filter of a signal arriving in chunks, e.g. the current of a running experiment.
+  Each sample is emitted as soon as the window_length//2 samples after it have arrived, so the latency is bounded.
+  The first and last window_length//2 samples are fitted as scipy.signal.savgol_filter does with mode='interp',
+  so the concatenated outputs of update and flush match savgol_filter on the whole signal.
+  Args:
+    window_length (int): odd number of samples in the filter window
+    polyorder (int): order of the filter polynomial, less than window_length
+  Examples:
+    filt = StreamingSavgolFilter(51, 3)
+    for chunk in feed:
+      plot(filt.update(chunk))
+    plot(filt.flush())
   """
-  n = polyorder + 2
-  pts = copy.deepcopy(raw)
-  while True:  # n+2 derivative
-    if n==0:
-      break
-    pts = np.gradient(pts)
-    n -= 1
-  vn = np.sum(pts**2) / raw.size
-  val = (2 * (polyorder+2) * factorial(2*polyorder+3)**2 * np.std(raw)**2) / (factorial(polyorder+1)**2 * vn)
-  window_length = val ** (1/(2*polyorder+5))
-  window_length = int(window_length)
-  if window_length%2 == 0:  # Make sure it's odd
-    window_length += 1
-  print(vn, val, window_length)
-  return window_length, apply_filter(raw, window_length, polyorder)
+
+  def __init__(self, window_length, polyorder):
+    from scipy.signal import savgol_coeffs
+    if window_length%2 == 0 or polyorder >= window_length:
+      raise ValueError(f"window_length must be odd and greater than polyorder, got {window_length} and {polyorder}.")
+    self.window_length = window_length
+    self.polyorder = polyorder
+    self.latency = window_length // 2  # In samples.
+
+    """Precomputed coefficients: interior dot product, and polynomial fits of the first and last windows."""
+    self.coeffs = savgol_coeffs(window_length, polyorder, use='dot')
+    t = np.arange(window_length) - self.latency
+    vander = np.vander(t, polyorder+1)
+    fit = vander @ np.linalg.pinv(vander)
+    self.start_coeffs = fit[:self.latency]
+    self.end_coeffs = fit[window_length-self.latency:]
+
+    self._buffer = np.empty(window_length)  # Last window_length samples.
+    self.reset()
+
+  def reset(self):
+    """Start a new signal."""
+    self._nbuf = 0
+    self.started = False
+    self.nsamples = 0  # Received samples.
+
+  def update(self, chunk):
+    """Add samples.
+    Args:
+      chunk (array_like): new samples, any number
+    Returns:
+      np.ndarray: filtered samples which became available, in order, possibly none
+    """
+    chunk = np.asarray(chunk, dtype=float).ravel()
+    x = np.concatenate([self._buffer[:self._nbuf], chunk])
+    self.nsamples += chunk.size
+    out = []
+    if not self.started:
+      if x.size < self.window_length:
+        self._buffer[:x.size] = x
+        self._nbuf = x.size
+        return np.empty(0)
+      out.append(self.start_coeffs @ x[:self.window_length])
+      self.started = True
+      first = 0
+    else:
+      first = 1  # The center of the buffered window has already been emitted.
+    if x.size - first >= self.window_length:  # np.correlate would swap shorter inputs.
+      out.append(np.correlate(x[first:], self.coeffs, mode='valid'))
+    self._buffer[:] = x[-self.window_length:]
+    self._nbuf = self.window_length
+    return np.concatenate(out) if out else np.empty(0)
+
+  def flush(self):
+    """Filtered last window_length//2 samples, fitted on the last window. The filter is then ready for a new signal.
+    Returns:
+      np.ndarray: remaining filtered samples
+    """
+    if not self.started:
+      raise ValueError(f"At least window_length ({self.window_length}) samples are needed, got {self.nsamples}.")
+    out = self.end_coeffs @ self._buffer
+    self.reset()
+    return out
 
 
 if __name__ == '__main__':
+  import matplotlib.pyplot as plt
+
   df = pd.read_csv('../../data/example_filter.csv', header=None)
   window_length, filt = optimize_window(df.iloc[:,1], 5)
 
@@ -4,7 +4,8 @@ import numericalunits as nu
 import numpy as np
 import pandas as pd
 import uncertainties as un
-from uncertainties import unumpy as unp
+
+from velazquez_lab.utils.uarray import UArray
 
 FARADAY_CONST = 96485 * (nu.C/nu.mol)
 SCCM = nu.cm**3 / nu.minute
@@ -34,39 +35,92 @@ GAS_MIXTURES = {
   'check_0.5': { 'CO2': 0.005, 'CO': 0.005, 'CH4': 0, 'H2': 0.005, 'O2': 0.005, 'N2': 0.98, 'He': 0 } ,
 }
 
-@np.vectorize
 def molec_struct_factor(natoms):
-  """Molecular structure correction factor of gas with n atoms (1 = monoatomic, 2 = diatomic, ...)."""
-  if natoms==1:
-    return 1.030
-  elif natoms==2:
-    return 1
-  elif natoms==3:
-    return 0.941
-  elif natoms>=4:
-    return 0.880
-  else:
-    raise ValueError(f"Number of atoms {natoms} is not valid.")
+  """Molecular structure correction factor of gas with n atoms (1 = monoatomic, 2 = diatomic, ...).
+  Args:
+    natoms (array_like): number of atoms in one molecule
+  Returns:
+    np.ndarray: correction factors, same shape as natoms
+  """
+  natoms = np.asarray(natoms)
+  conds = [natoms==1, natoms==2, natoms==3, natoms>=4]
+  valid = np.logical_or.reduce(conds)
+  if not np.all(valid):
+    raise ValueError(f"Number of atoms {natoms[~valid].flat[0]} is not valid.")
+  return np.select(conds, [1.030, 1, 0.941, 0.880])
+
+
+"""
+Gas properties as arrays, one entry per gas of GASES (same order), for batched calculations.
+names: gas names
+index: position of each gas name in the arrays
+cp, density, natoms, nelec_form: see GASES
+struct_factor: molecular structure correction factor, see molec_struct_factor
+"""
+GasTable = namedtuple('GasTable', ['names', 'index', 'cp', 'density', 'natoms', 'nelec_form', 'struct_factor'])
+
+def build_gas_table(gases=GASES):
+  """Create a GasTable from a DataFrame of gas properties (one column per gas)."""
+  cols = {key: gases.loc[key].to_numpy(dtype=float) for key in ('cp', 'density', 'natoms', 'nelec_form')}
+  return GasTable(
+    names=tuple(gases.columns),
+    index={name: k for k, name in enumerate(gases.columns)},
+    struct_factor=molec_struct_factor(cols['natoms']),
+    **cols,
+  )
+
+GAS_TABLE = build_gas_table()
 
 
 def gas_corr_factor(gas_fracs, ref_gas_name='N2'):
   """Get the gas correction factor.
+  See gas_corr_factor_many for many gas mixtures.
   Args:
     fracs (pd.Series): gas fractions (by volume or flow rate) with index being the gase name
     ref_gas_name (str): reference gas name
   """
-  gas_names = gas_fracs.index
+  idx = [GAS_TABLE.index[g] for g in gas_fracs.index]
+  ref = GAS_TABLE.index[ref_gas_name]
   a = gas_fracs  # Gas fractions
-  s = molec_struct_factor(GASES.loc['natoms', gas_names])
-  d = GASES.loc['density', gas_names]
-  cp = GASES.loc['cp', gas_names]
-  ref_gas = GASES[ref_gas_name]
-  corr = (ref_gas['density']*ref_gas['cp']) * sum(gas_fracs * s) / sum(a * d * cp)
+  s = GAS_TABLE.struct_factor[idx]
+  d = GAS_TABLE.density[idx]
+  cp = GAS_TABLE.cp[idx]
+  corr = (GAS_TABLE.density[ref]*GAS_TABLE.cp[ref]) * sum(gas_fracs * s) / sum(a * d * cp)
   return corr
 
 
+def gas_corr_factor_many(fracs, ref_gas_name='N2'):
+  """Gas correction factors of many gas mixtures, with first order error propagation in closed form.
+  Args:
+    fracs (array_like, pd.DataFrame, UArray): gas fractions, shape (nsamples, ngases) with columns in the order of GAS_TABLE.names,
+      or a DataFrame with gas names as columns (missing gases are taken as 0). The errors of a UArray are taken as independent.
+    ref_gas_name (str): reference gas name
+  Returns:
+    UArray: correction factors (nsamples,)
+  """
+  fracs_err = _gas_columns(fracs.s) if isinstance(fracs, UArray) else 0
+  fracs = _gas_columns(fracs.n if isinstance(fracs, UArray) else fracs)
+  ref = GAS_TABLE.index[ref_gas_name]
+  s = GAS_TABLE.struct_factor
+  w = GAS_TABLE.density * GAS_TABLE.cp
+  u, v = fracs @ s, fracs @ w
+  grad = w[ref] * (s*v[:, np.newaxis] - u[:, np.newaxis]*w) / v[:, np.newaxis]**2  # d(corr)/d(fracs)
+  return UArray(w[ref] * u / v, np.sqrt(np.sum((grad*fracs_err)**2, axis=1)))
+
+
+def _gas_columns(a):
+  """2-D float array with one column per gas of GAS_TABLE."""
+  if isinstance(a, pd.DataFrame):
+    a = a.reindex(columns=GAS_TABLE.names, fill_value=0)
+  a = np.atleast_2d(np.asarray(a, dtype=float))
+  if a.shape[-1] != len(GAS_TABLE.names):
+    raise ValueError(f"Expected {len(GAS_TABLE.names)} gas columns {GAS_TABLE.names}, got shape {a.shape}.")
+  return a
+
+
 def mix_gases(gas_names, actual_rates):
   """Mix gases together to find new concentrations.
+  See mix_gases_many for many flow rate samples.
   Args:
     gas_names (list): list of gases to mix
     actual_rates (list): rates for each gas mixture input
@@ -100,6 +154,71 @@ def mix_gases(gas_names, actual_rates):
   return final_mix_fracs
 
 
+def mixture_matrix(gas_names):
+  """Fractions of each gas of GAS_TABLE in each input (gas mixture of GAS_MIXTURES, or pure gas).
+  Args:
+    gas_names (list): input names
+  Returns:
+    np.ndarray: fractions, shape (ninputs, ngases)
+  """
+  if isinstance(gas_names, str):
+    gas_names = [gas_names]
+  mat = np.zeros((len(gas_names), len(GAS_TABLE.names)))
+  for k, name in enumerate(gas_names):
+    if name in GAS_MIXTURES:
+      for g, frac in GAS_MIXTURES[name].items():
+        mat[k, GAS_TABLE.index[g]] = frac
+    elif name in GAS_TABLE.index:
+      mat[k, GAS_TABLE.index[name]] = 1
+    else:
+      raise ValueError(f"Gas not implemented: {name}")
+  return mat
+
+
+"""
+names: gas names, in the order of the columns of fracs (see GAS_TABLE)
+fracs: gas fractions of the mixtures, UArray of shape (nsamples, ngases)
+corr: gas correction factors of the mixtures, UArray of shape (nsamples,)
+"""
+GasMixtures = namedtuple('GasMixtures', ['names', 'fracs', 'corr'])
+
+def mix_gases_many(gas_names, actual_rates, ref_gas_name='N2'):
+  """Mix gases for many flow rate samples (e.g. a mass flow controller log), and get the correction factors of the mixtures.
+  Errors are propagated to first order from the independent flow rate errors, in closed form on arrays.
+  Unlike chaining mix_gases and gas_corr_factor_many, this keeps the correlations between the fractions of a mixture.
+  Args:
+    gas_names (list): gases or gas mixtures (see GAS_MIXTURES) of the inputs
+    actual_rates (array_like, UArray): flow rates, shape (nsamples, ninputs), with errors if a UArray
+    ref_gas_name (str): reference gas name for the correction factors
+  Returns:
+    GasMixtures: fractions and correction factors
+  """
+  mat = mixture_matrix(gas_names)
+  rates_err = actual_rates.s if isinstance(actual_rates, UArray) else 0
+  rates = np.atleast_2d(actual_rates.n if isinstance(actual_rates, UArray) else np.asarray(actual_rates, dtype=float))
+  comp_rates = rates @ mat  # Flow rate of each gas.
+  tot_rate = comp_rates.sum(axis=1)
+  fracs = comp_rates / tot_rate[:, np.newaxis]
+
+  ref = GAS_TABLE.index[ref_gas_name]
+  s = GAS_TABLE.struct_factor
+  w = GAS_TABLE.density * GAS_TABLE.cp
+  u, v = comp_rates @ s, comp_rates @ w  # The total rate cancels in the correction factor.
+  corr = w[ref] * u / v
+
+  """Sum the squared contributions of each input."""
+  rates_err = np.broadcast_to(rates_err, rates.shape)
+  fracs_var = np.zeros_like(fracs)
+  corr_var = np.zeros_like(corr)
+  in_tot, in_s, in_w = mat.sum(axis=1), mat @ s, mat @ w
+  for k in range(mat.shape[0]):
+    dfracs = (mat[k] - fracs*in_tot[k]) / tot_rate[:, np.newaxis]  # d(fracs)/d(rate k)
+    fracs_var += (dfracs * rates_err[:, k:k+1])**2
+    dcorr = w[ref] * (in_s[k]*v - u*in_w[k]) / v**2
+    corr_var += (dcorr * rates_err[:, k])**2
+  return GasMixtures(GAS_TABLE.names, UArray(fracs, np.sqrt(fracs_var)), UArray(corr, np.sqrt(corr_var)))
+
+
 def ideal_gas_moles(p, v, t):
   """Get number of moles for ideal gas.
   Args:
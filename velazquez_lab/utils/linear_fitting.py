@@ -1,16 +1,14 @@
 """Functions for linear fitting.
 Also see notebooks/linear_fitting.ipynb.
+lmfit and matplotlib are imported on first use, they dominate the import time of the app.
 """
 
-import lmfit
-import matplotlib.pyplot as plt
-import matplotlib as mpl
+from collections import namedtuple
 import numpy as np
 import pandas as pd
-import uncertainties as un
-from uncertainties import unumpy
 
 from velazquez_lab.utils import styles
+from velazquez_lab.utils.uarray import UArray
 
 
 def linear_eqn(x, m, b):
@@ -27,7 +25,128 @@ def chisq_linear(m, b, x, y, x_err=None, y_err=None):
   else:
     return (y - y_pred)**2 / (m**2*x_err**2 + y_err**2)
 
-def linear_fit(x, y, x_err=None, y_err=None, m_init=1, b_init=0, m_range=(-np.inf, np.inf), b_range=(-np.inf, np.inf), vary_m=True, vary_b=True, is_verbose=False, return_fitres=False):
+def residual_linear(m, b, x, y, x_err=None, y_err=None):
+  """Residuals (normalized by the effective errors) for data fit to a linear model."""
+  y_pred = linear_eqn(x, m=m, b=b)
+  if x_err is None and y_err is None:
+    return y - y_pred
+  elif x_err is None:
+    return (y - y_pred) / y_err
+  else:
+    y_err = 0 if y_err is None else y_err
+    return (y - y_pred) / np.sqrt(m**2*x_err**2 + y_err**2)
+
+def wls_linear(x, y, w=None, m_fixed=None, b_fixed=None):
+  """Closed-form weighted least squares line along the last axis.
+  Args:
+    x (np.ndarray): X data values.
+    y (np.ndarray): Y data values.
+    w (np.ndarray, None): Weights (1/y_err**2). Unweighted if None.
+    m_fixed (float, None): Slope to hold fixed.
+    b_fixed (float, None): Intercept to hold fixed.
+  Returns:
+    m, b, var_m, var_b, cov_mb, chisq: best-fit parameters, their unscaled (co)variances and the chi-squared.
+  """
+  if w is None:
+    w = np.ones_like(y)
+  sw = np.sum(w, axis=-1)
+  if m_fixed is not None:  # Fit the intercept only.
+    m = np.full(sw.shape, m_fixed, dtype=float)
+    b = np.sum(w*(y - m_fixed*x), axis=-1) / sw
+    var_m, var_b, cov_mb = np.zeros(sw.shape), 1/sw, np.zeros(sw.shape)
+  elif b_fixed is not None:  # Fit the slope only.
+    swxx = np.sum(w*x**2, axis=-1)
+    m = np.sum(w*x*(y - b_fixed), axis=-1) / swxx
+    b = np.full(sw.shape, b_fixed, dtype=float)
+    var_m, var_b, cov_mb = 1/swxx, np.zeros(sw.shape), np.zeros(sw.shape)
+  else:  # Centered sums avoid cancellation when x is far from zero.
+    xm = np.sum(w*x, axis=-1) / sw
+    ym = np.sum(w*y, axis=-1) / sw
+    dx = x - xm[..., np.newaxis]
+    sdd = np.sum(w*dx**2, axis=-1)
+    m = np.sum(w*dx*y, axis=-1) / sdd
+    b = ym - m*xm
+    var_m, var_b, cov_mb = 1/sdd, 1/sw + xm**2/sdd, -xm/sdd
+  chisq = np.sum(w*(y - m[..., np.newaxis]*x - b[..., np.newaxis])**2, axis=-1)
+  return m, b, var_m, var_b, cov_mb, chisq
+
+def york_linear(x, y, x_err, y_err, valid=None, max_iter=100, rtol=1e-12):
+  """Line with errors on both X and Y using the York method, along the last axis.
+  Minimizes the effective-variance chi-squared sum((y - m*x - b)**2 / (y_err**2 + m**2*x_err**2)).
+  Args:
+    x (np.ndarray): X data values.
+    y (np.ndarray): Y data values.
+    x_err (np.ndarray): X data errors.
+    y_err (np.ndarray): Y data errors.
+    valid (np.ndarray, None): Mask of points to include. All points are included if None.
+    max_iter (int): Maximum number of slope iterations.
+    rtol (float): Relative tolerance on the slope for convergence.
+  Returns:
+    m, b, var_m, var_b, cov_mb, chisq: best-fit parameters, their unscaled (co)variances and the chi-squared.
+  Notes:
+    York et al., Am. J. Phys. 72, 367 (2004), without correlations between X and Y errors.
+  """
+  sx2, sy2 = x_err**2, y_err**2
+  valid = np.ones(np.shape(y), dtype=bool) if valid is None else valid
+  w0 = valid / sy2 if np.all(sy2[valid] > 0) else valid.astype(float)
+  m = wls_linear(x, y, w0)[0]  # Initial guess ignoring X errors
+  for _ in range(max_iter):
+    w = valid / (sy2 + m[..., np.newaxis]**2*sx2)
+    sw = np.sum(w, axis=-1)
+    xm = np.sum(w*x, axis=-1) / sw
+    ym = np.sum(w*y, axis=-1) / sw
+    u = x - xm[..., np.newaxis]
+    v = y - ym[..., np.newaxis]
+    beta = w * (u*sy2 + m[..., np.newaxis]*v*sx2)
+    m_new = np.sum(w*beta*v, axis=-1) / np.sum(w*beta*u, axis=-1)
+    converged = not np.any(np.abs(m_new - m) > rtol*np.abs(m_new))  # Degenerate (NaN) fits count as converged
+    m = m_new
+    if converged:
+      break
+
+  w = valid / (sy2 + m[..., np.newaxis]**2*sx2)
+  sw = np.sum(w, axis=-1)
+  xm = np.sum(w*x, axis=-1) / sw
+  ym = np.sum(w*y, axis=-1) / sw
+  u = x - xm[..., np.newaxis]
+  v = y - ym[..., np.newaxis]
+  b = ym - m*xm
+  xadj = xm[..., np.newaxis] + w*(u*sy2 + m[..., np.newaxis]*v*sx2)  # Least-squares adjusted X values
+  xadj_m = np.sum(w*xadj, axis=-1) / sw
+  var_m = 1 / np.sum(w*(xadj - xadj_m[..., np.newaxis])**2, axis=-1)
+  var_b = 1/sw + xadj_m**2*var_m
+  cov_mb = -xadj_m*var_m
+  chisq = np.sum(w*(y - m[..., np.newaxis]*x - b[..., np.newaxis])**2, axis=-1)
+  return m, b, var_m, var_b, cov_mb, chisq
+
+def _analytic_fitres(x, y, x_err, y_err, m, b, var_m, var_b, cov_mb, chisq, vary_m, vary_b, method):
+  """Wrap a closed-form solution in an lmfit.minimizer.MinimizerResult, with lmfit's covariance scaling."""
+  import lmfit
+  ndata = len(x)
+  nvarys = int(vary_m) + int(vary_b)
+  nfree = ndata - nvarys
+  redchi = chisq / nfree
+  params = lmfit.Parameters()
+  params.add('m', value=m, vary=vary_m)
+  params.add('b', value=b, vary=vary_b)
+  params['m'].stderr = np.sqrt(var_m*redchi)
+  params['b'].stderr = np.sqrt(var_b*redchi)
+  if vary_m and vary_b:
+    correl = cov_mb / np.sqrt(var_m*var_b)
+    params['m'].correl = {'b': correl}
+    params['b'].correl = {'m': correl}
+  var_names = [n for n, vary in (('m', vary_m), ('b', vary_b)) if vary]
+  idx = [i for i, vary in enumerate((vary_m, vary_b)) if vary]
+  covar = redchi * np.array([[var_m, cov_mb], [cov_mb, var_b]])[np.ix_(idx, idx)]
+  neg2_log_likel = ndata * np.log(max(chisq, 1e-250) / ndata)  # As computed by lmfit
+  return lmfit.minimizer.MinimizerResult(
+    params=params, method=method, nfev=0, ndata=ndata, nvarys=nvarys, nfree=nfree,
+    chisqr=chisq, redchi=redchi, aic=neg2_log_likel + 2*nvarys, bic=neg2_log_likel + np.log(ndata)*nvarys,
+    residual=residual_linear(m, b, x, y, x_err, y_err), covar=covar, var_names=var_names,
+    errorbars=True, success=True, message='Closed-form solution.',
+  )
+
+def linear_fit(x, y, x_err=None, y_err=None, m_init=1, b_init=0, m_range=(-np.inf, np.inf), b_range=(-np.inf, np.inf), vary_m=True, vary_b=True, is_verbose=False, return_fitres=False, progress=None):
   """Perform a linear fit using a chi squared fit.
   Args:
     x (array_like): X data values.
@@ -42,32 +161,123 @@ def linear_fit(x, y, x_err=None, y_err=None, m_init=1, b_init=0, m_range=(-np.in
     vary_b (bool): Whether to vary the intercept. If False then the value is fixed to b_init.
     is_verbose (bool): Whether to print the fit details.
     return_fitres (bool): Whether to return the fit results.
+    progress (app.jobs.Progress, None): Progress reporter of a background job, updated at each stage of the fit and
+      every 100 iterations of the iterative fit. It raises once the job is cancelled, which stops the fit.
   Returns:
     m_fit (un.ufloat): Best-fit slope with uncertainty.
     b_fit (un.ufloat): Best-fit intercept with uncertainty.
     redchi (float): Reduced chi-squared value.
   Notes:
     Errors on X and Y: https://aip.scitation.org/doi/pdf/10.1063/1.4823074
+    Unweighted and Y-error fits are solved in closed form, and fits with X errors with the York method.
+    lmfit is only used when a bound is active or for fixed parameters with X errors.
+    As with lmfit, uncertainties are scaled by the reduced chi-squared.
   """
-  # Setup parameters.
-  params = lmfit.Parameters()
-  params.add('m', value=m_init, min=m_range[0], max=m_range[1], vary=vary_m)
-  params.add('b', value=b_init, min=b_range[0], max=b_range[1], vary=vary_b)
+  import uncertainties as un
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  x_err = None if x_err is None else np.asarray(x_err, dtype=float)
+  y_err = None if y_err is None else np.asarray(y_err, dtype=float)
+
+  # Closed-form solution.
+  if progress is not None:
+    progress.update(0, 2, 'Linear fit')
+  result = None
+  if vary_m or vary_b:
+    if x_err is None:
+      sol = wls_linear(x, y, None if y_err is None else 1/y_err**2, m_fixed=None if vary_m else m_init, b_fixed=None if vary_b else b_init)
+      method = 'analytic'
+    elif vary_m and vary_b:
+      sol = york_linear(x, y, x_err, np.zeros_like(x) if y_err is None else y_err)
+      method = 'york'
+    else:
+      sol = None
+    if sol is not None:
+      m, b = sol[0], sol[1]
+      if (m_range[0] <= m <= m_range[1]) and (b_range[0] <= b <= b_range[1]):
+        result = _analytic_fitres(x, y, x_err, y_err, *(float(v) for v in sol), vary_m, vary_b, method)
+
+  # Iterative fit, needed when a bound is active.
+  if result is None:
+    import lmfit
+    params = lmfit.Parameters()
+    params.add('m', value=m_init, min=m_range[0], max=m_range[1], vary=vary_m)
+    params.add('b', value=b_init, min=b_range[0], max=b_range[1], vary=vary_b)
+    _residual_linear = lambda params: residual_linear(params['m'].value, params['b'].value, x, y, x_err, y_err)
+    iter_cb = None
+    if progress is not None:
+      progress.update(1, 2, 'Iterative linear fit')
+      def iter_cb(params, it, resid):
+        if it % 100 == 0:
+          progress.update(1, 2, f'Iterative linear fit, iteration {it}')
+    result = lmfit.minimize(_residual_linear, params, iter_cb=iter_cb)
 
-  # Do fit.
-  _chisq_linear = lambda params: chisq_linear(params['m'], params['b'], x, y, x_err, y_err)
-  result = lmfit.minimize(_chisq_linear, params)
   if is_verbose:
     # print(f"Is fit valid = {result.status()}")
+    import lmfit
     print(lmfit.fit_report(result))
-  m_fit = un.ufloat(result.params['m'].value, result.params['m'].stderr)
-  b_fit = un.ufloat(result.params['b'].value, result.params['b'].stderr)
+  m_fit = un.ufloat(result.params['m'].value, result.params['m'].stderr or 0)  # Fixed parameters have no stderr
+  b_fit = un.ufloat(result.params['b'].value, result.params['b'].stderr or 0)
   if return_fitres:
     return m_fit, b_fit, result.redchi, result
   return m_fit, b_fit, result.redchi
 
+"""Results of linear_fit_many: arrays with one value per fit."""
+LinearFits = namedtuple('LinearFits', ['m', 'm_err', 'b', 'b_err', 'redchi', 'rsq'])
+
+def _as_2d(a):
+  """Stack ragged 1-D arrays into a 2-D array padded with NaN."""
+  if a is None:
+    return None
+  if isinstance(a, (list, tuple)) and len(a) > 0 and np.ndim(a[0]) == 1 and len(set(len(r) for r in a)) > 1:
+    out = np.full((len(a), max(len(r) for r in a)), np.nan)
+    for row, r in zip(out, a):
+      row[:len(r)] = r
+    return out
+  return np.atleast_2d(np.asarray(a, dtype=float))
+
+def linear_fit_many(x, y, x_err=None, y_err=None):
+  """Perform many independent linear fits with vectorized reductions.
+  Uses the same closed-form (or York) solutions and uncertainty scaling as linear_fit.
+  Args:
+    x (array_like): X data values, shape (nfits, npoints), or (npoints,) if shared by all fits.
+      A list of arrays of different lengths is padded with NaN.
+    y (array_like): Y data values, like x.
+    x_err (array_like, None): X data errors, like x. If None then X errors are not included in the fits.
+    y_err (array_like, None): Y data errors, like x. If None then Y errors are not included in the fits.
+  Returns:
+    LinearFits: arrays of slopes (m), intercepts (b), their errors, reduced chi-squared values and R-squared values.
+  Notes:
+    NaN values (e.g. padding) are excluded from the fits.
+  """
+  x, y, x_err, y_err = (_as_2d(a) for a in (x, y, x_err, y_err))
+  x, y = np.broadcast_arrays(x, y)
+  valid = np.isfinite(x) & np.isfinite(y)
+  for err in (x_err, y_err):
+    if err is not None:
+      valid &= np.broadcast_to(np.isfinite(err), y.shape)
+  x, y = np.where(valid, x, 0), np.where(valid, y, 0)
+
+  if x_err is None:
+    w = valid.astype(float)
+    if y_err is not None:
+      w = np.where(valid, 1 / np.where(valid, y_err, 1)**2, 0)
+    m, b, var_m, var_b, _, chisq = wls_linear(x, y, w)
+  else:
+    x_err = np.where(valid, x_err, 1)
+    y_err = np.where(valid, 0 if y_err is None else y_err, 1)
+    m, b, var_m, var_b, _, chisq = york_linear(x, y, x_err, y_err, valid=valid)
+    w = valid / (y_err**2 + m[:, np.newaxis]**2*x_err**2)
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    redchi = chisq / (valid.sum(axis=-1) - 2)
+    ym = np.sum(w*y, axis=-1) / np.sum(w, axis=-1)
+    rsq = 1 - chisq / np.sum(w*(y - ym[:, np.newaxis])**2, axis=-1)
+    return LinearFits(m=m, m_err=np.sqrt(var_m*redchi), b=b, b_err=np.sqrt(var_b*redchi), redchi=redchi, rsq=rsq)
+
 def plot_linear_fit(x, y, m, b, x_err=None, y_err=None, redchi=None):
   """Plot the linear fit with error pars."""
+  import matplotlib.pyplot as plt
   if x_err is None:
     x_err = np.zeros(x.size)
   if y_err is None:
@@ -84,10 +294,10 @@ def plot_linear_fit(x, y, m, b, x_err=None, y_err=None, redchi=None):
 
   # Add fitted line and error band.
   x_fit = np.linspace(ax.get_xlim()[0], ax.get_xlim()[1], 101)
-  y_fit = linear_eqn(unumpy.uarray(x_fit, np.zeros(x_fit.size)), m, b)
-  ax.plot(x_fit, unumpy.nominal_values(y_fit), color=styles.COLORS[1], zorder=2)
-  ax.fill_between(x_fit, unumpy.nominal_values(y_fit)-unumpy.std_devs(y_fit), unumpy.nominal_values(y_fit)+unumpy.std_devs(y_fit), fc=styles.COLORS[1], ec=None, alpha=0.4, zorder=1)
-  # ax.fill_between(x_fit, unumpy.nominal_values(y_fit)-2*unumpy.std_devs(y_fit), unumpy.nominal_values(y_fit)+2*unumpy.std_devs(y_fit), fc=styles.COLORS[1], ec=None, alpha=0.1, zorder=1)
+  y_fit = linear_eqn(x_fit, UArray.from_ufloats(m), UArray.from_ufloats(b))
+  ax.plot(x_fit, y_fit.n, color=styles.COLORS[1], zorder=2)
+  ax.fill_between(x_fit, y_fit.n-y_fit.s, y_fit.n+y_fit.s, fc=styles.COLORS[1], ec=None, alpha=0.4, zorder=1)
+  # ax.fill_between(x_fit, y_fit.n-2*y_fit.s, y_fit.n+2*y_fit.s, fc=styles.COLORS[1], ec=None, alpha=0.1, zorder=1)
   ax.set_xlim(x_fit[0], x_fit[-1])
 
   # Add equation.
@@ -100,6 +310,7 @@ def plot_linear_fit(x, y, m, b, x_err=None, y_err=None, redchi=None):
 
 def plot_chi(x, y, m, b, x_err=None, y_err=None):
   """Plot chi values for each data point."""
+  import matplotlib.pyplot as plt
   # Sort data to ascending x.
   df = pd.DataFrame().from_dict({
     'x': x,
@@ -110,7 +321,7 @@ def plot_chi(x, y, m, b, x_err=None, y_err=None):
   df.sort_values('x', inplace=True)
 
   # Calculate chi values.
-  _m, _b = (m.n, b.n) if isinstance(m, un.UFloat) else (m, b)
+  _m, _b = (m.n, b.n) if hasattr(m, 'nominal_value') else (m, b)  # ufloats
   chi = df['y'] - linear_eqn(df['x'], _m, _b)
   if x_err is not None and y_err is not None:
     wt_sq = _m**2*x_err**2 + y_err**2
@@ -130,6 +341,7 @@ def plot_chi(x, y, m, b, x_err=None, y_err=None):
 
 
 if __name__ == '__main__':
+  import matplotlib.pyplot as plt
   import pandas as pd
 
   # Load data file.
@@ -0,0 +1,214 @@
+"""Memoization of analysis results.
+Notes:
+  Results are keyed by a hash of the arguments (array contents included) and kept in one memory-bounded LRU cache shared by all memoized functions.
+  Cached arrays are read-only copies and cached DataFrames are copied on every call, so callers can never modify a cached result.
+  Misses return the same read-only copies as hits.
+"""
+
+import collections
+from collections import namedtuple
+import copy
+import functools
+import hashlib
+import inspect
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+"""
+hits, misses: number of calls served from and missing in the cache
+entries: number of cached results
+nbytes: approximate size of the cached results (in bytes)
+max_bytes: size above which the least recently used results are evicted
+"""
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'entries', 'nbytes', 'max_bytes'])
+
+
+def _update_hash(h, value):
+  """Feed a value into a hashlib object. Arrays are hashed by dtype, shape and contents."""
+  if isinstance(value, np.ndarray):
+    h.update(f"nd{value.dtype.str}{value.shape}".encode())
+    if value.dtype.hasobject:
+      h.update(repr(value.tolist()).encode())
+    else:
+      h.update(np.ascontiguousarray(value).view(np.uint8))
+  elif isinstance(value, (pd.Series, pd.Index)):
+    h.update(f"pd{type(value).__name__}{value.name!r}".encode())
+    _update_hash(h, value.to_numpy())
+  elif isinstance(value, pd.DataFrame):
+    h.update(b'df')
+    _update_hash(h, list(value.columns))
+    for col in value.columns:
+      _update_hash(h, value[col].to_numpy())
+  elif isinstance(value, (list, tuple)):
+    h.update(f"{type(value).__name__}{len(value)}(".encode())
+    for v in value:
+      _update_hash(h, v)
+    h.update(b')')
+  elif isinstance(value, dict):
+    h.update(f"dict{len(value)}(".encode())
+    for k in sorted(value, key=repr):
+      _update_hash(h, k)
+      _update_hash(h, value[k])
+    h.update(b')')
+  else:
+    h.update(f"{type(value).__name__}:{value!r}".encode())
+
+
+def _nbytes(value):
+  """Approximate memory footprint of a result (in bytes)."""
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  if isinstance(value, (pd.DataFrame, pd.Series)):
+    return int(np.sum(value.memory_usage(deep=False)))
+  if isinstance(value, (list, tuple)):
+    return sys.getsizeof(value) + sum(_nbytes(v) for v in value)
+  if isinstance(value, dict):
+    return sys.getsizeof(value) + sum(_nbytes(v) for v in value.values())
+  return sys.getsizeof(value)
+
+
+def _freeze(value):
+  """Private copy of a result for the cache, with read-only arrays."""
+  if isinstance(value, np.ndarray):
+    value = value.copy()
+    value.flags.writeable = False
+    return value
+  if isinstance(value, (pd.DataFrame, pd.Series)):
+    return value.copy(deep=True)
+  if isinstance(value, (list, tuple)):
+    return type(value)(_freeze(v) for v in value)
+  if isinstance(value, dict):
+    return {k: _freeze(v) for k, v in value.items()}
+  return copy.copy(value)
+
+
+def _thaw(value):
+  """Result handed out by the cache. Arrays stay read-only views, DataFrames are copied."""
+  if isinstance(value, (pd.DataFrame, pd.Series)):
+    return value.copy(deep=True)
+  if isinstance(value, (list, tuple)):
+    return type(value)(_thaw(v) for v in value)
+  if isinstance(value, dict):
+    return {k: _thaw(v) for k, v in value.items()}
+  return value
+
+
+class ResultCache:
+  """Thread-safe LRU store of function results, bounded by their total size.
+  Args:
+    max_bytes (int): maximum total size (in bytes) of the cached results
+  """
+
+  def __init__(self, max_bytes=256*2**20):
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self._results = collections.OrderedDict()  # key: (value, nbytes, function name)
+    self._stats = collections.defaultdict(lambda: [0, 0])  # function name: [hits, misses]
+    self._lock = threading.Lock()
+
+  def get(self, key, name=None):
+    """Cached result.
+    Returns:
+      bool: whether the key was found
+      object: result, or None
+    """
+    with self._lock:
+      if key not in self._results:
+        self._stats[name][1] += 1
+        return False, None
+      self._results.move_to_end(key)
+      self._stats[name][0] += 1
+      return True, _thaw(self._results[key][0])
+
+  def put(self, key, value, name=None):
+    """Cache a result, evicting the least recently used ones. Results larger than the cache are not kept.
+    Returns:
+      object: private copy of the result with read-only arrays, as cached (see _freeze)
+    """
+    nbytes = _nbytes(value)
+    value = _freeze(value)
+    if nbytes > self.max_bytes:
+      return value
+    with self._lock:
+      if key in self._results:
+        self.nbytes -= self._results.pop(key)[1]
+      self._results[key] = (value, nbytes, name)
+      self.nbytes += nbytes
+      while self.nbytes > self.max_bytes:
+        _, (_, old_nbytes, _) = self._results.popitem(last=False)
+        self.nbytes -= old_nbytes
+    return value
+
+  def clear(self, name=None):
+    """Remove the results of one function, or all results if name is None, and reset the counters."""
+    with self._lock:
+      for key in [k for k, v in self._results.items() if name is None or v[2] == name]:
+        self.nbytes -= self._results.pop(key)[1]
+      if name is None:
+        self._stats.clear()
+      else:
+        self._stats.pop(name, None)
+
+  def cache_info(self, name=None):
+    """CacheInfo of one function, or of the whole cache if name is None."""
+    with self._lock:
+      if name is None:
+        hits, misses = (sum(s[i] for s in self._stats.values()) for i in range(2))
+        return CacheInfo(hits, misses, len(self._results), self.nbytes, self.max_bytes)
+      hits, misses = self._stats.get(name, (0, 0))
+      entries = [v[1] for v in self._results.values() if v[2] == name]
+      return CacheInfo(hits, misses, len(entries), sum(entries), self.max_bytes)
+
+
+"""Cache shared by the memoized analysis functions."""
+RESULTS = ResultCache()
+
+
+def memoize(func=None, cache=RESULTS, ignore=()):
+  """Decorator caching the results of a function, keyed by the hash of its arguments.
+  The decorated function also gets:
+    cache_key(*args, **kwargs): key of a call, e.g. to look up a result computed in another process
+    cache_get(key): (found, result)
+    cache_put(key, result): cache a result computed elsewhere (e.g. in a background job)
+    cache_info(): CacheInfo of the function
+    cache_clear(): remove the results of the function
+  Args:
+    func (callable): function to memoize. Its results must not depend on anything else than its arguments.
+    cache (ResultCache): cache holding the results
+    ignore (tuple): names of arguments left out of the key, e.g. a progress reporter
+  Examples:
+    @memoize
+    def fit(x, y, model='co2'): ...
+
+    @memoize(ignore=('progress',))
+    def fit(x, y, progress=None): ...
+  """
+  if func is None:
+    return functools.partial(memoize, cache=cache, ignore=ignore)
+  name = f"{func.__module__}.{func.__qualname__}"
+  sig = inspect.signature(func)
+
+  def cache_key(*args, **kwargs):
+    bound = sig.bind(*args, **kwargs)
+    bound.apply_defaults()
+    h = hashlib.sha256(name.encode())
+    _update_hash(h, {k: v for k, v in bound.arguments.items() if k not in ignore})
+    return h.hexdigest()
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    key = cache_key(*args, **kwargs)
+    found, result = cache.get(key, name)
+    if found:
+      return result
+    result = cache.put(key, func(*args, **kwargs), name)
+    return _thaw(result)  # Same as a hit, so callers see the same result whether it was cached or not.
+
+  wrapper.cache_key = cache_key
+  wrapper.cache_get = lambda key: cache.get(key, name)
+  wrapper.cache_put = lambda key, result: cache.put(key, result, name)
+  wrapper.cache_info = lambda: cache.cache_info(name)
+  wrapper.cache_clear = lambda: cache.clear(name)
+  return wrapper
@@ -0,0 +1,133 @@
+"""
+Plotly traces for large datasets.
+Curves are decimated server-side and drawn with WebGL above a size threshold.
+"""
+import numpy as np
+import plotly.graph_objects as go
+
+
+MAX_POINTS = 4000  # About two points per horizontal pixel of a wide graph.
+GL_THRESHOLD = 50000  # Number of points above which Scattergl is used.
+
+
+def minmax_indices(y, nbins):
+  """Indices of the minimum and maximum of y in each of nbins equal bins of consecutive samples.
+  Keeps every peak of a trace, which LTTB may skip.
+  Args:
+    y (array_like): y values in plotting order.
+    nbins (int): Number of bins, the result has at most 2*nbins+2 points.
+  Returns:
+    np.ndarray: sorted indices, including the first and last point.
+  """
+  y = np.asarray(y, dtype=float)
+  n = y.size
+  if n <= 2*nbins + 2:
+    return np.arange(n)
+  size = -(-n // nbins)
+  padded = np.full(nbins*size, np.nan)
+  padded[:n] = y
+  padded = padded.reshape(nbins, size)
+  valid = ~np.all(np.isnan(padded), axis=1)
+  offsets = size*np.arange(nbins)[valid]
+  imin = offsets + np.nanargmin(padded[valid], axis=1)
+  imax = offsets + np.nanargmax(padded[valid], axis=1)
+  return np.unique(np.concatenate([[0, n-1], imin, imax]))
+
+
+def lttb_indices(x, y, n_out):
+  """Indices selected by the Largest-Triangle-Three-Buckets algorithm.
+  Notes:
+    See Steinarsson, "Downsampling Time Series for Visual Representation" (2013).
+  Args:
+    x (array_like): x values in plotting order.
+    y (array_like): y values in plotting order.
+    n_out (int): Number of points to keep.
+  Returns:
+    np.ndarray: sorted indices, including the first and last point.
+  """
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  n = x.size
+  if n_out >= n or n_out < 3:
+    return np.arange(n)
+
+  """Buckets between the first and last points, and the mean of each bucket."""
+  edges = np.linspace(1, n-1, n_out-1).astype(int)
+  counts = np.diff(edges)
+  x_avg = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])
+  y_avg = np.append(np.add.reduceat(y[:-1], edges[:-1]) / counts, y[-1])
+
+  idx = np.empty(n_out, dtype=int)
+  idx[0], idx[-1] = 0, n-1
+  a = 0
+  for k in range(n_out-2):
+    lo, hi = edges[k], edges[k+1]
+    area = np.abs((x[a] - x_avg[k+1])*(y[lo:hi] - y[a]) - (x[a] - x[lo:hi])*(y_avg[k+1] - y[a]))
+    a = lo + np.argmax(area)
+    idx[k+1] = a
+  return idx
+
+
+def decimate(x, y, max_points=MAX_POINTS, method='minmax', x_range=None):
+  """Reduce a curve to at most about max_points points.
+  Args:
+    x (array_like): x values in plotting order.
+    y (array_like): y values in plotting order.
+    max_points (int, None): Number of points to keep. None keeps all points.
+    method (str): 'minmax' (extremes per bin) or 'lttb' (Largest-Triangle-Three-Buckets).
+    x_range (list, None): Only points with x in [xmin, xmax] are kept, e.g. the zoomed range of a graph.
+  Returns:
+    np.ndarray: decimated x values.
+    np.ndarray: decimated y values.
+  """
+  x = np.asarray(x)
+  y = np.asarray(y)
+  if x_range is not None:
+    mask = (x >= min(x_range)) & (x <= max(x_range))
+    x, y = x[mask], y[mask]
+  if max_points is None or x.size <= max_points:
+    return x, y
+  if method == 'minmax':
+    idx = minmax_indices(y, max_points//2 - 1)
+  elif method == 'lttb':
+    idx = lttb_indices(x, y, max_points)
+  else:
+    raise ValueError(f"Decimation method not implemented: {method}.")
+  return x[idx], y[idx]
+
+
+def build_scatter(x, y, max_points=MAX_POINTS, method='minmax', x_range=None, gl_threshold=GL_THRESHOLD, **kwargs):
+  """Scatter trace of a possibly very large curve.
+  Args:
+    x (array_like): x values in plotting order.
+    y (array_like): y values in plotting order.
+    max_points, method, x_range: See decimate.
+    gl_threshold (int): Number of points of the full curve above which a WebGL trace is used.
+    **kwargs: Passed to go.Scatter or go.Scattergl.
+  Returns:
+    go.Scatter or go.Scattergl: trace
+  """
+  npoints = np.size(x)
+  x, y = decimate(x, y, max_points=max_points, method=method, x_range=x_range)
+  trace = go.Scattergl if npoints > gl_threshold else go.Scatter
+  return trace(x=x, y=y, **kwargs)
+
+
+def zoom_range(relayout_data, axis='xaxis'):
+  """Axis range from the relayoutData of a dcc.Graph.
+  Args:
+    relayout_data (dict, None): relayoutData property.
+    axis (str): Axis name.
+  Returns:
+    bool: whether the event changed the axis range (zoom, pan or reset).
+    list: [min, max] of the zoomed range, or None if the axis is autoranged.
+  """
+  if not relayout_data:
+    return False, None
+  if f'{axis}.range[0]' in relayout_data:
+    return True, [relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']]
+  if f'{axis}.range' in relayout_data:
+    return True, list(relayout_data[f'{axis}.range'])
+  if f'{axis}.autorange' in relayout_data:
+    return True, None
+  return False, None
@@ -1,9 +1,6 @@
 """
 Plotting styles for the Velazquez Lab.
 """
-from cycler import cycler
-import matplotlib as mpl
-import matplotlib.colors as mcol
 import plotly.graph_objects as go
 import plotly.io as pio
 
@@ -45,6 +42,7 @@ def color_to_rgba(color, alpha=1, lib='plotly'):
   # if color[0] == '#':  # Hex string
     # rgb = pcol.hex_to_rgb(color)
   # else:
+  import matplotlib.colors as mcol
   rgb = mcol.to_rgba(color)[:3]
   if lib == 'plotly':
     return f"rgba({rgb[0]},{rgb[1]},{rgb[2]},{alpha})"
@@ -103,6 +101,9 @@ def set_matplotlib_style():
   Notes:
     See https://matplotlib.org/tutorials/introductory/customizing.html.
   """
+  from cycler import cycler
+  import matplotlib as mpl
+
   mpl.rcParams['font.size'] = 16
   mpl.rcParams['font.family'] = 'Arial'
   mpl.rcParams['font.weight'] = 700
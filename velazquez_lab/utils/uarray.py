@@ -0,0 +1,188 @@
+"""Arrays of values with uncertainties.
+Notes:
+  A UArray holds the nominal values and standard deviations as two NumPy arrays, and propagates them to first order
+  with vectorized expressions. unumpy arrays hold one Python object per element, which is orders of magnitude slower.
+  Unlike ufloats, correlations are not tracked: the operands of each operation are taken as independent.
+  This is exact for the expressions used here (e.g. fit parameters applied to data without errors), but x - x is not 0 +/- 0.
+  Variables sharing errors should be propagated in closed form instead, as in gas.mix_gases_many.
+  Where the first-order error is undefined (e.g. sqrt or a fractional power of 0 +/- 0.1), the error is NaN, as with ufloats.
+  Exact values (zero error) keep a zero error, e.g. sqrt of 0 +/- 0 is 0 +/- 0.
+"""
+
+import numpy as np
+
+
+def _parts(x):
+  """Nominal values and standard deviations of a UArray, ufloat(s) or plain number(s)."""
+  if isinstance(x, UArray):
+    return x.n, x.s
+  if hasattr(x, 'nominal_value') and hasattr(x, 'std_dev'):  # ufloat
+    return np.asarray(x.nominal_value, dtype=float), np.asarray(x.std_dev, dtype=float)
+  x = np.asarray(x)
+  if x.dtype == object:  # unumpy array
+    from uncertainties import unumpy as unp
+    return unp.nominal_values(x), unp.std_devs(x)
+  return x.astype(float, copy=False), np.zeros(())
+
+
+def _propagate(deriv, s):
+  """First-order error |deriv|*s. Zero errors stay zero, and infinite or undefined derivatives give NaN, without warnings."""
+  with np.errstate(invalid='ignore', over='ignore'):
+    return np.where(s == 0, 0.0, np.where(np.isfinite(deriv), np.abs(deriv)*s, np.nan))
+
+
+class UArray:
+  """Nominal values and standard deviations, with first-order error propagation.
+  Supports +, -, *, /, ** and abs with UArrays, ufloats and plain numbers or arrays, indexing, sum, mean,
+  and the functions sqrt, exp, log and log10 of this module.
+  Args:
+    nominal_values (array_like): nominal values
+    std_devs (array_like): standard deviations, broadcastable to nominal_values
+  Examples:
+    m = UArray(2.0, 0.1)
+    y = m*np.linspace(0, 1, 101) + UArray(0.5, 0.05)
+    ax.fill_between(x, y.n - y.s, y.n + y.s)
+  """
+
+  __array_ufunc__ = None  # NumPy arrays defer to the reflected operators below.
+
+  def __init__(self, nominal_values, std_devs=0):
+    n = np.asarray(nominal_values, dtype=float)
+    s = np.asarray(std_devs, dtype=float)
+    if s.shape != n.shape:
+      n, s = np.broadcast_arrays(n, s)
+    self.n, self.s = n, s
+
+  @classmethod
+  def from_ufloats(cls, values):
+    """UArray from a ufloat, a unumpy array, or plain numbers (with zero errors)."""
+    return cls(*_parts(values))
+
+  def to_ufloats(self):
+    """unumpy array (or ufloat for a scalar) with the same values and errors."""
+    import uncertainties as un
+    from uncertainties import unumpy as unp
+    if self.ndim == 0:
+      return un.ufloat(float(self.n), float(self.s))
+    return unp.uarray(self.n, self.s)
+
+  @property
+  def shape(self):
+    return self.n.shape
+
+  @property
+  def ndim(self):
+    return self.n.ndim
+
+  @property
+  def size(self):
+    return self.n.size
+
+  def __len__(self):
+    return len(self.n)
+
+  def __getitem__(self, key):
+    return UArray(self.n[key], self.s[key])
+
+  def __repr__(self):
+    return f"UArray(n={self.n!r}, s={self.s!r})"
+
+  def __str__(self):
+    if self.ndim == 0:
+      return f"{float(self.n):g}+/-{float(self.s):g}"
+    return f"UArray({self.n}, +/-{self.s})"
+
+  """Arithmetic."""
+  def __add__(self, other):
+    n, s = _parts(other)
+    return UArray(self.n + n, np.hypot(self.s, s))
+
+  __radd__ = __add__
+
+  def __sub__(self, other):
+    n, s = _parts(other)
+    return UArray(self.n - n, np.hypot(self.s, s))
+
+  def __rsub__(self, other):
+    n, s = _parts(other)
+    return UArray(n - self.n, np.hypot(self.s, s))
+
+  def __mul__(self, other):
+    n, s = _parts(other)
+    return UArray(self.n * n, np.hypot(self.s*n, self.n*s))
+
+  __rmul__ = __mul__
+
+  def __truediv__(self, other):
+    n, s = _parts(other)
+    val = self.n / n
+    return UArray(val, np.hypot(self.s, val*s) / np.abs(n))
+
+  def __rtruediv__(self, other):
+    n, s = _parts(other)
+    val = n / self.n
+    return UArray(val, np.hypot(s, val*self.s) / np.abs(self.n))
+
+  def __pow__(self, other):
+    n, s = _parts(other)
+    val = self.n ** n
+    with np.errstate(divide='ignore', invalid='ignore'):
+      d_self = _propagate(n * self.n**(n-1), self.s)
+      d_other = _propagate(val * np.log(np.abs(self.n)), s)
+    return UArray(val, np.hypot(d_self, d_other))
+
+  def __rpow__(self, other):
+    n, s = _parts(other)
+    return UArray(n, s) ** self
+
+  def __neg__(self):
+    return UArray(-self.n, self.s)
+
+  def __pos__(self):
+    return self
+
+  def __abs__(self):
+    return UArray(np.abs(self.n), self.s)
+
+  """Reductions."""
+  def sum(self, axis=None):
+    return UArray(np.sum(self.n, axis=axis), np.sqrt(np.sum(self.s**2, axis=axis)))
+
+  def mean(self, axis=None):
+    count = self.n.size if axis is None else self.n.shape[axis]
+    return self.sum(axis=axis) / count
+
+
+def nominal_values(x):
+  """Nominal values of a UArray, ufloat(s) or plain number(s)."""
+  return _parts(x)[0]
+
+
+def std_devs(x):
+  """Standard deviations of a UArray, ufloat(s) or plain number(s) (zero)."""
+  return np.broadcast_arrays(*_parts(x))[1]
+
+
+def sqrt(x):
+  n, s = _parts(x)
+  val = np.sqrt(n)
+  with np.errstate(divide='ignore'):
+    return UArray(val, _propagate(1 / (2*val), s))
+
+
+def exp(x):
+  n, s = _parts(x)
+  val = np.exp(n)
+  return UArray(val, val * s)
+
+
+def log(x):
+  n, s = _parts(x)
+  with np.errstate(divide='ignore'):
+    return UArray(np.log(n), _propagate(1 / n, s))
+
+
+def log10(x):
+  n, s = _parts(x)
+  with np.errstate(divide='ignore'):
+    return UArray(np.log10(n), _propagate(1 / (n*np.log(10)), s))